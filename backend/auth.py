@@ -1,16 +1,34 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
-from database import get_db
-from models import User
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_async_db, AsyncSessionLocal
+from models import User, UserRole
+from principal_cache import Principal, get_cached_principal, begin_principal_fill, cache_principal
 from config import settings
 
 # 密码加密上下文
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# 轮数固定为配置值，其它轮数的旧哈希在登录验证时视为需要更新
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=settings.bcrypt_rounds,
+    bcrypt__min_rounds=settings.bcrypt_rounds,
+    bcrypt__max_rounds=settings.bcrypt_rounds,
+)
+
+# 密码哈希专用线程池（bcrypt 计算期间释放 GIL），线程数即并发上限，
+# 避免 CPU 密集的哈希计算阻塞事件循环或占满默认线程池
+_password_executor = ThreadPoolExecutor(
+    max_workers=settings.password_hash_workers,
+    thread_name_prefix="password-hash"
+)
 
 # HTTP Bearer认证
 security = HTTPBearer()
@@ -23,6 +41,18 @@ def get_password_hash(password: str) -> str:
     """生成密码哈希"""
     return pwd_context.hash(password)
 
+async def verify_password_async(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """在密码哈希线程池中验证密码，返回 (是否通过, 需要更新时的新哈希)"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _password_executor, pwd_context.verify_and_update, plain_password, hashed_password
+    )
+
+async def get_password_hash_async(password: str) -> str:
+    """在密码哈希线程池中生成密码哈希"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_password_executor, pwd_context.hash, password)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """创建访问令牌"""
     to_encode = data.copy()
@@ -46,36 +76,89 @@ def verify_token(token: str) -> Optional[str]:
     except JWTError:
         return None
 
-def authenticate_user(db: Session, username: str, password: str) -> Optional[User]:
+async def authenticate_user(db: AsyncSession, username: str, password: str) -> Optional[User]:
     """认证用户"""
-    user = db.query(User).filter(User.username == username).first()
+    result = await db.execute(select(User).where(User.username == username))
+    user = result.scalar_one_or_none()
     if not user:
         return None
-    if not verify_password(password, user.hashed_password):
+    valid, new_hash = await verify_password_async(password, user.hashed_password)
+    if not valid:
         return None
+    # 登录成功时将旧轮数的哈希透明升级为当前配置
+    if new_hash and settings.password_rehash_on_login:
+        user.hashed_password = new_hash
+        await db.commit()
     return user
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)) -> User:
-    """获取当前用户"""
-    credentials_exception = HTTPException(
+def credentials_exception() -> HTTPException:
+    """认证失败异常"""
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: AsyncSession = Depends(get_async_db)) -> User:
+    """获取当前用户（数据库对象，需要修改用户信息的接口使用）"""
     token = credentials.credentials
     username = verify_token(token)
     if username is None:
-        raise credentials_exception
+        raise credentials_exception()
     
-    user = db.query(User).filter(User.username == username).first()
+    result = await db.execute(select(User).where(User.username == username))
+    user = result.scalar_one_or_none()
     if user is None:
-        raise credentials_exception
+        raise credentials_exception()
     
     return user
 
-def get_current_active_user(current_user: User = Depends(get_current_user)) -> User:
+async def get_current_active_user(current_user: User = Depends(get_current_user)) -> User:
     """获取当前活跃用户"""
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
-    return current_user
\ No newline at end of file
+    return current_user
+
+async def resolve_principal(username: str) -> Optional[Principal]:
+    """按用户名解析用户身份（优先读缓存，未命中时查询数据库并回填缓存）"""
+    if settings.principal_cache_enabled:
+        principal = await get_cached_principal(username)
+        if principal is not None:
+            return principal
+        # 在查询数据库之前记录失效代次，查询期间发生的失效会使本次回填作废
+        fill = await begin_principal_fill(username)
+    
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(User).where(User.username == username))
+        user = result.scalar_one_or_none()
+    if user is None:
+        return None
+    
+    principal = Principal.from_user(user)
+    if settings.principal_cache_enabled:
+        await cache_principal(principal, fill)
+    return principal
+
+async def get_current_principal(credentials: HTTPAuthorizationCredentials = Depends(security)) -> Principal:
+    """获取当前用户身份（只需要身份信息的接口使用，缓存命中时不访问数据库）"""
+    username = verify_token(credentials.credentials)
+    if username is None:
+        raise credentials_exception()
+    
+    principal = await resolve_principal(username)
+    if principal is None:
+        raise credentials_exception()
+    
+    return principal
+
+async def get_current_active_principal(principal: Principal = Depends(get_current_principal)) -> Principal:
+    """获取当前活跃用户身份"""
+    if not principal.is_active:
+        raise HTTPException(status_code=400, detail="Inactive user")
+    return principal
+
+async def get_current_admin_user(principal: Principal = Depends(get_current_active_principal)) -> Principal:
+    """获取当前管理员用户"""
+    if principal.role != UserRole.ADMIN:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+    return principal
\ No newline at end of file
@@ -0,0 +1,59 @@
+"""
+API 进程冷启动基准：导入 main（创建应用、注册路由）的耗时和导入后的常驻内存
+
+    python benchmarks/api_cold_start.py --runs 5
+
+每次在新的子进程中导入，同时列出已加载的 worker 侧依赖（火山引擎 SDK、PIL、boto3 等）。
+导入 main 时会执行 sync_schema，需要数据库可用。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 在子进程中执行：导入 main 并报告耗时、内存和已加载的重量级模块
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import main
+elapsed = time.perf_counter() - start
+rss_kb = 0
+with open("/proc/self/status") as f:
+    for line in f:
+        if line.startswith("VmRSS:"):
+            rss_kb = int(line.split()[1])
+heavy = ["volcengine", "PIL", "boto3", "tasks.image_age_transform", "tasks.volc_client"]
+print(json.dumps({
+    "import_ms": elapsed * 1000,
+    "rss_mb": rss_kb / 1024,
+    "modules": len(sys.modules),
+    "loaded": [name for name in heavy if name in sys.modules],
+}))
+"""
+
+
+def probe() -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    results = [probe() for _ in range(args.runs)]
+    print(f"导入 main: 中位数 {statistics.median(r['import_ms'] for r in results):.0f}ms, "
+          f"常驻内存 {statistics.median(r['rss_mb'] for r in results):.1f}MB, "
+          f"模块数 {results[-1]['modules']}")
+    print(f"已加载的 worker 侧依赖: {', '.join(results[-1]['loaded']) or '无'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""基准测试公共工具"""
+import asyncio
+import statistics
+import time
+
+
+def percentile(values, pct):
+    """计算百分位数（最近秩法）"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+async def run_concurrently(request, total: int, concurrency: int):
+    """
+    以固定并发数执行 total 次请求
+    :param request: 无参协程函数，返回 HTTP 响应
+    :return: (耗时秒数, 各请求延迟毫秒列表, 失败数)
+    """
+    latencies = []
+    errors = 0
+    remaining = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            start = time.perf_counter()
+            resp = await request()
+            latencies.append((time.perf_counter() - start) * 1000)
+            if resp.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - started, latencies, errors
+
+
+def report(total: int, concurrency: int, elapsed: float, latencies, errors: int):
+    """输出吞吐量与延迟统计"""
+    print(f"请求数: {total}  并发: {concurrency}  失败: {errors}")
+    print(f"耗时: {elapsed:.2f}s  吞吐量: {total / elapsed:.1f} req/s")
+    print(
+        "延迟(ms): mean={:.1f} p50={:.1f} p95={:.1f} p99={:.1f} max={:.1f}".format(
+            statistics.mean(latencies),
+            percentile(latencies, 50),
+            percentile(latencies, 95),
+            percentile(latencies, 99),
+            max(latencies),
+        )
+    )
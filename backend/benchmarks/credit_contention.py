@@ -0,0 +1,66 @@
+"""
+积分扣费并发竞争基准测试
+
+多个并发提交者对同一用户调用 POST /api/tasks/，统计吞吐量与延迟，并校验积分一致性：
+成功创建的任务数 × 单价 必须等于余额减少量，且余额不能为负。
+
+用法:
+
+    uvicorn main:app --workers 1 --port 8000
+    python benchmarks/credit_contention.py --username testuser --password test123 \
+        --service-id 1 --requests 500 --concurrency 50
+"""
+import argparse
+import asyncio
+
+import httpx
+
+from common import report, run_concurrently
+
+
+async def run(args):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=60) as client:
+        resp = await client.post("/api/auth/login", json={"username": args.username, "password": args.password})
+        resp.raise_for_status()
+        headers = {"Authorization": f"Bearer {resp.json()['access_token']}"}
+
+        service = (await client.get(f"/api/services/{args.service_id}")).json()
+        before = (await client.get("/api/users/credits", headers=headers)).json()["credits"]
+
+        created = 0
+
+        async def submit():
+            nonlocal created
+            resp = await client.post(
+                "/api/tasks/",
+                headers=headers,
+                json={"service_id": args.service_id, "input_data": "{}"},
+            )
+            if resp.status_code == 200:
+                created += 1
+            return resp
+
+        elapsed, latencies, errors = await run_concurrently(submit, args.requests, args.concurrency)
+        after = (await client.get("/api/users/credits", headers=headers)).json()["credits"]
+
+    report(args.requests, args.concurrency, elapsed, latencies, errors)
+    charged = before - after
+    expected = created * service["cost_credits"]
+    print(f"积分: {before} -> {after}  成功任务: {created}  被拒绝: {errors}")
+    print("一致性校验: " + ("通过" if charged == expected and after >= 0 else f"失败（扣除 {charged}，应扣 {expected}）"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="积分扣费并发竞争基准测试")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--username", default="testuser")
+    parser.add_argument("--password", default="test123")
+    parser.add_argument("--service-id", type=int, default=1)
+    parser.add_argument("--requests", type=int, default=500, help="总提交数")
+    parser.add_argument("--concurrency", type=int, default=50, help="并发提交者数量")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
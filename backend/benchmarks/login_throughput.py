@@ -0,0 +1,72 @@
+"""
+并发登录吞吐量基准测试
+
+同时以固定间隔探测 /health 的延迟：若密码哈希阻塞事件循环，探测延迟会随登录并发明显上升。
+
+用法（单 worker 启动服务后运行）:
+
+    uvicorn main:app --workers 1 --port 8000
+    python benchmarks/login_throughput.py --username testuser --password test123 \
+        --requests 200 --concurrency 20
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+from common import percentile, report, run_concurrently
+
+
+async def probe_health(client: httpx.AsyncClient, stop: asyncio.Event, interval: float):
+    """登录压测期间周期性请求 /health，返回延迟列表（毫秒）"""
+    latencies = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        await client.get("/health")
+        latencies.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(interval)
+    return latencies
+
+
+async def run(args):
+    limits = httpx.Limits(max_connections=args.concurrency + 1, max_keepalive_connections=args.concurrency + 1)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=60) as client:
+        payload = {"username": args.username, "password": args.password}
+        # 预热（同时触发可能的哈希升级）
+        (await client.post("/api/auth/login", json=payload)).raise_for_status()
+
+        stop = asyncio.Event()
+        probe = asyncio.create_task(probe_health(client, stop, args.probe_interval))
+        elapsed, latencies, errors = await run_concurrently(
+            lambda: client.post("/api/auth/login", json=payload),
+            args.requests,
+            args.concurrency,
+        )
+        stop.set()
+        probe_latencies = await probe
+
+    report(args.requests, args.concurrency, elapsed, latencies, errors)
+    if probe_latencies:
+        print(
+            "/health 探测延迟(ms): p50={:.1f} p99={:.1f} max={:.1f}".format(
+                percentile(probe_latencies, 50),
+                percentile(probe_latencies, 99),
+                max(probe_latencies),
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="并发登录吞吐量基准测试")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--username", default="testuser")
+    parser.add_argument("--password", default="test123")
+    parser.add_argument("--requests", type=int, default=200, help="总请求数")
+    parser.add_argument("--concurrency", type=int, default=20, help="并发连接数")
+    parser.add_argument("--probe-interval", type=float, default=0.05, help="/health 探测间隔（秒）")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
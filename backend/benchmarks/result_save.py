@@ -0,0 +1,99 @@
+"""
+结果图片保存基准：改动前的“解码 + PIL 重新编码为 PNG”与直接写入接口返回字节的对比
+
+    python benchmarks/result_save.py --image ./sample.jpg --runs 20
+    python benchmarks/result_save.py --image ./sample.png --runs 20
+
+--image 作为火山引擎返回的结果图片（按原格式 base64 编码），不指定时生成一张 1024x1024 的合成 JPEG。
+输出每个任务的写入字节数、耗时和 CPU 时间。
+"""
+import argparse
+import base64
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image  # noqa: E402
+from storage import LocalStorage  # noqa: E402
+from tasks.image_processing import prepare_result_image  # noqa: E402
+
+
+def synthetic_result(size: int) -> bytes:
+    """生成带细节的合成图片（纯色图会让 PNG 编码快得不真实）"""
+    img = Image.effect_noise((size, size), 40).convert("RGB")
+    img = Image.blend(img, Image.linear_gradient("L").resize((size, size)).convert("RGB"), 0.5)
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def legacy_save(result_base64: str, output_stem: str):
+    """改动前的保存方式：解码后用 PIL 打开并重新编码为 PNG"""
+    binary_data = base64.b64decode(result_base64)
+    path = f"{output_stem}.png"
+    with Image.open(io.BytesIO(binary_data)) as image:
+        image.save(path)
+    return path
+
+
+def new_save(result_base64: str, output_stem: str):
+    """当前的保存方式：校验文件头后直接写入接口返回的字节（临时文件 + 原子重命名）"""
+    data, extension, _ = prepare_result_image(result_base64)
+    path = f"{output_stem}.{extension}"
+    LocalStorage("/").put_bytes(path, data)
+    return path
+
+
+def measure(save, result_base64: str, directory: str, runs: int) -> dict:
+    wall, cpu, written = [], [], []
+    for i in range(runs):
+        stem = os.path.join(directory, f"{save.__name__}_{i}")
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        path = save(result_base64, stem)
+        wall.append((time.perf_counter() - start) * 1000)
+        cpu.append((time.process_time() - cpu_start) * 1000)
+        written.append(os.path.getsize(path))
+        os.remove(path)
+    return {
+        "bytes": statistics.mean(written),
+        "wall_ms": statistics.mean(wall),
+        "cpu_ms": statistics.mean(cpu),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image", help="作为接口返回结果的图片文件")
+    parser.add_argument("--size", type=int, default=1024, help="未指定 --image 时合成图片的边长")
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.image:
+        with open(args.image, "rb") as f:
+            data = f.read()
+    else:
+        data = synthetic_result(args.size)
+    result_base64 = base64.b64encode(data).decode("ascii")
+    with Image.open(io.BytesIO(data)) as img:
+        print(f"结果图片: {img.format} {img.width}x{img.height}, {len(data)} 字节, 每种方式 {args.runs} 次")
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = {
+            "重新编码 PNG（改动前）": measure(legacy_save, result_base64, directory, args.runs),
+            "直接写入原始字节": measure(new_save, result_base64, directory, args.runs),
+        }
+
+    for name, r in results.items():
+        print(f"{name:<24} 写入 {r['bytes']:>10.0f} 字节  耗时 {r['wall_ms']:>8.1f}ms  CPU {r['cpu_ms']:>8.1f}ms")
+    legacy, new = results.values()
+    print(f"每个任务节省 CPU {legacy['cpu_ms'] - new['cpu_ms']:.1f}ms，少写入 {legacy['bytes'] - new['bytes']:.0f} 字节")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+任务列表深分页基准测试：offset 分页与游标分页在不同页深度下的延迟对比
+
+先为测试用户灌入大量任务（仅支持 PostgreSQL，使用 generate_series 批量插入），
+再对每个页深度分别以 offset 和 cursor 请求 GET /api/tasks/，游标分页的耗时应与页深度无关。
+
+用法:
+
+    uvicorn main:app --workers 1 --port 8000
+    python benchmarks/task_list_paging.py --username testuser --password test123 \
+        --seed 2000000 --depths 0,100,1000,10000,50000 --repeat 20
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+import httpx
+from sqlalchemy import text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import engine  # noqa: E402
+from pagination import encode_cursor  # noqa: E402
+
+SEED_SQL = text("""
+    INSERT INTO tasks (user_id, service_id, status, input_data, output_data, credits_used, created_at)
+    SELECT :user_id, :service_id, 'COMPLETED', '{}', '{}', 0,
+           now() - make_interval(secs => i + :start)
+    FROM generate_series(1, :count) AS i
+""")
+
+
+def seed_tasks(username: str, service_id: int, count: int, batch_size: int = 200000):
+    """为用户批量插入已完成任务"""
+    with engine.begin() as conn:
+        user_id = conn.execute(text("SELECT id FROM users WHERE username = :u"), {"u": username}).scalar_one()
+        existing = conn.execute(text("SELECT count(*) FROM tasks WHERE user_id = :u"), {"u": user_id}).scalar_one()
+
+    inserted = 0
+    while inserted < count:
+        batch = min(batch_size, count - inserted)
+        with engine.begin() as conn:
+            conn.execute(SEED_SQL, {
+                "user_id": user_id,
+                "service_id": service_id,
+                "start": existing + inserted,
+                "count": batch,
+            })
+        inserted += batch
+        print(f"已插入 {inserted}/{count}")
+
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE tasks"))
+
+
+def cursor_at(username: str, position: int) -> str:
+    """取第 position 条任务（按列表顺序）之前一条的游标，不计入耗时"""
+    if position == 0:
+        return None
+    with engine.connect() as conn:
+        row = conn.execute(text("""
+            SELECT t.created_at, t.id FROM tasks t JOIN users u ON u.id = t.user_id
+            WHERE u.username = :u
+            ORDER BY t.created_at DESC, t.id DESC
+            OFFSET :o LIMIT 1
+        """), {"u": username, "o": position - 1}).one()
+    return encode_cursor(row.created_at, row.id)
+
+
+async def measure(client: httpx.AsyncClient, headers: dict, params: dict, repeat: int) -> float:
+    """重复请求同一页，返回延迟中位数（毫秒）"""
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        resp = await client.get("/api/tasks/", headers=headers, params=params)
+        resp.raise_for_status()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return statistics.median(latencies)
+
+
+async def run(args):
+    if args.seed:
+        seed_tasks(args.username, args.service_id, args.seed)
+
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=120) as client:
+        resp = await client.post("/api/auth/login", json={"username": args.username, "password": args.password})
+        resp.raise_for_status()
+        headers = {"Authorization": f"Bearer {resp.json()['access_token']}"}
+
+        print(f"{'page':>8} {'offset p50(ms)':>16} {'cursor p50(ms)':>16}")
+        for depth in (int(d) for d in args.depths.split(",")):
+            position = depth * args.limit
+            offset_ms = await measure(client, headers, {"limit": args.limit, "offset": position}, args.repeat)
+
+            params = {"limit": args.limit}
+            cursor = cursor_at(args.username, position)
+            if cursor:
+                params["cursor"] = cursor
+            cursor_ms = await measure(client, headers, params, args.repeat)
+            print(f"{depth:>8} {offset_ms:>16.1f} {cursor_ms:>16.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="任务列表 offset / cursor 分页延迟对比")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--username", default="testuser")
+    parser.add_argument("--password", default="test123")
+    parser.add_argument("--service-id", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0, help="测试前为用户插入的任务数，0 表示不插入")
+    parser.add_argument("--depths", default="0,10,100,1000,10000", help="逗号分隔的页序号")
+    parser.add_argument("--limit", type=int, default=20, help="每页任务数")
+    parser.add_argument("--repeat", type=int, default=10, help="每个页深度的请求次数")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
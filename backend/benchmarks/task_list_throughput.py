@@ -0,0 +1,57 @@
+"""
+并发 GET /api/tasks/ 吞吐量基准测试
+
+用法（单 worker 启动服务后运行，分别在改动前后的提交上各跑一次进行对比）:
+
+    uvicorn main:app --workers 1 --port 8000
+    python benchmarks/task_list_throughput.py --username testuser --password test123 \
+        --requests 2000 --concurrency 50
+"""
+import argparse
+import asyncio
+
+import httpx
+
+from common import report, run_concurrently
+
+
+async def login(client: httpx.AsyncClient, username: str, password: str) -> str:
+    """登录并返回访问令牌"""
+    resp = await client.post("/api/auth/login", json={"username": username, "password": password})
+    resp.raise_for_status()
+    return resp.json()["access_token"]
+
+
+async def run(args):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=60) as client:
+        token = await login(client, args.username, args.password)
+        headers = {"Authorization": f"Bearer {token}"}
+        params = {"limit": args.limit}
+
+        # 预热
+        for _ in range(min(20, args.requests)):
+            await client.get("/api/tasks/", headers=headers, params=params)
+
+        elapsed, latencies, errors = await run_concurrently(
+            lambda: client.get("/api/tasks/", headers=headers, params=params),
+            args.requests,
+            args.concurrency,
+        )
+
+    report(args.requests, args.concurrency, elapsed, latencies, errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="并发 GET /api/tasks/ 吞吐量基准测试")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--username", default="testuser")
+    parser.add_argument("--password", default="test123")
+    parser.add_argument("--requests", type=int, default=1000, help="总请求数")
+    parser.add_argument("--concurrency", type=int, default=50, help="并发连接数")
+    parser.add_argument("--limit", type=int, default=20, help="每次请求返回的任务数")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+火山引擎客户端单次调用延迟基准：每次调用新建客户端 vs 进程内复用连接池客户端
+
+需先启动本地模拟服务（见 volc_stub.py），HTTPS 模式下可观察 TLS 握手的开销:
+
+    python benchmarks/volc_stub.py --port 9100 --certfile /tmp/stub.crt --keyfile /tmp/stub.key
+    python benchmarks/volc_client_latency.py --host localhost:9100 --scheme https --cafile /tmp/stub.crt --calls 200
+"""
+import argparse
+import base64
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import percentile  # noqa: E402
+from config import settings  # noqa: E402
+from tasks.volc_client import get_volc_client  # noqa: E402
+from volcengine.visual.VisualService import VisualService  # noqa: E402
+
+
+def fresh_client(cafile: str) -> VisualService:
+    """改动前的行为：每个任务新建客户端（新的 Session，重新建立连接）"""
+    client = VisualService()
+    client.set_ak(settings.volc_access_key)
+    client.set_sk(settings.volc_secret_key)
+    client.set_host(settings.volc_host)
+    client.set_scheme(settings.volc_scheme)
+    if cafile:
+        client.session.verify = cafile
+    return client
+
+
+def measure(get_client, form: dict, calls: int) -> list:
+    latencies = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        resp = get_client().cv_process(form)
+        latencies.append((time.perf_counter() - start) * 1000)
+        if resp.get("code") != 10000:
+            raise RuntimeError(f"调用失败: {resp}")
+    return latencies
+
+
+def print_stats(name: str, latencies: list):
+    print(
+        f"{name:<10} p50 {statistics.median(latencies):7.2f}ms  "
+        f"p95 {percentile(latencies, 95):7.2f}ms  p99 {percentile(latencies, 99):7.2f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="火山引擎客户端单次调用延迟对比")
+    parser.add_argument("--host", default="localhost:9100", help="模拟服务地址")
+    parser.add_argument("--scheme", default="http", choices=["http", "https"])
+    parser.add_argument("--cafile", help="模拟服务使用自签名证书时指定该证书")
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--payload-kb", type=int, default=200, help="提交的图片大小")
+    args = parser.parse_args()
+
+    settings.volc_host = args.host
+    settings.volc_scheme = args.scheme
+    settings.volc_access_key = settings.volc_access_key or "benchmark"
+    settings.volc_secret_key = settings.volc_secret_key or "benchmark"
+
+    form = {
+        "req_key": settings.image_age_transform_req_key,
+        "target_age": 60,
+        "binary_data_base64": [base64.b64encode(os.urandom(args.payload_kb * 1024)).decode()],
+    }
+
+    print_stats("per-call", measure(lambda: fresh_client(args.cafile), form, args.calls))
+
+    pooled = get_volc_client()
+    if args.cafile:
+        pooled.session.verify = args.cafile
+    print_stats("pooled", measure(lambda: pooled, form, args.calls))
+
+
+if __name__ == "__main__":
+    main()
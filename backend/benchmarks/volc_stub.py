@@ -0,0 +1,90 @@
+"""
+火山引擎 CVProcess 接口的本地模拟服务，用于离线压测 worker 与客户端
+
+收到请求后等待 --latency-ms 毫秒，原样返回提交的图片作为结果。支持 HTTP/1.1 keep-alive，
+提供证书时以 HTTPS 监听（可用 openssl 生成自签名证书）：
+
+    openssl req -x509 -newkey rsa:2048 -nodes -days 1 -subj /CN=localhost \
+        -addext subjectAltName=DNS:localhost -keyout /tmp/stub.key -out /tmp/stub.crt
+    python benchmarks/volc_stub.py --port 9100 --latency-ms 200 --certfile /tmp/stub.crt --keyfile /tmp/stub.key
+
+worker 指向模拟服务:
+
+    VOLC_HOST=localhost:9100 VOLC_SCHEME=http VOLC_ACCESS_KEY=test VOLC_SECRET_KEY=test \
+        celery -A tasks worker
+"""
+import argparse
+import json
+import socket
+import ssl
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+    connections = 0
+    lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        # 响应头和响应体分两次写出，关闭 Nagle 以免与客户端延迟确认叠加出 40ms 等待
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with StubHandler.lock:
+            StubHandler.connections += 1
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            form = json.loads(body)
+            images = form.get("binary_data_base64") or [""]
+            payload = {"code": 10000, "message": "Success", "data": {"binary_data_base64": images[:1]}}
+        except ValueError:
+            payload = {"code": 50000, "message": "invalid json", "data": None}
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        data = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="火山引擎 CVProcess 模拟服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=0, help="模拟的接口处理耗时")
+    parser.add_argument("--certfile", help="HTTPS 证书")
+    parser.add_argument("--keyfile", help="HTTPS 私钥")
+    args = parser.parse_args()
+
+    StubHandler.latency = args.latency_ms / 1000
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    server.daemon_threads = True
+    scheme = "http"
+    if args.certfile:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(args.certfile, args.keyfile)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        scheme = "https"
+
+    print(f"模拟服务已启动: {scheme}://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"累计建立连接数: {StubHandler.connections}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Celery worker 吞吐量基准：prefork 与 I/O 模式（threads 池）对比
+
+先启动带延迟的火山引擎模拟服务，再以不同模式启动 worker（每次只运行一个 worker）:
+
+    python benchmarks/volc_stub.py --port 9100 --latency-ms 500
+    export VOLC_HOST=localhost:9100 VOLC_SCHEME=http VOLC_ACCESS_KEY=test VOLC_SECRET_KEY=test
+
+    celery -A tasks.celery worker --pool prefork --concurrency 4
+    celery -A tasks.celery worker --pool threads --concurrency 64
+
+    python benchmarks/worker_throughput.py --username testuser --image ./sample.jpg --tasks 200
+
+脚本直接写入任务记录并投递到队列，不经过 API，也不扣除积分。
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import SessionLocal  # noqa: E402
+from models import Service, Task, TaskStatus, User  # noqa: E402
+from tasks.image_age_transform import process_image_age_transform  # noqa: E402
+
+
+def create_tasks(username: str, image_path: str, count: int) -> list:
+    """为用户创建待处理任务（不扣积分、不走结果缓存）"""
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.username == username).one()
+        service = db.query(Service).filter(Service.name == "图片年龄变换").first() or db.query(Service).first()
+        tasks = [
+            Task(
+                user_id=user.id,
+                service_id=service.id,
+                status=TaskStatus.PENDING,
+                input_data=json.dumps({"image_path": image_path, "target_age": 60}),
+                credits_used=0,
+            )
+            for _ in range(count)
+        ]
+        db.add_all(tasks)
+        db.commit()
+        return [task.id for task in tasks]
+    finally:
+        db.close()
+
+
+def count_finished(task_ids: list) -> int:
+    db = SessionLocal()
+    try:
+        return db.query(Task).filter(
+            Task.id.in_(task_ids),
+            Task.status.in_([TaskStatus.COMPLETED, TaskStatus.FAILED])
+        ).count()
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Celery worker 吞吐量基准")
+    parser.add_argument("--username", default="testuser")
+    parser.add_argument("--image", required=True, help="任务使用的图片（worker 需能访问同一路径）")
+    parser.add_argument("--tasks", type=int, default=200)
+    parser.add_argument("--timeout", type=float, default=600)
+    args = parser.parse_args()
+
+    task_ids = create_tasks(args.username, os.path.abspath(args.image), args.tasks)
+    start = time.perf_counter()
+    for task_id in task_ids:
+        process_image_age_transform.delay(task_id)
+
+    finished = 0
+    while finished < len(task_ids) and time.perf_counter() - start < args.timeout:
+        time.sleep(0.5)
+        finished = count_finished(task_ids)
+    elapsed = time.perf_counter() - start
+
+    print(f"完成任务: {finished}/{len(task_ids)}")
+    print(f"耗时: {elapsed:.1f}s")
+    print(f"吞吐量: {finished / elapsed:.2f} 任务/秒")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+from redis.exceptions import RedisError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from config import settings
+from models import Service, ServiceTag
+from redis_client import get_redis, get_async_redis
+from schemas import ServiceResponse, ServiceTagResponse
+
+logger = logging.getLogger(__name__)
+
+# 服务目录版本号，服务或标签变更时递增，各进程据此判断本地快照是否过期
+VERSION_KEY = "aigc:catalog:version"
+
+@dataclass
+class CatalogSnapshot:
+    """服务目录（全部服务及标签）的只读快照"""
+    version: Optional[int]
+    services: List[ServiceResponse]
+    tags: List[ServiceTagResponse]
+    etag: str
+    loaded_at: float
+    by_id: Dict[int, ServiceResponse] = field(default_factory=dict)
+    by_name: Dict[str, ServiceResponse] = field(default_factory=dict)
+
+_snapshot: Optional[CatalogSnapshot] = None
+_checked_at = 0.0
+_lock = asyncio.Lock()
+
+async def _current_version() -> Optional[int]:
+    try:
+        value = await get_async_redis().get(VERSION_KEY)
+    except RedisError as e:
+        logger.warning(f"读取服务目录版本失败: {e}")
+        return None
+    return int(value or 0)
+
+async def _load(db: AsyncSession, version: Optional[int]) -> CatalogSnapshot:
+    result = await db.execute(select(Service).options(selectinload(Service.tag)).order_by(Service.id))
+    services = [ServiceResponse.model_validate(service) for service in result.scalars().all()]
+    result = await db.execute(select(ServiceTag).order_by(ServiceTag.id))
+    tags = [ServiceTagResponse.model_validate(tag) for tag in result.scalars().all()]
+
+    # ETag 由内容计算，Redis 不可用（没有版本号）时同样有效
+    payload = json.dumps({
+        "services": [service.model_dump(mode="json") for service in services],
+        "tags": [tag.model_dump(mode="json") for tag in tags],
+    }, sort_keys=True)
+    snapshot = CatalogSnapshot(
+        version=version,
+        services=services,
+        tags=tags,
+        etag=f'"{hashlib.sha256(payload.encode()).hexdigest()[:32]}"',
+        loaded_at=time.monotonic(),
+    )
+    for service in services:
+        snapshot.by_id[service.id] = service
+        # 与原先按名称查询的 first() 保持一致：同名时取 ID 最小的
+        snapshot.by_name.setdefault(service.name, service)
+    return snapshot
+
+def _is_fresh(snapshot: Optional[CatalogSnapshot], now: float) -> bool:
+    return (
+        snapshot is not None
+        and now - _checked_at < settings.catalog_cache_version_check_seconds
+        and now - snapshot.loaded_at < settings.catalog_cache_max_age_seconds
+    )
+
+async def get_catalog(db: AsyncSession) -> CatalogSnapshot:
+    """
+    获取服务目录快照
+    每隔 catalog_cache_version_check_seconds 检查一次 Redis 中的版本号，版本变化时重新加载；
+    超过 catalog_cache_max_age_seconds 时无论版本是否变化都重新加载（兜底直接修改数据库的情况）
+    """
+    global _snapshot, _checked_at
+    if not settings.catalog_cache_enabled:
+        return await _load(db, None)
+
+    if _is_fresh(_snapshot, time.monotonic()):
+        return _snapshot
+
+    async with _lock:
+        if _is_fresh(_snapshot, time.monotonic()):
+            return _snapshot
+
+        # 先读版本号再加载数据：加载期间发生的变更会让版本号变化，下次检查时再次加载
+        version = await _current_version()
+        now = time.monotonic()
+        snapshot = _snapshot
+        if (
+            snapshot is None
+            or version is None
+            or version != snapshot.version
+            or now - snapshot.loaded_at >= settings.catalog_cache_max_age_seconds
+        ):
+            snapshot = _snapshot = await _load(db, version)
+        _checked_at = now
+        return snapshot
+
+async def find_service(db: AsyncSession, service_id: int) -> Optional[ServiceResponse]:
+    """按 ID 查找服务（使用目录缓存）"""
+    return (await get_catalog(db)).by_id.get(service_id)
+
+async def find_service_by_name(db: AsyncSession, name: str) -> Optional[ServiceResponse]:
+    """按名称查找服务（使用目录缓存）"""
+    return (await get_catalog(db)).by_name.get(name)
+
+async def bump_catalog_version():
+    """服务或标签变更后使各进程的目录缓存失效（API 进程使用）"""
+    global _snapshot
+    _snapshot = None
+    try:
+        await get_async_redis().incr(VERSION_KEY)
+    except RedisError as e:
+        logger.warning(f"更新服务目录版本失败: {e}")
+
+def bump_catalog_version_sync():
+    """服务或标签变更后使各进程的目录缓存失效（初始化脚本等同步代码使用）"""
+    try:
+        get_redis().incr(VERSION_KEY)
+    except RedisError as e:
+        logger.warning(f"更新服务目录版本失败: {e}")
@@ -0,0 +1,113 @@
+import logging
+from typing import Optional
+from sqlalchemy import update, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from models import User, Task, TaskBatch, CreditLedger, CreditReason
+
+logger = logging.getLogger(__name__)
+
+def _charge_statement(user_id: int, amount: int):
+    # 条件扣减：余额不足时不更新任何行，避免读-改-写竞争
+    return (
+        update(User)
+        .where(User.id == user_id, User.credits >= amount)
+        .values(credits=User.credits - amount)
+        .returning(User.credits)
+    )
+
+def _credit_statement(user_id: int, amount: int):
+    return (
+        update(User)
+        .where(User.id == user_id)
+        .values(credits=User.credits + amount)
+        .returning(User.credits)
+    )
+
+async def charge_task(db: AsyncSession, user_id: int, task: Task) -> Optional[int]:
+    """
+    为任务扣除积分并记录流水（不提交，由调用方与任务写入在同一事务中提交）
+    :return: 扣除后的余额，余额不足时返回 None
+    """
+    result = await db.execute(_charge_statement(user_id, task.credits_used))
+    balance = result.scalar_one_or_none()
+    if balance is None:
+        return None
+
+    await db.flush()
+    db.add(CreditLedger(
+        user_id=user_id,
+        delta=-task.credits_used,
+        balance_after=balance,
+        reason=CreditReason.TASK_CHARGE,
+        task_id=task.id
+    ))
+    return balance
+
+async def charge_batch(db: AsyncSession, user_id: int, batch: TaskBatch) -> Optional[int]:
+    """
+    为整个批次一次性扣除积分并记录一条流水（不提交）
+    批次内任务失败时仍按任务逐个退款
+    :return: 扣除后的余额，余额不足时返回 None
+    """
+    result = await db.execute(_charge_statement(user_id, batch.credits_used))
+    balance = result.scalar_one_or_none()
+    if balance is None:
+        return None
+
+    await db.flush()
+    db.add(CreditLedger(
+        user_id=user_id,
+        delta=-batch.credits_used,
+        balance_after=balance,
+        reason=CreditReason.TASK_CHARGE,
+        batch_id=batch.id
+    ))
+    return balance
+
+async def add_credits(
+    db: AsyncSession,
+    user_id: int,
+    amount: int,
+    reason: CreditReason,
+    payment_id: Optional[int] = None
+) -> int:
+    """增加积分并记录流水（不提交），返回增加后的余额"""
+    result = await db.execute(_credit_statement(user_id, amount))
+    balance = result.scalar_one()
+    db.add(CreditLedger(
+        user_id=user_id,
+        delta=amount,
+        balance_after=balance,
+        reason=reason,
+        payment_id=payment_id
+    ))
+    return balance
+
+def refund_task(db: Session, task: Task) -> Optional[int]:
+    """
+    退还失败任务的积分并记录流水（Celery worker 使用，不提交）
+    同一任务只会退款一次，已退款时返回 None
+    """
+    if not task.credits_used:
+        return None
+
+    refunded = db.execute(
+        select(CreditLedger.id).where(
+            CreditLedger.task_id == task.id,
+            CreditLedger.reason == CreditReason.TASK_REFUND
+        )
+    ).first()
+    if refunded:
+        return None
+
+    balance = db.execute(_credit_statement(task.user_id, task.credits_used)).scalar_one()
+    db.add(CreditLedger(
+        user_id=task.user_id,
+        delta=task.credits_used,
+        balance_after=balance,
+        reason=CreditReason.TASK_REFUND,
+        task_id=task.id
+    ))
+    logger.info(f"任务 {task.id} 失败，已退还 {task.credits_used} 积分")
+    return balance
@@ -1,9 +1,21 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text, update
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import sessionmaker, Session
 from config import settings
+from metrics import instrument_engine
 
-# 创建数据库引擎
+def to_async_database_url(url: str) -> str:
+    """将同步数据库URL转换为对应的异步驱动URL"""
+    if url.startswith("postgresql+asyncpg://") or url.startswith("sqlite+aiosqlite://"):
+        return url
+    if url.startswith("postgresql://") or url.startswith("postgresql+psycopg2://"):
+        return "postgresql+asyncpg://" + url.split("://", 1)[1]
+    if url.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + url.split("://", 1)[1]
+    return url
+
+# 创建数据库引擎（Celery worker 和初始化脚本使用）
 engine = create_engine(
     settings.database_url,
     pool_pre_ping=True,
@@ -13,13 +25,72 @@ engine = create_engine(
 # 创建会话工厂
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# 创建异步数据库引擎（API 路由使用，避免阻塞事件循环）
+async_engine = create_async_engine(
+    settings.async_database_url or to_async_database_url(settings.database_url),
+    pool_pre_ping=True,
+    pool_recycle=300
+)
+
+# 创建异步会话工厂
+# expire_on_commit=False: 提交后仍可直接读取对象属性，避免在异步上下文中触发隐式加载
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    autoflush=False,
+    expire_on_commit=False
+)
+
+# SQL 语句计时（按引擎统计，并计入当前 HTTP 请求）
+instrument_engine(engine, "sync")
+instrument_engine(async_engine.sync_engine, "async")
+
 # 创建基础模型类
 Base = declarative_base()
 
+def sync_schema(bind=None):
+    """
+    同步数据库结构：创建缺失的表，并为已有表补充新增的列和索引
+    只做增量变更，不会修改或删除已有的列和索引
+    新增列的 info 中带有 backfill（参数为表，返回取值表达式）时，加列后按其回填已有记录
+    """
+    import models  # noqa: F401  确保所有模型已注册到 Base.metadata
+
+    bind = bind or engine
+    Base.metadata.create_all(bind=bind)
+
+    inspector = inspect(bind)
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                # 新增的枚举类型需要先创建（PostgreSQL）
+                if hasattr(column.type, "create"):
+                    column.type.create(conn, checkfirst=True)
+                column_type = column.type.compile(dialect=conn.dialect)
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+                for foreign_key in column.foreign_keys:
+                    target = foreign_key.column
+                    ddl += f" REFERENCES {target.table.name}({target.name})"
+                    if foreign_key.ondelete:
+                        ddl += f" ON DELETE {foreign_key.ondelete}"
+                conn.execute(text(ddl))
+                backfill = column.info.get("backfill")
+                if backfill is not None:
+                    conn.execute(update(table).values({column.name: backfill(table)}))
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
 # 依赖注入：获取数据库会话
 def get_db() -> Session:
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+# 依赖注入：获取异步数据库会话
+async def get_async_db() -> AsyncSession:
+    async with AsyncSessionLocal() as db:
+        yield db
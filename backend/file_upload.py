@@ -0,0 +1,191 @@
+import hashlib
+import os
+import uuid
+import zipfile
+from typing import List, Tuple
+from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+from config import settings
+from storage import get_storage
+
+# 压缩包中按扩展名识别的图片文件
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp"}
+
+class FileTooLargeError(Exception):
+    """上传文件超过大小限制"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        super().__init__(f"文件大小超过限制: {max_size} 字节")
+
+class ArchiveError(Exception):
+    """压缩包无效或内容超出限制"""
+
+def _open_for_write(path: str):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    return open(path, "wb")
+
+def _discard(file_obj, path: str):
+    file_obj.close()
+    if os.path.exists(path):
+        os.remove(path)
+
+def _spool_path() -> str:
+    # 上传内容先流式写入本地暂存文件（本地存储时与最终文件在同一目录，可直接重命名）
+    return os.path.join(settings.upload_dir, f".{uuid.uuid4().hex}.part")
+
+async def spool_upload_file(
+    upload: UploadFile,
+    max_size: int = settings.max_file_size,
+    chunk_size: int = settings.upload_chunk_size,
+) -> Tuple[str, int, str]:
+    """
+    流式保存上传文件到本地暂存文件
+    按固定大小分块读取并在线程池中写盘，超过 max_size 立即中止，同时计算 SHA-256
+    :return: (暂存文件路径, 文件大小, SHA-256 十六进制摘要)
+    """
+    # 已知大小时直接拒绝，避免无意义的读取
+    if upload.size is not None and upload.size > max_size:
+        raise FileTooLargeError(max_size)
+
+    temp_path = _spool_path()
+    hasher = hashlib.sha256()
+    size = 0
+
+    def write_chunk(file_obj, chunk: bytes):
+        hasher.update(chunk)
+        file_obj.write(chunk)
+
+    file_obj = await run_in_threadpool(_open_for_write, temp_path)
+    try:
+        while True:
+            chunk = await upload.read(chunk_size)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_size:
+                raise FileTooLargeError(max_size)
+            await run_in_threadpool(write_chunk, file_obj, chunk)
+    except BaseException:
+        await run_in_threadpool(_discard, file_obj, temp_path)
+        raise
+    await run_in_threadpool(file_obj.close)
+
+    return temp_path, size, hasher.hexdigest()
+
+def _store_spooled(temp_path: str, key: str):
+    try:
+        get_storage().store_file(key, temp_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def _storage_key(directory: str, filename_prefix: str, digest: str, extension: str) -> str:
+    """
+    上传文件的存储 key，每次上传唯一
+    带随机后缀：同一用户同一秒内上传相同图片时 key 也不相同，清理未被接受的上传时不会删除其他任务引用的文件
+    """
+    return f"{directory}/{filename_prefix}_{digest[:16]}_{uuid.uuid4().hex[:8]}{extension}"
+
+async def save_upload_file(
+    upload: UploadFile,
+    directory: str,
+    filename_prefix: str,
+    max_size: int = settings.max_file_size,
+    chunk_size: int = settings.upload_chunk_size,
+) -> Tuple[str, int, str]:
+    """
+    流式保存上传文件并存入存储（对象存储使用分片上传，不把整个文件读入内存）
+    :return: (存储 key, 文件大小, SHA-256 十六进制摘要)
+    """
+    temp_path, size, digest = await spool_upload_file(upload, max_size, chunk_size)
+    extension = os.path.splitext(upload.filename or "")[1].lower()
+    key = _storage_key(directory, filename_prefix, digest, extension)
+    await run_in_threadpool(_store_spooled, temp_path, key)
+
+    return key, size, digest
+
+def _is_image_entry(info: zipfile.ZipInfo) -> bool:
+    name = info.filename
+    basename = os.path.basename(name)
+    if info.is_dir() or name.startswith("__MACOSX/") or not basename or basename.startswith("."):
+        return False
+    return os.path.splitext(basename)[1].lower() in IMAGE_EXTENSIONS
+
+def count_archive_images(archive_path: str) -> int:
+    """统计 zip 压缩包中的图片数量（只读取目录，不解压；同步函数，需在线程池中调用）"""
+    try:
+        with zipfile.ZipFile(archive_path) as archive:
+            return sum(1 for info in archive.infolist() if _is_image_entry(info))
+    except (zipfile.BadZipFile, OSError):
+        raise ArchiveError("无效的压缩包")
+
+def extract_archive_images(
+    archive_path: str,
+    directory: str,
+    filename_prefix: str,
+    max_files: int,
+    max_size: int = settings.max_file_size,
+    chunk_size: int = settings.upload_chunk_size,
+) -> List[Tuple[str, int, str, str]]:
+    """
+    解压 zip 压缩包中的图片并存入存储（同步函数，需在线程池中调用）
+    按块解压并校验实际大小，不信任压缩包中记录的文件大小；非图片文件直接跳过
+    :param archive_path: 本地暂存的压缩包路径
+    :param directory: 图片的存储 key 前缀
+    :return: [(存储 key, 文件大小, SHA-256 十六进制摘要, 压缩包内文件名)]
+    """
+    try:
+        archive = zipfile.ZipFile(archive_path)
+    except (zipfile.BadZipFile, OSError):
+        raise ArchiveError("无效的压缩包")
+
+    extracted = []
+    try:
+        with archive:
+            entries = [info for info in archive.infolist() if _is_image_entry(info)]
+            if len(entries) > max_files:
+                raise ArchiveError(f"压缩包内图片数量不能超过 {max_files} 张")
+
+            for info in entries:
+                if info.file_size > max_size:
+                    raise FileTooLargeError(max_size)
+                extension = os.path.splitext(info.filename)[1].lower()
+                temp_path = _spool_path()
+                hasher = hashlib.sha256()
+                size = 0
+                file_obj = _open_for_write(temp_path)
+                try:
+                    with archive.open(info) as source:
+                        while True:
+                            chunk = source.read(chunk_size)
+                            if not chunk:
+                                break
+                            size += len(chunk)
+                            if size > max_size:
+                                raise FileTooLargeError(max_size)
+                            hasher.update(chunk)
+                            file_obj.write(chunk)
+                except BaseException:
+                    _discard(file_obj, temp_path)
+                    raise
+                file_obj.close()
+
+                digest = hasher.hexdigest()
+                key = _storage_key(directory, filename_prefix, digest, extension)
+                _store_spooled(temp_path, key)
+                extracted.append((key, size, digest, os.path.basename(info.filename)))
+    except zipfile.BadZipFile:
+        remove_files([path for path, _, _, _ in extracted])
+        raise ArchiveError("无效的压缩包")
+    except BaseException:
+        remove_files([path for path, _, _, _ in extracted])
+        raise
+
+    return extracted
+
+def remove_files(keys: List[str]):
+    """从存储中删除文件（忽略不存在的文件）"""
+    storage = get_storage()
+    for key in keys:
+        storage.delete(key)
@@ -0,0 +1,17 @@
+from typing import Optional
+from fastapi import Request, Response, status
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match 使用弱比较，支持多个 ETag 和 *"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return etag in (tag[2:] if tag.startswith("W/") else tag for tag in candidates)
+
+def not_modified(request: Request, etag: str, headers: dict) -> Optional[Response]:
+    """客户端缓存的版本仍然有效时返回 304 响应，否则返回 None"""
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={**headers, "ETag": etag})
+    return None
@@ -1,16 +1,17 @@
 from sqlalchemy.orm import sessionmaker
-from database import engine
+from database import engine, sync_schema
 from models import Base, ServiceTag, Service, User
 from auth import get_password_hash
 from config import settings
+from catalog_cache import bump_catalog_version_sync
 
 # 创建数据库会话
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 def init_database():
     """初始化数据库"""
-    # 创建所有表
-    Base.metadata.create_all(bind=engine)
+    # 创建所有表（并补充新增的列和索引）
+    sync_schema()
     
     db = SessionLocal()
     
@@ -52,6 +53,8 @@ def init_database():
                 db.add(service)
         
         db.commit()
+        # 通知运行中的 API 进程重新加载服务目录
+        bump_catalog_version_sync()
         
         # 创建管理员用户
         admin_username = "admin"
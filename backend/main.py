@@ -1,22 +1,35 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, status, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
+from contextlib import asynccontextmanager
 import uvicorn
 
-from database import get_db, engine
+from database import get_db, engine, async_engine, sync_schema
 from models import Base
-from routers import auth, users, services, tasks, payments
+from routers import auth, users, services, tasks, payments, outputs
 from config import settings
-from fastapi.staticfiles import StaticFiles
+from task_events import task_event_broker
+import principal_cache
+from metrics import MetricsMiddleware, render_metrics, METRICS_CONTENT_TYPE
 
-# 创建数据库表
-Base.metadata.create_all(bind=engine)
+# 创建数据库表（并补充新增的列和索引）
+sync_schema()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # 停止 Redis 订阅并关闭异步数据库连接池
+    await task_event_broker.close()
+    await principal_cache.close()
+    await async_engine.dispose()
 
 app = FastAPI(
     title="AIGC服务平台API",
     description="提供AI生成内容服务的后端API",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS配置
@@ -26,14 +39,21 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
+# 请求耗时及 SQL 统计（放在最外层，CORS 预检等请求也计入）
+if settings.metrics_enabled:
+    app.add_middleware(MetricsMiddleware)
+
 # 注册路由
 app.include_router(auth.router, prefix="/api/auth", tags=["认证"])
 app.include_router(users.router, prefix="/api/users", tags=["用户"])
 app.include_router(services.router, prefix="/api/services", tags=["服务"])
 app.include_router(tasks.router, prefix="/api/tasks", tags=["任务"])
 app.include_router(payments.router, prefix="/api/payments", tags=["支付"])
+# 结果文件（原图及 WebP/AVIF、缩略图变体）
+app.include_router(outputs.router, prefix="/outputs", tags=["结果文件"])
 
 @app.get("/")
 async def root():
@@ -43,8 +63,13 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
-# 添加静态文件服务
-app.mount("/outputs", StaticFiles(directory="outputs"), name="outputs")
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Prometheus 监控指标（队列积压需要访问 Redis，在线程池中生成）"""
+    if not settings.metrics_enabled:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    return Response(await run_in_threadpool(render_metrics), media_type=METRICS_CONTENT_TYPE)
+
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,221 @@
+import logging
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+import redis
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest,
+    multiprocess, start_http_server,
+)
+from prometheus_client.core import GaugeMetricFamily
+from sqlalchemy import event
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+METRICS_CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+# API 请求
+HTTP_REQUEST_DURATION = Histogram(
+    "aigc_http_request_duration_seconds", "HTTP 请求耗时（按路由模板）", ["method", "route", "status"]
+)
+HTTP_REQUEST_DB_QUERIES = Histogram(
+    "aigc_http_request_db_queries", "单个 HTTP 请求执行的 SQL 语句数", ["method", "route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89),
+)
+HTTP_REQUEST_DB_SECONDS = Histogram(
+    "aigc_http_request_db_seconds", "单个 HTTP 请求执行 SQL 的总耗时", ["method", "route"]
+)
+
+# 数据库
+DB_QUERY_DURATION = Histogram("aigc_db_query_duration_seconds", "单条 SQL 语句耗时", ["engine"])
+
+# Celery 任务
+TASK_QUEUE_WAIT = Histogram(
+    "aigc_task_queue_wait_seconds", "任务从入队到开始执行的等待时间", ["tier"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600),
+)
+TASK_STAGE_DURATION = Histogram(
+    "aigc_task_stage_duration_seconds", "任务各阶段耗时", ["task", "stage"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+TASKS_FINISHED = Counter("aigc_tasks_finished_total", "任务执行结果", ["task", "outcome"])
+TASKS_IN_PROGRESS = Gauge(
+    "aigc_tasks_in_progress", "正在执行的任务数", ["task"], multiprocess_mode="livesum"
+)
+TASKS_RECLAIMED = Counter("aigc_tasks_reclaimed_total", "租约过期被回收的任务", ["outcome"])
+
+# 火山引擎全局限流
+PROVIDER_RATE_LIMIT_DECISIONS = Counter(
+    "aigc_provider_rate_limit_decisions_total", "火山引擎全局限流的放行/等待后放行/重新入队次数", ["outcome"]
+)
+
+# 当前 HTTP 请求的 SQL 统计 [语句数, 总耗时]，由中间件设置，数据库事件钩子累加
+_request_db_stats: ContextVar[Optional[list]] = ContextVar("request_db_stats", default=None)
+
+def instrument_engine(engine, name: str):
+    """为同步引擎（异步引擎传入 sync_engine）注册 SQL 计时钩子"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_started_at = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started_at = getattr(context, "_metrics_started_at", None)
+        if started_at is None:
+            return
+        elapsed = time.perf_counter() - started_at
+        DB_QUERY_DURATION.labels(name).observe(elapsed)
+        stats = _request_db_stats.get()
+        if stats is not None:
+            stats[0] += 1
+            stats[1] += elapsed
+
+def _route_template(scope) -> str:
+    """
+    请求匹配到的路由模板（如 /api/tasks/{task_id}）
+    include_router 注册的路由只记录相对路径，这里用实际路径参数还原出路由前缀
+    """
+    route = scope.get("route")
+    template = getattr(route, "path_format", None)
+    if template is None:
+        return "unmatched"
+    relative = template
+    for name, value in scope.get("path_params", {}).items():
+        relative = relative.replace(f"{{{name}}}", str(value))
+    path = scope["path"]
+    if path.endswith(relative):
+        return path[:len(path) - len(relative)] + template
+    return template
+
+class MetricsMiddleware:
+    """
+    记录每个 HTTP 请求的耗时及其执行的 SQL 语句数和耗时
+    路由标签使用匹配到的路由模板（如 /api/tasks/{task_id}），未匹配的请求统一记为 unmatched，避免标签数量失控
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        stats = [0, 0.0]
+        token = _request_db_stats.set(stats)
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_db_stats.reset(token)
+            route = _route_template(scope)
+            method = scope["method"]
+            HTTP_REQUEST_DURATION.labels(method, route, str(status_code)).observe(time.perf_counter() - start)
+            HTTP_REQUEST_DB_QUERIES.labels(method, route).observe(stats[0])
+            HTTP_REQUEST_DB_SECONDS.labels(method, route).observe(stats[1])
+
+@contextmanager
+def stage_timer(task: str, stage: str, timings: Optional[dict] = None):
+    """统计任务某个阶段的耗时（异常退出时同样记录），传入 timings 时同时以毫秒记入 timings[stage]"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        TASK_STAGE_DURATION.labels(task, stage).observe(elapsed)
+        if timings is not None:
+            timings[stage] = round(elapsed * 1000)
+
+class QueueDepthCollector:
+    """采集时读取 Celery Redis 队列的积压消息数和已投递未确认的消息数"""
+
+    def __init__(self):
+        self._client = None
+
+    def _redis(self) -> redis.Redis:
+        if self._client is None:
+            self._client = redis.Redis.from_url(
+                settings.celery_broker_url, socket_timeout=1, socket_connect_timeout=1
+            )
+        return self._client
+
+    def collect(self):
+        from kombu.transport.redis import Channel
+        from tasks.queues import TASK_QUEUES
+
+        if not settings.celery_broker_url.startswith("redis"):
+            return
+        depth = GaugeMetricFamily("aigc_celery_queue_depth", "Celery 队列中等待执行的消息数", labels=["queue"])
+        unacked = GaugeMetricFamily("aigc_celery_unacked_messages", "已投递给 worker 但尚未确认的消息数")
+        try:
+            pipe = self._redis().pipeline(transaction=False)
+            for queue in TASK_QUEUES:
+                # kombu 按优先级把一个队列拆成多个列表：{队列名}、{队列名}\x06\x16{优先级}
+                for priority in Channel.priority_steps:
+                    pipe.llen(f"{queue.name}{Channel.sep}{priority}" if priority else queue.name)
+            pipe.hlen(Channel.unacked_key)
+            counts = pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"读取队列积压失败: {e}")
+            return
+        steps = len(Channel.priority_steps)
+        for i, queue in enumerate(TASK_QUEUES):
+            depth.add_metric([queue.name], sum(counts[i * steps:(i + 1) * steps]))
+        unacked.add_metric([], counts[-1])
+        yield depth
+        yield unacked
+
+class ProviderBudgetCollector:
+    """采集时读取火山引擎全局限流的配额占用（所有 worker 共享，只在 API 的 /metrics 上暴露一份）"""
+
+    def collect(self):
+        from provider_rate_limit import get_budget_usage
+
+        if not settings.volc_rate_limit_enabled:
+            return
+        usage = GaugeMetricFamily("aigc_provider_rate_limit_budget_usage", "火山引擎全局限流已占用的突发容量比例")
+        try:
+            usage.add_metric([], get_budget_usage())
+        except redis.RedisError as e:
+            logger.warning(f"读取火山引擎限流配额失败: {e}")
+            return
+        yield usage
+
+# 采集时读取 Redis 的指标（队列积压、全局限流配额）
+_queue_registry = CollectorRegistry(auto_describe=False)
+_queue_registry.register(QueueDepthCollector())
+_queue_registry.register(ProviderBudgetCollector())
+
+def _registry() -> CollectorRegistry:
+    # 多进程模式下各进程的指标写入 PROMETHEUS_MULTIPROC_DIR，采集时汇总
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+def render_metrics() -> bytes:
+    """生成 Prometheus 文本格式的指标（包含队列积压和限流配额，会访问 Redis）"""
+    return generate_latest(_registry()) + generate_latest(_queue_registry)
+
+def start_metrics_server(port: int):
+    """在独立端口上暴露指标（Celery worker 使用）"""
+    start_http_server(port, registry=_registry())
+    logger.info(f"监控指标已在端口 {port} 暴露")
+
+def mark_process_dead(pid: int):
+    """多进程模式下清理已退出子进程的 livesum 类指标"""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(pid)
@@ -1,9 +1,15 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, Boolean, ForeignKey, Enum, Float
+from sqlalchemy import Column, Integer, String, DateTime, Text, Boolean, ForeignKey, Enum, Float, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
+from result_blobs import INLINE_BLOB_FIELD
+from datetime import datetime, timezone
 import enum
 
+def utcnow() -> datetime:
+    """带时区的当前 UTC 时间（写入任务的时间字段统一使用）"""
+    return datetime.now(timezone.utc)
+
 class UserRole(str, enum.Enum):
     USER = "user"
     ADMIN = "admin"
@@ -19,6 +25,13 @@ class PaymentStatus(str, enum.Enum):
     SUCCESS = "success"
     FAILED = "failed"
 
+class CreditReason(str, enum.Enum):
+    SIGNUP = "signup"
+    TASK_CHARGE = "task_charge"
+    TASK_REFUND = "task_refund"
+    PAYMENT = "payment"
+    ADJUSTMENT = "adjustment"
+
 class User(Base):
     __tablename__ = "users"
     
@@ -35,6 +48,8 @@ class User(Base):
     # 关系
     tasks = relationship("Task", back_populates="user")
     payments = relationship("Payment", back_populates="user")
+    credit_entries = relationship("CreditLedger", back_populates="user")
+    task_batches = relationship("TaskBatch", back_populates="user")
 
 class ServiceTag(Base):
     __tablename__ = "service_tags"
@@ -65,6 +80,21 @@ class Service(Base):
 
 class Task(Base):
     __tablename__ = "tasks"
+    __table_args__ = (
+        # 任务列表按 (created_at, id) 倒序做键集分页
+        Index("ix_tasks_user_created", "user_id", "created_at", "id"),
+        Index("ix_tasks_user_status_created", "user_id", "status", "created_at", "id"),
+        # 热门服务对账按时间范围统计各服务任务数（仅扫描索引）
+        Index("ix_tasks_created_service", "created_at", "service_id"),
+        # SLA 汇总按完成时间范围扫描
+        Index("ix_tasks_completed_service", "completed_at", "service_id"),
+        # 定时回收按状态和租约到期时间查找失联的任务
+        Index("ix_tasks_status_lease", "status", "lease_expires_at"),
+        # 定时回收按状态和投递时间查找消息丢失的排队任务
+        Index("ix_tasks_status_enqueued", "status", "enqueued_at"),
+        # 后台迁移查找仍内联结果图片的旧记录
+        Index("ix_tasks_inline_result", "inline_result"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -72,21 +102,80 @@ class Task(Base):
     status = Column(Enum(TaskStatus), default=TaskStatus.PENDING)
     input_data = Column(Text)  # JSON格式的输入数据
     output_data = Column(Text)  # JSON格式的输出数据
+    # 旧版本在 output_data 中内联了结果图片且尚未迁移（为空即否），任务列表据此跳过这些记录的输出，
+    # 不必逐行匹配 output_data；新增该列时由 sync_schema 按 output_data 回填一次
+    inline_result = Column(Boolean, info={
+        "backfill": lambda table: table.c.output_data.like(f'%"{INLINE_BLOB_FIELD}"%')
+    })
     error_message = Column(Text)
     credits_used = Column(Integer, nullable=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # 由应用写入创建时间（server_default 仅用于直接插入的记录）：SQLite 的 CURRENT_TIMESTAMP 只精确到秒，
+    # 且存储格式与 SQLAlchemy 绑定的时间参数不同，按 (created_at, id) 比较游标时会重复返回同一秒内的任务
+    created_at = Column(DateTime(timezone=True), default=utcnow, server_default=func.now())
     started_at = Column(DateTime(timezone=True))
     completed_at = Column(DateTime(timezone=True))
+    batch_id = Column(Integer, ForeignKey("task_batches.id", ondelete="SET NULL"), index=True)  # 批量提交时所属批次
+    
+    # 执行租约：worker 领取任务时写入并定期续期，结束时清空；租约过期的处理中任务由定时任务回收
+    lease_owner = Column(String(200))  # 持有租约的 worker（主机名:进程号:随机后缀）
+    lease_expires_at = Column(DateTime(timezone=True))
+    retry_count = Column(Integer)  # 临时性错误重试和回收后重新入队的次数（为空即 0）
+    enqueued_at = Column(DateTime(timezone=True))  # 最近一次投递到队列的时间（延迟重试为预计到期时间），为空表示未投递
+    
+    # 各阶段时间点、耗时（毫秒）和载荷大小，由 worker 记录（命中结果缓存的任务为空）
+    provider_started_at = Column(DateTime(timezone=True))
+    provider_completed_at = Column(DateTime(timezone=True))
+    queue_wait_ms = Column(Integer)  # 创建到开始执行
+    preprocess_ms = Column(Integer)
+    provider_ms = Column(Integer)  # 火山引擎接口往返
+    save_ms = Column(Integer)
+    processing_ms = Column(Integer)  # 开始执行到完成（含失败）
+    input_bytes = Column(Integer)  # 上传图片大小
+    provider_request_bytes = Column(Integer)  # 提交给火山引擎的图片载荷（base64）
+    provider_response_bytes = Column(Integer)  # 火山引擎返回的图片载荷（base64）
+    output_bytes = Column(Integer)  # 保存的结果文件大小
     
     # 关系
     user = relationship("User", back_populates="tasks")
     service = relationship("Service", back_populates="tasks")
+    batch = relationship("TaskBatch", back_populates="tasks")
+
+class TaskBatch(Base):
+    """批量提交的一组任务"""
+    __tablename__ = "task_batches"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    service_id = Column(Integer, ForeignKey("services.id"), nullable=False)
+    total_tasks = Column(Integer, nullable=False)
+    credits_used = Column(Integer, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    # 关系
+    user = relationship("User", back_populates="task_batches")
+    tasks = relationship("Task", back_populates="batch")
+
+class TaskSlaRollup(Base):
+    """任务 SLA 小时汇总（按服务和完成时间所在小时），由定时任务根据 tasks 表重算"""
+    __tablename__ = "task_sla_rollups"
+    __table_args__ = (
+        UniqueConstraint("service_id", "hour", name="uq_task_sla_rollups_service_hour"),
+        Index("ix_task_sla_rollups_hour", "hour"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    service_id = Column(Integer, ForeignKey("services.id"), nullable=False)
+    hour = Column(DateTime(timezone=True), nullable=False)  # UTC 整点
+    completed = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    histograms = Column(Text, nullable=False)  # JSON格式：各指标的对数分桶计数、总和与最大值
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
 class Payment(Base):
     __tablename__ = "payments"
     
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     amount = Column(Float, nullable=False)  # 支付金额
     credits = Column(Integer, nullable=False)  # 获得积分
     status = Column(Enum(PaymentStatus), default=PaymentStatus.PENDING)
@@ -96,4 +185,25 @@ class Payment(Base):
     completed_at = Column(DateTime(timezone=True))
     
     # 关系
-    user = relationship("User", back_populates="payments")
\ No newline at end of file
+    user = relationship("User", back_populates="payments")
+
+class CreditLedger(Base):
+    """积分流水（只追加），User.credits 为其余额"""
+    __tablename__ = "credit_ledger"
+    __table_args__ = (
+        # 同一任务的扣费/退款各只能记录一次
+        UniqueConstraint("task_id", "reason", name="uq_credit_ledger_task_reason"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    delta = Column(Integer, nullable=False)  # 积分变动，扣费为负
+    balance_after = Column(Integer, nullable=False)  # 变动后余额
+    reason = Column(Enum(CreditReason), nullable=False)
+    task_id = Column(Integer, ForeignKey("tasks.id", ondelete="SET NULL"))
+    payment_id = Column(Integer, ForeignKey("payments.id"))
+    batch_id = Column(Integer, ForeignKey("task_batches.id", ondelete="SET NULL"))  # 批量扣费时对应的批次
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    # 关系
+    user = relationship("User", back_populates="credit_entries")
\ No newline at end of file
@@ -0,0 +1,99 @@
+import hashlib
+import io
+import logging
+import os
+from functools import lru_cache
+from typing import Optional
+from config import settings
+from result_blobs import output_cache_control
+from storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+# 变体格式（AVIF 需要 Pillow 编译时带 libavif）
+VARIANT_FORMATS = {
+    "webp": {"pil_format": "WEBP", "media_type": "image/webp"},
+    "avif": {"pil_format": "AVIF", "media_type": "image/avif"},
+}
+
+@lru_cache(maxsize=None)
+def _pil_supports(fmt: str) -> bool:
+    from PIL import features
+    return features.check(fmt)
+
+def is_format_supported(fmt: str) -> bool:
+    """当前环境能否生成该格式（首次调用时才导入 PIL，API 进程启动时不加载）"""
+    return fmt in VARIANT_FORMATS and _pil_supports(fmt)
+
+def supported_formats() -> list:
+    """当前环境可生成的变体格式"""
+    return [name for name in VARIANT_FORMATS if is_format_supported(name)]
+
+def negotiate_format(accept: str) -> Optional[str]:
+    """按 Accept 请求头选择浏览器支持的最小格式，都不支持时返回 None（使用原图）"""
+    accept = accept or ""
+    for name in ("avif", "webp"):
+        if VARIANT_FORMATS[name]["media_type"] in accept and is_format_supported(name):
+            return name
+    return None
+
+def variant_key(filename: str, fmt: str, width: Optional[int] = None) -> str:
+    """变体在存储中的 key：outputs/.variants/{原文件名去扩展名}[.w{宽度}].{格式}"""
+    stem = os.path.splitext(filename)[0]
+    suffix = f".w{width}" if width else ""
+    return f"{settings.output_dir}/{settings.output_variants_dir}/{stem}{suffix}.{fmt}"
+
+def generate_variant(source_key: str, fmt: Optional[str], width: Optional[int] = None) -> str:
+    """
+    生成结果图片的变体（转码，可选按宽度缩小，不放大）并写入存储，已存在时直接返回
+    :param fmt: 目标格式，为 None 时保持原图格式（只缩小，用于不接受 WebP/AVIF 的客户端）
+    :return: 变体的 key
+    """
+    storage = get_storage()
+    extension = fmt or os.path.splitext(source_key)[1].lstrip(".").lower()
+    target = variant_key(os.path.basename(source_key), extension, width)
+    if storage.exists(target):
+        return target
+
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    with storage.local_copy(source_key) as source_path, Image.open(source_path) as img:
+        pil_format = VARIANT_FORMATS[fmt]["pil_format"] if fmt else img.format
+        if width and img.width > width:
+            img.thumbnail((width, img.height), Image.Resampling.LANCZOS)
+        if pil_format == "JPEG":
+            if img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+        elif pil_format != "PNG" and img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "transparency" in img.info or img.mode in ("LA", "PA") else "RGB")
+        options = {}
+        quality = settings.output_variant_quality.get(pil_format.lower())
+        if quality is not None:
+            options["quality"] = quality
+        img.save(buffer, format=pil_format, **options)
+    storage.put_bytes(target, buffer.getvalue(), cache_control=output_cache_control())
+    return target
+
+def pregenerate_variants(source_key: str):
+    """任务完成时预先生成列表页使用的缩略图，失败只记录日志（首次访问时还会再生成）"""
+    for fmt in supported_formats():
+        try:
+            generate_variant(source_key, fmt, settings.output_thumbnail_width)
+        except Exception as e:
+            logger.warning(f"生成缩略图失败 {source_key} ({fmt}): {e}")
+
+@lru_cache(maxsize=4096)
+def _content_etag(path: str, mtime_ns: int, size: int) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return f'"{digest.hexdigest()[:32]}"'
+
+def file_etag(path: str, stat_result: os.stat_result) -> str:
+    """
+    基于内容哈希的强 ETag（同一文件按修改时间和大小缓存，不重复计算）
+    结果文件和变体写入后不再修改，ETag 可以配合 immutable 长期缓存
+    """
+    return _content_etag(path, stat_result.st_mtime_ns, stat_result.st_size)
@@ -0,0 +1,18 @@
+import base64
+import json
+from datetime import datetime
+from typing import Tuple
+
+def encode_cursor(created_at: datetime, item_id: int) -> str:
+    """将列表最后一条记录的排序键编码为不透明游标"""
+    payload = json.dumps({"c": created_at.isoformat(), "i": item_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """解析游标，格式不正确时抛出 ValueError"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(payload["c"]), int(payload["i"])
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError("无效的分页游标") from e
@@ -0,0 +1,243 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from typing import Optional
+from redis.exceptions import RedisError
+from config import settings
+from models import User, UserRole
+from redis_client import get_redis, get_async_redis
+
+logger = logging.getLogger(__name__)
+
+# Redis 中的用户身份缓存键前缀
+KEY_PREFIX = "aigc:principal"
+# 失效广播频道，通知各 API 进程清理本地缓存
+INVALIDATE_CHANNEL = "aigc:principal_invalidate"
+# 用户身份的失效代次，每次失效加 1；回填缓存前核对代次，避免把失效前读到的旧快照写回缓存
+GENERATION_PREFIX = "aigc:principal_gen"
+
+# 代次未变化时才写入缓存（原子比较并写入）
+FILL_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+return 1
+"""
+
+@dataclass
+class Principal:
+    """已认证用户的只读快照（不绑定数据库会话）"""
+    id: int
+    username: str
+    email: str
+    role: UserRole
+    credits: int
+    is_active: bool
+    created_at: Optional[datetime]
+
+    @classmethod
+    def from_user(cls, user: User) -> "Principal":
+        return cls(
+            id=user.id,
+            username=user.username,
+            email=user.email,
+            role=UserRole(user.role),
+            credits=user.credits,
+            is_active=user.is_active,
+            created_at=user.created_at,
+        )
+
+    def to_json(self) -> str:
+        data = asdict(self)
+        data["role"] = self.role.value
+        data["created_at"] = self.created_at.isoformat() if self.created_at else None
+        return json.dumps(data)
+
+    @classmethod
+    def from_json(cls, value: str) -> "Principal":
+        data = json.loads(value)
+        data["role"] = UserRole(data["role"])
+        data["created_at"] = datetime.fromisoformat(data["created_at"]) if data["created_at"] else None
+        return cls(**data)
+
+class LocalTTLCache:
+    """进程内 TTL + LRU 缓存"""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def pop(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+_local_cache = LocalTTLCache(
+    settings.principal_cache_local_max_entries,
+    settings.principal_cache_local_ttl_seconds
+)
+# 本进程内进行中的回填：用户名 -> 回填令牌，本地失效时移除，令牌不再匹配的回填不写入本地缓存
+_pending_fills = LocalTTLCache(
+    settings.principal_cache_local_max_entries,
+    settings.principal_cache_local_ttl_seconds
+)
+_fill_script = None
+_listener: Optional[asyncio.Task] = None
+
+@dataclass
+class PrincipalFill:
+    """一次缓存回填在查询数据库之前记录的失效代次"""
+    username: str
+    generation: Optional[str]  # Redis 中的代次，读取失败时为 None（不写 Redis 缓存）
+    token: object
+
+def _redis_key(username: str) -> str:
+    return f"{KEY_PREFIX}:{username}"
+
+def _generation_key(username: str) -> str:
+    return f"{GENERATION_PREFIX}:{username}"
+
+def _invalidate_local(username: str):
+    _local_cache.pop(username)
+    _pending_fills.pop(username)
+
+def _invalidation_pipeline(redis, username: str):
+    """删除 Redis 缓存、递增失效代次并广播失效通知（代次的有效期长于缓存，过期后回填只会被跳过）"""
+    pipe = redis.pipeline()
+    pipe.delete(_redis_key(username))
+    pipe.incr(_generation_key(username))
+    pipe.expire(_generation_key(username), settings.principal_cache_redis_ttl_seconds * 2)
+    pipe.publish(INVALIDATE_CHANNEL, username)
+    return pipe
+
+async def get_cached_principal(username: str) -> Optional[Principal]:
+    """依次查询本地缓存和 Redis 缓存"""
+    _ensure_invalidation_listener()
+
+    principal = _local_cache.get(username)
+    if principal is not None:
+        return principal
+
+    try:
+        value = await get_async_redis().get(_redis_key(username))
+    except RedisError as e:
+        logger.warning(f"读取用户身份缓存失败: {e}")
+        return None
+    if value is None:
+        return None
+
+    principal = Principal.from_json(value)
+    _local_cache.set(username, principal)
+    return principal
+
+async def begin_principal_fill(username: str) -> PrincipalFill:
+    """缓存未命中、查询数据库之前调用，记录当前的失效代次"""
+    token = object()
+    _pending_fills.set(username, token)
+    try:
+        generation = await get_async_redis().get(_generation_key(username)) or "0"
+    except RedisError as e:
+        logger.warning(f"读取用户身份缓存代次失败: {e}")
+        generation = None
+    return PrincipalFill(username, generation, token)
+
+async def cache_principal(principal: Principal, fill: PrincipalFill):
+    """
+    回填本地缓存和 Redis 缓存
+    查询数据库期间用户身份已失效（如扣费、支付确认、退款）时放弃写入，避免旧快照覆盖失效
+    """
+    global _fill_script
+    if _pending_fills.get(fill.username) is not fill.token:
+        return
+    _pending_fills.pop(fill.username)
+    if fill.generation is None:
+        return
+
+    try:
+        redis = get_async_redis()
+        if _fill_script is None:
+            _fill_script = redis.register_script(FILL_SCRIPT)
+        stored = await _fill_script(
+            keys=[_redis_key(principal.username), _generation_key(principal.username)],
+            args=[fill.generation, principal.to_json(), settings.principal_cache_redis_ttl_seconds]
+        )
+    except RedisError as e:
+        logger.warning(f"写入用户身份缓存失败: {e}")
+        return
+    # Redis 中的代次已变化时，失效通知随后也会到达本进程，不写本地缓存
+    if stored:
+        _local_cache.set(principal.username, principal)
+
+async def invalidate_principal(username: str):
+    """用户积分、状态、邮箱或密码变更后使缓存失效（API 进程使用）"""
+    _invalidate_local(username)
+    try:
+        await _invalidation_pipeline(get_async_redis(), username).execute()
+    except RedisError as e:
+        logger.warning(f"清理用户身份缓存失败: {e}")
+
+def invalidate_principal_sync(username: str):
+    """用户信息变更后使缓存失效（Celery worker 使用）"""
+    try:
+        _invalidation_pipeline(get_redis(), username).execute()
+    except RedisError as e:
+        logger.warning(f"清理用户身份缓存失败: {e}")
+
+async def _listen_invalidations():
+    while True:
+        pubsub = get_async_redis().pubsub()
+        try:
+            await pubsub.subscribe(INVALIDATE_CHANNEL)
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    _invalidate_local(message["data"])
+        except asyncio.CancelledError:
+            raise
+        except (RedisError, OSError) as e:
+            # 订阅断开期间无法收到失效通知，清空本地缓存以免使用过期数据
+            _local_cache.clear()
+            _pending_fills.clear()
+            logger.warning(f"用户身份缓存失效订阅断开，1秒后重连: {e}")
+            await asyncio.sleep(1)
+        finally:
+            await pubsub.aclose()
+
+def _ensure_invalidation_listener():
+    global _listener
+    if _listener is None or _listener.done():
+        _listener = asyncio.create_task(_listen_invalidations())
+
+async def close():
+    """停止失效订阅（应用关闭时调用）"""
+    global _listener
+    if _listener is not None:
+        _listener.cancel()
+        try:
+            await _listener
+        except asyncio.CancelledError:
+            pass
+        _listener = None
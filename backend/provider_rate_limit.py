@@ -0,0 +1,135 @@
+import logging
+import math
+import random
+import time
+from redis.exceptions import RedisError
+from config import settings
+from redis_client import get_redis, get_async_redis
+from metrics import PROVIDER_RATE_LIMIT_DECISIONS
+
+logger = logging.getLogger(__name__)
+
+# 火山引擎调用的全局限流状态（所有 worker 共享）
+KEY_PREFIX = "aigc:rate_limit:volc"
+# 理论到达时间（GCRA 的 TAT，毫秒）
+TAT_KEY = f"{KEY_PREFIX}:tat"
+# 放行/等待/重新入队计数
+STATS_KEY = f"{KEY_PREFIX}:stats"
+
+# GCRA：每次调用把理论到达时间推后一个发放间隔，超前当前时间超过突发容量时拒绝
+# 使用 Redis 服务器时间，避免各 worker 时钟不一致
+# 返回 {是否放行, 需等待毫秒数}（Redis 会把 Lua 数值截断为整数，等待时间向上取整，不足 1 毫秒时不会变成 0）
+GCRA_SCRIPT = """
+local interval = tonumber(ARGV[1])
+local tolerance = tonumber(ARGV[2])
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) * 1000 + math.floor(tonumber(now_parts[2]) / 1000)
+local tat = tonumber(redis.call('GET', KEYS[1])) or now
+if tat < now then
+    tat = now
+end
+local new_tat = tat + interval
+local wait = new_tat - now - tolerance
+if wait > 0 then
+    return {0, math.ceil(wait)}
+end
+redis.call('SET', KEYS[1], string.format('%.3f', new_tat), 'PX', math.ceil(new_tat - now))
+return {1, 0}
+"""
+
+class ProviderRateLimited(Exception):
+    """超出火山引擎调用配额，retry_after 秒后可重试"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"火山引擎调用超出限流配额，{retry_after:.2f}秒后重试")
+        self.retry_after = retry_after
+
+_script = None
+
+def _interval_ms() -> float:
+    return 1000 / settings.volc_rate_limit_qps
+
+def try_acquire() -> float:
+    """
+    尝试获取一次调用配额
+    :return: 0 表示已放行，否则为需要等待的秒数
+    """
+    global _script
+    if not settings.volc_rate_limit_enabled:
+        return 0
+
+    interval = _interval_ms()
+    try:
+        redis = get_redis()
+        if _script is None:
+            _script = redis.register_script(GCRA_SCRIPT)
+        allowed, wait_ms = _script(keys=[TAT_KEY], args=[interval, interval * settings.volc_rate_limit_burst])
+    except RedisError as e:
+        # Redis 不可用时不限流，避免阻塞所有任务
+        logger.warning(f"火山引擎限流检查失败，本次直接放行: {e}")
+        return 0
+    return 0 if allowed else wait_ms / 1000
+
+def _incr_stat(field: str):
+    PROVIDER_RATE_LIMIT_DECISIONS.labels(field).inc()
+    try:
+        get_redis().hincrby(STATS_KEY, field, 1)
+    except RedisError as e:
+        logger.warning(f"记录限流统计失败: {e}")
+
+def acquire(max_wait: float = None):
+    """
+    获取一次调用配额，需等待的时间不超过 max_wait 时在当前线程等待，
+    否则抛出 ProviderRateLimited 由调用方重新入队
+    """
+    if not settings.volc_rate_limit_enabled:
+        return
+    max_wait = settings.volc_rate_limit_max_wait_seconds if max_wait is None else max_wait
+    deadline = time.monotonic() + max_wait
+    waited = False
+    while True:
+        retry_after = try_acquire()
+        if not retry_after:
+            _incr_stat("waited" if waited else "allowed")
+            return
+        if time.monotonic() + retry_after > deadline:
+            _incr_stat("requeued")
+            raise ProviderRateLimited(retry_after)
+        waited = True
+        time.sleep(retry_after)
+
+def requeue_countdown(retry_after: float, retries: int) -> float:
+    """重新入队的延迟：等待时间 + 按重试次数指数增长的随机退避，避免同时醒来再次拥塞"""
+    backoff = min(settings.volc_rate_limit_max_backoff_seconds, 2 ** retries)
+    return retry_after + random.uniform(0, backoff)
+
+def _budget_in_use(tat, server_time) -> float:
+    """当前已占用的突发容量（TAT 超前 Redis 服务器时间的部分折算成调用次数）"""
+    seconds, microseconds = server_time
+    now = seconds * 1000 + microseconds // 1000
+    return max(0.0, (float(tat) - now) / _interval_ms()) if tat else 0.0
+
+def get_budget_usage() -> float:
+    """已占用的突发容量占比（0~1，监控指标采集时调用）"""
+    burst = settings.volc_rate_limit_burst
+    if not burst:
+        return 0.0
+    redis = get_redis()
+    return min(_budget_in_use(redis.get(TAT_KEY), redis.time()) / burst, 1.0)
+
+async def get_rate_limit_stats() -> dict:
+    """获取限流配额使用情况"""
+    redis = get_async_redis()
+    stats = await redis.hgetall(STATS_KEY)
+    in_use = _budget_in_use(await redis.get(TAT_KEY), await redis.time())
+    burst = settings.volc_rate_limit_burst
+    return {
+        "enabled": settings.volc_rate_limit_enabled,
+        "qps": settings.volc_rate_limit_qps,
+        "burst": burst,
+        "budget_in_use": round(in_use, 2),
+        "budget_usage": round(min(in_use / burst, 1.0), 4) if burst else 0.0,
+        "allowed": int(stats.get("allowed", 0)),
+        "waited": int(stats.get("waited", 0)),
+        "requeued": int(stats.get("requeued", 0)),
+    }
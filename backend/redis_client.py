@@ -0,0 +1,21 @@
+import redis
+import redis.asyncio as aioredis
+from config import settings
+
+# Redis客户端（按进程懒加载，连接池由客户端内部维护）
+_redis = None
+_async_redis = None
+
+def get_redis() -> redis.Redis:
+    """获取同步Redis客户端（Celery worker 使用）"""
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis.from_url(settings.redis_url, decode_responses=True)
+    return _redis
+
+def get_async_redis() -> aioredis.Redis:
+    """获取异步Redis客户端（API 路由使用）"""
+    global _async_redis
+    if _async_redis is None:
+        _async_redis = aioredis.Redis.from_url(settings.redis_url, decode_responses=True)
+    return _async_redis
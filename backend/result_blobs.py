@@ -0,0 +1,39 @@
+import mimetypes
+import os
+from config import settings
+from storage import get_storage
+
+# 旧版本内联在 Task.output_data 中的结果图片字段
+INLINE_BLOB_FIELD = "result_image_base64"
+
+def output_cache_control() -> str:
+    """结果文件和变体的缓存头（文件名唯一且写入后不再修改）"""
+    return f"public, max-age={settings.output_cache_max_age}, immutable"
+
+def result_image_url(path: str) -> str:
+    """结果图片的访问地址（由 /outputs 提供）"""
+    return f"/outputs/{os.path.basename(path)}"
+
+def result_thumbnail_url(path: str) -> str:
+    """结果图片缩略图的访问地址（按浏览器支持选择 AVIF/WebP）"""
+    return f"{result_image_url(path)}?format=auto&w={settings.output_thumbnail_width}"
+
+def result_image_reference(path: str, size: int = None) -> dict:
+    """
+    生成结果图片的引用信息，只在任务记录中保存路径和元数据
+    :param path: 结果文件在存储中的 key
+    :param size: 文件大小，不传时从存储中查询
+    """
+    if size is None:
+        size = get_storage().stat(path).size
+    return {
+        "result_image_path": path,
+        "result_image_url": result_image_url(path),
+        "result_thumbnail_url": result_thumbnail_url(path),
+        "result_image_size": size,
+        "result_content_type": mimetypes.guess_type(path)[0] or "application/octet-stream",
+    }
+
+def output_key(filename: str) -> str:
+    """结果文件在存储中的 key"""
+    return f"{settings.output_dir}/{filename}"
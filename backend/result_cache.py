@@ -0,0 +1,79 @@
+import json
+import logging
+import time
+from typing import Optional
+from redis.exceptions import RedisError
+from config import settings
+from redis_client import get_redis, get_async_redis
+
+logger = logging.getLogger(__name__)
+
+# 缓存键前缀
+CACHE_PREFIX = "aigc:result_cache"
+# 按写入时间排序的缓存键索引，用于按数量淘汰
+INDEX_KEY = f"{CACHE_PREFIX}:index"
+# 命中/未命中计数
+STATS_KEY = f"{CACHE_PREFIX}:stats"
+
+def cache_key(image_sha256: str, target_age: int, req_key: str) -> str:
+    """生成结果缓存键（图片内容哈希 + 目标年龄 + 接口 req_key）"""
+    return f"{CACHE_PREFIX}:{req_key}:{target_age}:{image_sha256}"
+
+async def get_cached_result(image_sha256: str, target_age: int, req_key: str) -> Optional[dict]:
+    """查询缓存结果，并记录命中/未命中次数"""
+    if not settings.result_cache_enabled or not image_sha256:
+        return None
+
+    try:
+        redis = get_async_redis()
+        value = await redis.get(cache_key(image_sha256, target_age, req_key))
+        await redis.hincrby(STATS_KEY, "hits" if value else "misses", 1)
+    except RedisError as e:
+        logger.warning(f"读取结果缓存失败: {e}")
+        return None
+
+    return json.loads(value) if value else None
+
+def store_result(image_sha256: str, target_age: int, req_key: str, result_data: dict):
+    """写入缓存结果，并淘汰过期及超出数量上限的条目"""
+    if not settings.result_cache_enabled or not image_sha256:
+        return
+
+    key = cache_key(image_sha256, target_age, req_key)
+    now = time.time()
+    try:
+        redis = get_redis()
+        pipe = redis.pipeline()
+        pipe.set(key, json.dumps(result_data), ex=settings.result_cache_ttl_seconds)
+        pipe.zadd(INDEX_KEY, {key: now})
+        # 清理索引中已过期的键
+        pipe.zremrangebyscore(INDEX_KEY, "-inf", now - settings.result_cache_ttl_seconds)
+        pipe.zcard(INDEX_KEY)
+        entries = pipe.execute()[-1]
+
+        # 超过数量上限时淘汰最早写入的条目
+        overflow = entries - settings.result_cache_max_entries
+        if overflow > 0:
+            evicted = [k for k, _ in redis.zpopmin(INDEX_KEY, overflow)]
+            if evicted:
+                redis.delete(*evicted)
+                redis.hincrby(STATS_KEY, "evictions", len(evicted))
+    except RedisError as e:
+        logger.warning(f"写入结果缓存失败: {e}")
+
+async def get_cache_stats() -> dict:
+    """获取结果缓存统计信息"""
+    redis = get_async_redis()
+    stats = await redis.hgetall(STATS_KEY)
+    entries = await redis.zcard(INDEX_KEY)
+
+    hits = int(stats.get("hits", 0))
+    misses = int(stats.get("misses", 0))
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "evictions": int(stats.get("evictions", 0)),
+        "entries": entries,
+        "hit_rate": hits / total if total else 0.0,
+    }
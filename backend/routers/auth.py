@@ -1,32 +1,35 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from database import get_db
-from models import User
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_async_db
+from models import User, CreditLedger, CreditReason
 from schemas import UserCreate, UserLogin, Token, UserResponse, MessageResponse
-from auth import authenticate_user, create_access_token, get_password_hash
+from auth import authenticate_user, create_access_token, get_password_hash_async
 from config import settings
 
 router = APIRouter()
 
 @router.post("/register", response_model=UserResponse)
-async def register(user_data: UserCreate, db: Session = Depends(get_db)):
+async def register(user_data: UserCreate, db: AsyncSession = Depends(get_async_db)):
     """用户注册"""
     # 检查用户名是否已存在
-    if db.query(User).filter(User.username == user_data.username).first():
+    result = await db.execute(select(User.id).where(User.username == user_data.username))
+    if result.first():
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="用户名已存在"
         )
     
     # 检查邮箱是否已存在
-    if db.query(User).filter(User.email == user_data.email).first():
+    result = await db.execute(select(User.id).where(User.email == user_data.email))
+    if result.first():
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="邮箱已存在"
         )
     
     # 创建新用户
-    hashed_password = get_password_hash(user_data.password)
+    hashed_password = await get_password_hash_async(user_data.password)
     db_user = User(
         username=user_data.username,
         email=user_data.email,
@@ -35,15 +38,24 @@ async def register(user_data: UserCreate, db: Session = Depends(get_db)):
     )
     
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.flush()
+    
+    # 记录注册赠送积分流水
+    db.add(CreditLedger(
+        user_id=db_user.id,
+        delta=db_user.credits,
+        balance_after=db_user.credits,
+        reason=CreditReason.SIGNUP
+    ))
+    await db.commit()
+    await db.refresh(db_user)
     
     return db_user
 
 @router.post("/login", response_model=Token)
-async def login(user_data: UserLogin, db: Session = Depends(get_db)):
+async def login(user_data: UserLogin, db: AsyncSession = Depends(get_async_db)):
     """用户登录"""
-    user = authenticate_user(db, user_data.username, user_data.password)
+    user = await authenticate_user(db, user_data.username, user_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
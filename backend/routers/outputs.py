@@ -0,0 +1,84 @@
+import asyncio
+import os
+from typing import Optional
+from fastapi import APIRouter, HTTPException, status, Query, Request
+from fastapi.responses import FileResponse, RedirectResponse
+from starlette.concurrency import run_in_threadpool
+from output_variants import VARIANT_FORMATS, is_format_supported, generate_variant, negotiate_format, file_etag
+from result_blobs import output_key, output_cache_control
+from storage import get_storage
+from http_cache import not_modified
+from config import settings
+
+router = APIRouter()
+
+# 正在生成的变体，同一进程内并发请求同一变体时只生成一次
+_variant_locks: dict = {}
+
+def _source_key(filename: str) -> str:
+    # 只允许访问输出目录下的结果文件（不含子目录和隐藏的变体目录）
+    if filename != os.path.basename(filename) or filename.startswith("."):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="文件不存在")
+    return output_key(filename)
+
+async def _variant(source_key: str, fmt: str, width: Optional[int]) -> str:
+    key = (source_key, fmt, width)
+    lock = _variant_locks.setdefault(key, asyncio.Lock())
+    try:
+        async with lock:
+            return await run_in_threadpool(generate_variant, source_key, fmt, width)
+    finally:
+        if not lock.locked() and _variant_locks.get(key) is lock:
+            _variant_locks.pop(key, None)
+
+@router.api_route("/{filename}", methods=["GET", "HEAD"])
+async def get_output_file(
+    filename: str,
+    request: Request,
+    format: Optional[str] = Query(None, description="webp / avif / auto（按 Accept 选择），不传返回原图"),
+    w: Optional[int] = Query(None, description="缩略图宽度，只能使用配置允许的宽度")
+):
+    """
+    获取结果文件（支持格式转换和缩略图变体、强 ETag、304 和 Range 请求）
+    使用对象存储时重定向到预签名地址，由客户端直接从存储下载
+    """
+    storage = get_storage()
+    source_key = _source_key(filename)
+    if format not in (None, "auto") and not is_format_supported(format):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"不支持的格式: {format}")
+    if w is not None and w not in settings.output_variant_widths:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"不支持的宽度，可选: {settings.output_variant_widths}"
+        )
+    if not await run_in_threadpool(storage.exists, source_key):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="文件不存在")
+
+    headers = {"Cache-Control": output_cache_control()}
+    fmt = format
+    if format == "auto":
+        fmt = negotiate_format(request.headers.get("accept"))
+        headers["Vary"] = "Accept"
+
+    # 只指定宽度、未指定格式时缩略图默认使用 WebP（PNG 缩略图体积大得多）；
+    # format=auto 而客户端不接受 WebP/AVIF 时使用原图格式的缩略图
+    if format is None and w is not None:
+        fmt = "webp" if is_format_supported("webp") else None
+    key = source_key if fmt is None and w is None else await _variant(source_key, fmt, w)
+
+    path = storage.local_path(key)
+    if path is None:
+        # 预签名地址会过期，重定向本身只短时间缓存（对象上已设置长期缓存头，ETag 和 Range 由存储服务处理）
+        url = await run_in_threadpool(storage.presigned_url, key)
+        headers["Cache-Control"] = f"private, max-age={settings.s3_presign_expires_seconds // 2}"
+        return RedirectResponse(url, status_code=status.HTTP_307_TEMPORARY_REDIRECT, headers=headers)
+
+    stat_result = await run_in_threadpool(os.stat, path)
+    etag = await run_in_threadpool(file_etag, path, stat_result)
+    cached = not_modified(request, etag, headers)
+    if cached is not None:
+        return cached
+    headers["ETag"] = etag
+
+    media_type = VARIANT_FORMATS[fmt]["media_type"] if fmt else None
+    return FileResponse(path, headers=headers, media_type=media_type, stat_result=stat_result)
@@ -1,10 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
-from database import get_db
-from models import Payment, User, PaymentStatus
+from database import get_async_db
+from models import Payment, PaymentStatus, CreditReason
 from schemas import PaymentCreate, PaymentResponse, MessageResponse
-from auth import get_current_active_user
+from auth import get_current_active_principal
+from credits import add_credits
+from principal_cache import Principal, invalidate_principal
 import uuid
 from datetime import datetime
 
@@ -12,21 +15,24 @@ router = APIRouter()
 
 @router.get("/", response_model=List[PaymentResponse])
 async def get_user_payments(
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_active_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取用户支付记录"""
-    payments = db.query(Payment).filter(
-        Payment.user_id == current_user.id
-    ).order_by(Payment.created_at.desc()).all()
+    result = await db.execute(
+        select(Payment)
+        .where(Payment.user_id == current_user.id)
+        .order_by(Payment.created_at.desc())
+    )
+    payments = result.scalars().all()
     
     return payments
 
 @router.post("/create", response_model=PaymentResponse)
 async def create_payment(
     payment_data: PaymentCreate,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_active_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """创建支付订单"""
     # 验证支付金额
@@ -57,46 +63,54 @@ async def create_payment(
     )
     
     db.add(payment)
-    db.commit()
-    db.refresh(payment)
+    await db.commit()
+    await db.refresh(payment)
     
     return payment
 
 @router.post("/confirm/{payment_id}", response_model=MessageResponse)
 async def confirm_payment(
     payment_id: int,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_active_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """确认支付（模拟支付成功）"""
-    payment = db.query(Payment).filter(
-        Payment.id == payment_id,
-        Payment.user_id == current_user.id
-    ).first()
-    
-    if not payment:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="支付记录不存在"
+    # 条件更新：只有待支付的记录会被确认，并发重复确认时只有一次生效
+    result = await db.execute(
+        update(Payment)
+        .where(
+            Payment.id == payment_id,
+            Payment.user_id == current_user.id,
+            Payment.status == PaymentStatus.PENDING
         )
-    
-    if payment.status != PaymentStatus.PENDING:
+        .values(status=PaymentStatus.SUCCESS, completed_at=datetime.utcnow())
+        .returning(Payment.credits)
+    )
+    payment_credits = result.scalar_one_or_none()
+    
+    if payment_credits is None:
+        result = await db.execute(select(Payment.id).where(
+            Payment.id == payment_id,
+            Payment.user_id == current_user.id
+        ))
+        if not result.first():
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="支付记录不存在"
+            )
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="支付状态不正确"
         )
     
-    # 更新支付状态
-    payment.status = PaymentStatus.SUCCESS
-    payment.completed_at = datetime.utcnow()
-    
-    # 增加用户积分
-    current_user.credits += payment.credits
+    # 增加用户积分，与支付状态在同一事务中提交
+    balance = await add_credits(db, current_user.id, payment_credits, CreditReason.PAYMENT, payment_id=payment_id)
     
-    db.commit()
+    await db.commit()
+    await invalidate_principal(current_user.username)
     
     return {
-        "message": f"支付成功！获得 {payment.credits} 积分，当前积分: {current_user.credits}"
+        "message": f"支付成功！获得 {payment_credits} 积分，当前积分: {balance}"
     }
 
 @router.get("/packages", response_model=List[dict])
@@ -142,8 +156,8 @@ async def get_credit_packages():
 @router.post("/package/{package_id}", response_model=PaymentResponse)
 async def purchase_credit_package(
     package_id: int,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_active_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """购买积分套餐"""
     # 获取套餐信息
@@ -183,7 +197,7 @@ async def purchase_credit_package(
     )
     
     db.add(payment)
-    db.commit()
-    db.refresh(payment)
+    await db.commit()
+    await db.refresh(payment)
     
     return payment
\ No newline at end of file
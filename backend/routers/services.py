@@ -1,30 +1,50 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from sqlalchemy.orm import Session
-from sqlalchemy import or_
+import hashlib
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
-from database import get_db
-from models import Service, ServiceTag, User
+from database import get_async_db
+from models import Service, ServiceTag
 from schemas import ServiceResponse, ServiceTagResponse, ServiceCreate, ServiceTagCreate
-from auth import get_current_active_user
+from auth import get_current_active_principal
+from principal_cache import Principal
+from catalog_cache import get_catalog, bump_catalog_version
+from service_popularity import WINDOWS, get_popular_service_ids
+from http_cache import not_modified
 
 router = APIRouter()
 
+# 目录列表每次使用前向服务端验证（命中时返回 304，不传输内容）
+CATALOG_CACHE_CONTROL = "no-cache"
+
+def catalog_not_modified(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """设置目录列表的 ETag，客户端缓存仍然有效时返回 304 响应"""
+    headers = {"Cache-Control": CATALOG_CACHE_CONTROL}
+    cached = not_modified(request, etag, headers)
+    if cached is None:
+        response.headers.update({**headers, "ETag": etag})
+    return cached
+
 # 服务标签相关路由
 @router.get("/tags", response_model=List[ServiceTagResponse])
-async def get_service_tags(db: Session = Depends(get_db)):
+async def get_service_tags(request: Request, response: Response, db: AsyncSession = Depends(get_async_db)):
     """获取所有服务标签"""
-    tags = db.query(ServiceTag).all()
-    return tags
+    catalog = await get_catalog(db)
+    cached = catalog_not_modified(request, response, catalog.etag)
+    if cached is not None:
+        return cached
+    return catalog.tags
 
 @router.post("/tags", response_model=ServiceTagResponse)
 async def create_service_tag(
     tag_data: ServiceTagCreate,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_active_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_active_principal)
 ):
     """创建服务标签（管理员功能）"""
     # 检查标签名是否已存在
-    if db.query(ServiceTag).filter(ServiceTag.name == tag_data.name).first():
+    result = await db.execute(select(ServiceTag.id).where(ServiceTag.name == tag_data.name))
+    if result.first():
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="标签名已存在"
@@ -32,46 +52,52 @@ async def create_service_tag(
     
     db_tag = ServiceTag(**tag_data.dict())
     db.add(db_tag)
-    db.commit()
-    db.refresh(db_tag)
+    await db.commit()
+    await db.refresh(db_tag)
+    await bump_catalog_version()
     
     return db_tag
 
 # 服务相关路由
 @router.get("/", response_model=List[ServiceResponse])
 async def get_services(
+    request: Request,
+    response: Response,
     tag_id: Optional[int] = Query(None, description="按标签ID筛选"),
     search: Optional[str] = Query(None, description="搜索关键词"),
     active_only: bool = Query(True, description="只显示活跃服务"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取服务列表"""
-    query = db.query(Service)
+    catalog = await get_catalog(db)
+    cached = catalog_not_modified(request, response, catalog.etag)
+    if cached is not None:
+        return cached
+    
+    services = catalog.services
     
     # 按标签筛选
     if tag_id:
-        query = query.filter(Service.tag_id == tag_id)
+        services = [service for service in services if service.tag_id == tag_id]
     
-    # 按关键词搜索
+    # 按关键词搜索（不区分大小写）
     if search:
-        query = query.filter(
-            or_(
-                Service.name.ilike(f"%{search}%"),
-                Service.description.ilike(f"%{search}%")
-            )
-        )
+        keyword = search.lower()
+        services = [
+            service for service in services
+            if keyword in service.name.lower() or keyword in (service.description or "").lower()
+        ]
     
     # 只显示活跃服务
     if active_only:
-        query = query.filter(Service.is_active == True)
+        services = [service for service in services if service.is_active]
     
-    services = query.all()
     return services
 
 @router.get("/image-age-transform", response_model=ServiceResponse)
-async def get_image_age_transform_service(db: Session = Depends(get_db)):
+async def get_image_age_transform_service(db: AsyncSession = Depends(get_async_db)):
     """获取图片年龄变换服务信息"""
-    service = db.query(Service).filter(Service.name == "图片年龄变换").first()
+    service = (await get_catalog(db)).by_name.get("图片年龄变换")
     if not service:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -81,23 +107,50 @@ async def get_image_age_transform_service(db: Session = Depends(get_db)):
 
 @router.get("/popular", response_model=List[ServiceResponse])
 async def get_popular_services(
+    request: Request,
+    response: Response,
     limit: int = Query(10, description="返回数量限制"),
-    db: Session = Depends(get_db)
+    window: str = Query("7d", description="统计窗口：24h 或 7d"),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """获取热门服务（按使用次数排序）"""
-    # 这里可以根据任务数量来排序，暂时返回前N个活跃服务
-    services = db.query(Service).filter(Service.is_active == True).limit(limit).all()
+    """获取热门服务（按统计窗口内的使用次数排序）"""
+    if window not in WINDOWS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"统计窗口只能是 {'、'.join(WINDOWS)}"
+        )
+    catalog = await get_catalog(db)
+    active_services = [service for service in catalog.services if service.is_active]
+    ranked = await get_popular_service_ids(window, len(catalog.services))
+    if ranked is None:
+        # 统计不可用时按服务顺序返回
+        services = active_services[:limit]
+    else:
+        services = [
+            catalog.by_id[service_id] for service_id, _ in ranked
+            if service_id in catalog.by_id and catalog.by_id[service_id].is_active
+        ]
+        # 窗口内没有使用记录的服务排在后面
+        ranked_ids = {service.id for service in services}
+        services = (services + [service for service in active_services if service.id not in ranked_ids])[:limit]
+    
+    # 排名随使用次数变化，ETag 由目录版本和排名共同决定
+    ranking = ",".join(str(service.id) for service in services)
+    etag = f'"{hashlib.sha256(f"{catalog.etag}:{ranking}".encode()).hexdigest()[:32]}"'
+    cached = catalog_not_modified(request, response, etag)
+    if cached is not None:
+        return cached
     return services
 
 @router.post("/", response_model=ServiceResponse)
 async def create_service(
     service_data: ServiceCreate,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_active_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_active_principal)
 ):
     """创建新服务（管理员功能）"""
     # 检查标签是否存在
-    tag = db.query(ServiceTag).filter(ServiceTag.id == service_data.tag_id).first()
+    tag = await db.get(ServiceTag, service_data.tag_id)
     if not tag:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -106,18 +159,19 @@ async def create_service(
     
     db_service = Service(**service_data.dict())
     db.add(db_service)
-    db.commit()
-    db.refresh(db_service)
+    await db.commit()
+    await db.refresh(db_service, attribute_names=["tag", "is_active", "created_at"])
+    await bump_catalog_version()
     
     return db_service
 
 @router.get("/{service_id}", response_model=ServiceResponse)
 async def get_service(
     service_id: int,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取单个服务详情"""
-    service = db.query(Service).filter(Service.id == service_id).first()
+    service = (await get_catalog(db)).by_id.get(service_id)
     if not service:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
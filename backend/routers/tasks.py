@@ -1,46 +1,191 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form, Query
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, case, tuple_, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload, defer
+from sqlalchemy.orm.attributes import set_committed_value
 from typing import List, Optional
+import asyncio
 import json
 import os
 from datetime import datetime
-from database import get_db
-from models import Task, Service, User, TaskStatus
-from schemas import TaskResponse, TaskCreate, ImageAgeTransformRequest, ImageAgeTransformResponse, MessageResponse
-from auth import get_current_active_user
-from tasks.image_age_transform import process_image_age_transform
+from database import get_async_db
+from models import Task, TaskBatch, Service, User, TaskStatus, utcnow
+from schemas import (
+    TaskResponse, TaskCreate, ImageAgeTransformRequest, ImageAgeTransformResponse,
+    ImageAgeTransformBatchResponse, TaskBatchResponse, MessageResponse
+)
+from auth import get_current_active_principal, get_current_admin_user, resolve_principal, verify_token
+from principal_cache import Principal, invalidate_principal
+from file_upload import (
+    save_upload_file, spool_upload_file, count_archive_images, extract_archive_images, remove_files, FileTooLargeError, ArchiveError
+)
+from storage import get_storage
+from credits import charge_task, charge_batch
+from result_cache import get_cached_result, get_cache_stats
+from provider_rate_limit import get_rate_limit_stats
+from task_events import task_event_broker
+from pagination import encode_cursor, decode_cursor
+from starlette.concurrency import run_in_threadpool
+from tasks.dispatch import dispatch_task, dispatch_tasks, get_service_handler
+from tasks.queues import get_queue_wait_stats
+from tiers import get_user_tier
+from catalog_cache import get_catalog, find_service, find_service_by_name
+from sla_stats import SLA_WINDOWS, get_sla_stats
+from service_popularity import record_service_usage
 from config import settings
 
 router = APIRouter()
 
+def task_query():
+    """任务查询（预加载服务及其标签，异步会话中不能隐式懒加载）"""
+    return select(Task).options(selectinload(Task.service).selectinload(Service.tag))
+
 @router.get("/", response_model=List[TaskResponse])
 async def get_user_tasks(
+    response: Response,
     status: Optional[TaskStatus] = Query(None, description="按状态筛选"),
-    limit: int = Query(20, description="返回数量限制"),
-    offset: int = Query(0, description="偏移量"),
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    limit: int = Query(20, ge=1, le=100, description="返回数量限制"),
+    cursor: Optional[str] = Query(None, description="分页游标（取自上一页响应头 X-Next-Cursor）"),
+    offset: int = Query(0, ge=0, description="偏移量（已弃用，深分页请使用 cursor）"),
+    batch_id: Optional[int] = Query(None, description="按批次筛选"),
+    current_user: Principal = Depends(get_current_active_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """获取用户任务列表"""
-    query = db.query(Task).filter(Task.user_id == current_user.id)
+    """获取用户任务列表（按创建时间倒序，下一页游标通过响应头 X-Next-Cursor 返回）"""
+    # 列表不加载结果图片数据：尚未完成后台迁移、仍内联图片的旧记录返回空输出
+    output_data = case(
+        (Task.inline_result.is_(True), None),
+        else_=Task.output_data
+    )
+    query = (
+        task_query()
+        .options(defer(Task.output_data))
+        .add_columns(output_data.label("output_data"))
+        .where(Task.user_id == current_user.id)
+    )
     
     if status:
-        query = query.filter(Task.status == status)
+        query = query.where(Task.status == status)
+    if batch_id is not None:
+        query = query.where(Task.batch_id == batch_id)
+    
+    # 键集分页：从游标位置继续扫描 (user_id, created_at, id) 索引，耗时与页码无关
+    if cursor:
+        try:
+            cursor_created_at, cursor_id = decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        query = query.where(tuple_(Task.created_at, Task.id) < (cursor_created_at, cursor_id))
+    elif offset:
+        query = query.offset(offset)
     
-    tasks = query.order_by(Task.created_at.desc()).offset(offset).limit(limit).all()
+    result = await db.execute(query.order_by(Task.created_at.desc(), Task.id.desc()).limit(limit))
+    tasks = []
+    for task, task_output in result.all():
+        set_committed_value(task, "output_data", task_output)
+        tasks.append(task)
+    
+    if len(tasks) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(tasks[-1].created_at, tasks[-1].id)
     return tasks
 
+@router.get("/events")
+async def stream_task_events(
+    request: Request,
+    token: str = Query(..., description="访问令牌（EventSource 无法设置请求头）"),
+    task_id: Optional[int] = Query(None, description="只订阅指定任务")
+):
+    """以 SSE 推送当前用户的任务状态变更"""
+    username = verify_token(token)
+    if username is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials")
+    
+    # 只在建立连接时解析一次身份，长连接期间不占用数据库连接
+    user = await resolve_principal(username)
+    if user is None or not user.is_active:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials")
+    
+    async def event_stream():
+        queue = task_event_broker.subscribe(user.id)
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    data = await asyncio.wait_for(queue.get(), timeout=settings.task_events_heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    # 心跳，防止代理断开空闲连接
+                    yield ": ping\n\n"
+                    continue
+                if task_id is not None and json.loads(data)["task_id"] != task_id:
+                    continue
+                yield f"event: task\ndata: {data}\n\n"
+        finally:
+            task_event_broker.unsubscribe(user.id, queue)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/result-cache/stats", response_model=dict)
+async def get_result_cache_stats(current_user: Principal = Depends(get_current_admin_user)):
+    """获取结果缓存命中统计（管理员功能）"""
+    return await get_cache_stats()
+
+@router.get("/queue-wait/stats", response_model=dict)
+async def get_queue_wait_statistics(current_user: Principal = Depends(get_current_admin_user)):
+    """获取各用户等级的任务排队耗时（管理员功能）"""
+    return await get_queue_wait_stats()
+
+@router.get("/provider-rate-limit/stats", response_model=dict)
+async def get_provider_rate_limit_stats(current_user: Principal = Depends(get_current_admin_user)):
+    """获取火山引擎全局限流配额使用情况（管理员功能）"""
+    return await get_rate_limit_stats()
+
+@router.get("/sla/stats", response_model=dict)
+async def get_task_sla_statistics(
+    window: str = Query("24h", description="统计窗口：1h、24h、7d 或 30d"),
+    service_id: Optional[int] = Query(None, description="只统计指定服务"),
+    current_user: Principal = Depends(get_current_admin_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    获取各服务的排队、处理及火山引擎调用耗时分位数（管理员功能）
+    由按小时汇总的 task_sla_rollups 计算，数据最多延迟 sla_rollup_interval_seconds
+    """
+    if window not in SLA_WINDOWS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"统计窗口只能是 {'、'.join(SLA_WINDOWS)}"
+        )
+    stats = await get_sla_stats(db, window, service_id)
+    catalog = await get_catalog(db)
+    return {
+        "window": window,
+        "services": [
+            {
+                "service_id": sid,
+                "service_name": catalog.by_id[sid].name if sid in catalog.by_id else None,
+                **service_stats,
+            }
+            for sid, service_stats in sorted(stats.items())
+        ],
+    }
+
 @router.get("/{task_id}", response_model=TaskResponse)
 async def get_task(
     task_id: int,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_active_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取单个任务详情"""
-    task = db.query(Task).filter(
+    result = await db.execute(task_query().where(
         Task.id == task_id,
         Task.user_id == current_user.id
-    ).first()
+    ))
+    task = result.scalar_one_or_none()
     
     if not task:
         raise HTTPException(
@@ -50,12 +195,32 @@ async def get_task(
     
     return task
 
+async def apply_cached_result(task: Task, file_sha256: str, target_age: int, file_path: str) -> bool:
+    """命中结果缓存时将任务直接置为完成，返回是否命中"""
+    cached_result = await get_cached_result(
+        file_sha256, target_age, settings.image_age_transform_req_key
+    )
+    if not cached_result or not await run_in_threadpool(get_storage().exists, cached_result["result_image_path"]):
+        return False
+    
+    now = utcnow()
+    task.status = TaskStatus.COMPLETED
+    task.output_data = json.dumps({
+        **cached_result,
+        "original_image_path": file_path,
+        "processed_at": now.isoformat(),
+        "cache_hit": True
+    })
+    task.started_at = now
+    task.completed_at = now
+    return True
+
 @router.post("/image-age-transform", response_model=ImageAgeTransformResponse)
 async def create_image_age_transform_task(
     target_age: int = Form(..., description="目标年龄：5或70"),
     image: UploadFile = File(..., description="上传的图片文件"),
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_active_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """创建图片年龄变换任务"""
     # 验证目标年龄
@@ -66,47 +231,44 @@ async def create_image_age_transform_task(
         )
     
     # 验证文件类型
-    if not image.content_type.startswith("image/"):
+    if not image.content_type or not image.content_type.startswith("image/"):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="只支持图片文件"
         )
     
-    # 验证文件大小
-    if image.size > settings.max_file_size:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"文件大小不能超过 {settings.max_file_size // (1024*1024)}MB"
-        )
-    
     # 获取服务信息
-    service = db.query(Service).filter(Service.name == "图片年龄变换").first()
+    service = await find_service_by_name(db, "图片年龄变换")
     if not service:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="服务不存在"
         )
     
-    # 检查用户积分
+    # 检查用户积分（快速预检，实际扣费时会再次原子校验）
     if current_user.credits < service.cost_credits:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="积分不足"
         )
     
-    # 保存上传的文件
-    os.makedirs(settings.upload_dir, exist_ok=True)
-    file_extension = os.path.splitext(image.filename)[1]
-    filename = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{current_user.id}{file_extension}"
-    file_path = os.path.join(settings.upload_dir, filename)
-    
-    with open(file_path, "wb") as buffer:
-        content = await image.read()
-        buffer.write(content)
+    # 流式保存上传的文件（分块写盘，超过大小限制立即中止）
+    filename_prefix = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{current_user.id}"
+    try:
+        file_path, file_size, file_sha256 = await save_upload_file(
+            image, settings.upload_dir, filename_prefix
+        )
+    except FileTooLargeError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"文件大小不能超过 {settings.max_file_size // (1024*1024)}MB"
+        )
     
     # 创建任务
     input_data = {
         "image_path": file_path,
+        "image_size": file_size,
+        "image_sha256": file_sha256,
         "target_age": target_age,
         "original_filename": image.filename
     }
@@ -115,76 +277,288 @@ async def create_image_age_transform_task(
         user_id=current_user.id,
         service_id=service.id,
         input_data=json.dumps(input_data),
-        credits_used=service.cost_credits
+        credits_used=service.cost_credits,
+        enqueued_at=utcnow()
     )
     
+    # 相同图片和参数命中结果缓存时直接完成任务，不再进入队列
+    await apply_cached_result(task, file_sha256, target_age, file_path)
+    
+    # 任务写入与积分扣除在同一事务中提交
     db.add(task)
-    db.commit()
-    db.refresh(task)
+    if await charge_task(db, current_user.id, task) is None:
+        await db.rollback()
+        await run_in_threadpool(get_storage().delete, file_path)
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="积分不足"
+        )
+    await db.commit()
+    await invalidate_principal(current_user.username)
+    await record_service_usage(service.id)
     
-    # 扣除用户积分
-    current_user.credits -= service.cost_credits
-    db.commit()
+    if task.status == TaskStatus.COMPLETED:
+        return {
+            "task_id": task.id,
+            "message": "任务已完成（命中结果缓存）"
+        }
     
-    # 异步处理任务
-    process_image_age_transform.delay(task.id)
+    # 异步处理任务，按用户等级进入对应的优先级队列
+    tier = await get_user_tier(db, current_user.id)
+    dispatch_task(service, task.id, tier)
     
     return {
         "task_id": task.id,
         "message": "任务已创建，正在处理中..."
     }
 
+@router.post("/image-age-transform/batch", response_model=ImageAgeTransformBatchResponse)
+async def create_image_age_transform_batch(
+    target_age: int = Form(..., description="目标年龄：5或70"),
+    images: Optional[List[UploadFile]] = File(None, description="上传的图片文件（可多选）"),
+    archive: Optional[UploadFile] = File(None, description="包含图片的 zip 压缩包"),
+    current_user: Principal = Depends(get_current_active_principal),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """批量创建图片年龄变换任务（一次扣费、一次提交、作为一个 Celery group 入队）"""
+    if target_age not in [5, 70]:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="目标年龄只能是5岁或70岁"
+        )
+    
+    images = images or []
+    if not images and archive is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="请上传图片或压缩包"
+        )
+    if len(images) > settings.batch_max_files:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"单个批次最多 {settings.batch_max_files} 张图片"
+        )
+    if any(not image.content_type or not image.content_type.startswith("image/") for image in images):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="只支持图片文件"
+        )
+    
+    service = await find_service_by_name(db, "图片年龄变换")
+    if not service:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="服务不存在"
+        )
+    
+    # 图片数量确定后立即检查积分，积分不足时不写入存储；压缩包只在本地暂存以读取目录
+    archive_path = None
+    # 已存入存储的图片: [(路径, 大小, SHA-256, 原始文件名)]，未提交时全部删除
+    saved = []
+    committed = False
+    try:
+        archive_images = 0
+        if archive is not None:
+            archive_path, _, _ = await spool_upload_file(archive, max_size=settings.batch_max_archive_size)
+            archive_images = await run_in_threadpool(count_archive_images, archive_path)
+        total_files = len(images) + archive_images
+        if total_files == 0:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="压缩包中没有图片"
+            )
+        if total_files > settings.batch_max_files:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"单个批次最多 {settings.batch_max_files} 张图片"
+            )
+        
+        # 检查用户积分（快速预检，实际扣费时会再次原子校验）
+        total_credits = service.cost_credits * total_files
+        if current_user.credits < total_credits:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="积分不足"
+            )
+        
+        filename_prefix = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{current_user.id}"
+        for image in images:
+            file_path, file_size, file_sha256 = await save_upload_file(
+                image, settings.upload_dir, filename_prefix
+            )
+            saved.append((file_path, file_size, file_sha256, image.filename))
+        if archive_path is not None:
+            # 解压出的图片逐个存入存储
+            saved.extend(await run_in_threadpool(
+                extract_archive_images, archive_path, settings.upload_dir,
+                filename_prefix, settings.batch_max_files - len(saved)
+            ))
+        
+        batch = TaskBatch(
+            user_id=current_user.id,
+            service_id=service.id,
+            total_tasks=len(saved),
+            credits_used=total_credits
+        )
+        db.add(batch)
+        await db.flush()
+        
+        tasks = []
+        cached_tasks = 0
+        for file_path, file_size, file_sha256, original_filename in saved:
+            task = Task(
+                user_id=current_user.id,
+                service_id=service.id,
+                batch_id=batch.id,
+                input_data=json.dumps({
+                    "image_path": file_path,
+                    "image_size": file_size,
+                    "image_sha256": file_sha256,
+                    "target_age": target_age,
+                    "original_filename": original_filename
+                }),
+                credits_used=service.cost_credits,
+                enqueued_at=utcnow()
+            )
+            if await apply_cached_result(task, file_sha256, target_age, file_path):
+                cached_tasks += 1
+            tasks.append(task)
+        
+        # 批次、全部任务与一次性扣费在同一事务中提交
+        db.add_all(tasks)
+        if await charge_batch(db, current_user.id, batch) is None:
+            await db.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="积分不足"
+            )
+        await db.commit()
+        committed = True
+    except FileTooLargeError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"文件大小不能超过 {e.max_size // (1024*1024)}MB"
+        )
+    except ArchiveError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    finally:
+        if archive_path is not None:
+            await run_in_threadpool(os.remove, archive_path)
+        if not committed:
+            await run_in_threadpool(remove_files, [path for path, _, _, _ in saved])
+    await invalidate_principal(current_user.username)
+    await record_service_usage(service.id, len(tasks))
+    
+    pending_ids = [task.id for task in tasks if task.status != TaskStatus.COMPLETED]
+    if pending_ids:
+        tier = await get_user_tier(db, current_user.id)
+        dispatch_tasks(service, pending_ids, tier)
+    
+    return {
+        "batch_id": batch.id,
+        "task_ids": [task.id for task in tasks],
+        "total_tasks": len(tasks),
+        "cached_tasks": cached_tasks,
+        "credits_used": total_credits,
+        "message": f"已创建 {len(tasks)} 个任务，其中 {cached_tasks} 个命中结果缓存"
+    }
+
+@router.get("/batches/{batch_id}", response_model=TaskBatchResponse)
+async def get_task_batch(
+    batch_id: int,
+    current_user: Principal = Depends(get_current_active_principal),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """获取批次的整体进度"""
+    batch = await db.get(TaskBatch, batch_id)
+    if not batch or batch.user_id != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="批次不存在"
+        )
+    
+    result = await db.execute(
+        select(Task.status, func.count())
+        .where(Task.batch_id == batch_id)
+        .group_by(Task.status)
+    )
+    counts = {task_status.value: count for task_status, count in result.all()}
+    finished = counts.get(TaskStatus.COMPLETED.value, 0) + counts.get(TaskStatus.FAILED.value, 0)
+    
+    return TaskBatchResponse(
+        id=batch.id,
+        service_id=batch.service_id,
+        total_tasks=batch.total_tasks,
+        credits_used=batch.credits_used,
+        created_at=batch.created_at,
+        progress=finished / batch.total_tasks if batch.total_tasks else 0.0,
+        **counts
+    )
+
 @router.post("/", response_model=TaskResponse)
 async def create_task(
     task_data: TaskCreate,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_active_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """创建通用任务"""
     # 获取服务信息
-    service = db.query(Service).filter(Service.id == task_data.service_id).first()
+    service = await find_service(db, task_data.service_id)
     if not service:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="服务不存在"
         )
     
-    # 检查用户积分
-    if current_user.credits < service.cost_credits:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="积分不足"
-        )
+    # 已登记处理器且支持通用输入的服务直接投递，其余服务由各自的接口或外部流程处理
+    handler = get_service_handler(service)
+    dispatch = handler is not None and handler.generic
     
-    # 创建任务
+    # 创建任务，任务写入与积分扣除在同一事务中提交
     task = Task(
         user_id=current_user.id,
         service_id=service.id,
         input_data=task_data.input_data,
-        credits_used=service.cost_credits
+        credits_used=service.cost_credits,
+        enqueued_at=utcnow() if dispatch else None
     )
     
     db.add(task)
-    db.commit()
-    db.refresh(task)
+    if await charge_task(db, current_user.id, task) is None:
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="积分不足"
+        )
+    await db.commit()
+    await invalidate_principal(current_user.username)
+    await record_service_usage(service.id)
     
-    # 扣除用户积分
-    current_user.credits -= service.cost_credits
-    db.commit()
+    if dispatch:
+        tier = await get_user_tier(db, current_user.id)
+        dispatch_task(service, task.id, tier)
     
-    return task
+    # 重新加载任务及其服务信息用于响应
+    result = await db.execute(
+        task_query().where(Task.id == task.id).execution_options(populate_existing=True)
+    )
+    return result.scalar_one()
 
 @router.delete("/{task_id}", response_model=MessageResponse)
 async def delete_task(
     task_id: int,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_active_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """删除任务"""
-    task = db.query(Task).filter(
+    result = await db.execute(select(Task).where(
         Task.id == task_id,
         Task.user_id == current_user.id
-    ).first()
+    ))
+    task = result.scalar_one_or_none()
     
     if not task:
         raise HTTPException(
@@ -199,7 +573,7 @@ async def delete_task(
             detail="无法删除正在处理的任务"
         )
     
-    db.delete(task)
-    db.commit()
+    await db.delete(task)
+    await db.commit()
     
     return {"message": "任务已删除"}
\ No newline at end of file
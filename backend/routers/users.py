@@ -1,14 +1,17 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from database import get_db
-from models import User
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_async_db
+from models import User, CreditReason
+from credits import add_credits as add_user_credits
 from schemas import UserResponse, UserUpdate, MessageResponse
-from auth import get_current_active_user, get_password_hash
+from auth import get_current_active_user, get_current_active_principal, get_password_hash_async
+from principal_cache import Principal, invalidate_principal
 
 router = APIRouter()
 
 @router.get("/me", response_model=UserResponse)
-async def get_current_user_info(current_user: User = Depends(get_current_active_user)):
+async def get_current_user_info(current_user: Principal = Depends(get_current_active_principal)):
     """获取当前用户信息"""
     return current_user
 
@@ -16,16 +19,17 @@ async def get_current_user_info(current_user: User = Depends(get_current_active_
 async def update_current_user(
     user_update: UserUpdate,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """更新当前用户信息"""
     # 更新邮箱
     if user_update.email:
         # 检查邮箱是否已被其他用户使用
-        existing_user = db.query(User).filter(
+        result = await db.execute(select(User.id).where(
             User.email == user_update.email,
             User.id != current_user.id
-        ).first()
+        ))
+        existing_user = result.first()
         if existing_user:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -35,23 +39,24 @@ async def update_current_user(
     
     # 更新密码
     if user_update.password:
-        current_user.hashed_password = get_password_hash(user_update.password)
+        current_user.hashed_password = await get_password_hash_async(user_update.password)
     
-    db.commit()
-    db.refresh(current_user)
+    await db.commit()
+    await db.refresh(current_user)
+    await invalidate_principal(current_user.username)
     
     return current_user
 
 @router.get("/credits", response_model=dict)
-async def get_user_credits(current_user: User = Depends(get_current_active_user)):
+async def get_user_credits(current_user: Principal = Depends(get_current_active_principal)):
     """获取用户积分"""
     return {"credits": current_user.credits}
 
 @router.post("/credits/add", response_model=MessageResponse)
 async def add_credits(
     credits: int,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_active_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """添加积分（管理员功能或测试用）"""
     if credits <= 0:
@@ -60,7 +65,8 @@ async def add_credits(
             detail="积分数量必须大于0"
         )
     
-    current_user.credits += credits
-    db.commit()
+    balance = await add_user_credits(db, current_user.id, credits, CreditReason.ADJUSTMENT)
+    await db.commit()
+    await invalidate_principal(current_user.username)
     
-    return {"message": f"成功添加 {credits} 积分，当前积分: {current_user.credits}"}
\ No newline at end of file
+    return {"message": f"成功添加 {credits} 积分，当前积分: {balance}"}
\ No newline at end of file
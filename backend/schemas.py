@@ -106,6 +106,26 @@ class ImageAgeTransformResponse(BaseModel):
     task_id: int
     message: str
 
+class ImageAgeTransformBatchResponse(BaseModel):
+    batch_id: int
+    task_ids: List[int]
+    total_tasks: int
+    cached_tasks: int  # 命中结果缓存、已直接完成的任务数
+    credits_used: int
+    message: str
+
+class TaskBatchResponse(BaseModel):
+    id: int
+    service_id: int
+    total_tasks: int
+    credits_used: int
+    created_at: datetime
+    pending: int = 0
+    processing: int = 0
+    completed: int = 0
+    failed: int = 0
+    progress: float = 0.0  # 已结束（完成或失败）任务占比
+
 # 支付模式
 class PaymentBase(BaseModel):
     amount: float
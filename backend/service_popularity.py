@@ -0,0 +1,77 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from redis.exceptions import RedisError
+from redis_client import get_redis, get_async_redis
+
+logger = logging.getLogger(__name__)
+
+# 按小时分桶的服务使用次数（有序集合，member 为服务ID）: aigc:popular:hour:{YYYYMMDDHH}
+KEY_PREFIX = "aigc:popular"
+# 统计窗口及包含的小时数，窗口集合由小时桶定期汇总，读取时只需一次 ZREVRANGE
+WINDOWS = {"24h": 24, "7d": 7 * 24}
+# 小时桶保留时间（比最大窗口多一天）
+BUCKET_TTL_SECONDS = (max(WINDOWS.values()) + 24) * 3600
+
+def _bucket_key(hour: datetime) -> str:
+    return f"{KEY_PREFIX}:hour:{hour.strftime('%Y%m%d%H')}"
+
+def _window_key(window: str) -> str:
+    return f"{KEY_PREFIX}:window:{window}"
+
+def current_hour() -> datetime:
+    return datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+
+async def record_service_usage(service_id: int, count: int = 1):
+    """任务提交后累加服务使用次数（当前小时桶及各窗口集合）"""
+    try:
+        pipe = get_async_redis().pipeline(transaction=False)
+        bucket = _bucket_key(current_hour())
+        pipe.zincrby(bucket, count, service_id)
+        pipe.expire(bucket, BUCKET_TTL_SECONDS)
+        for window in WINDOWS:
+            pipe.zincrby(_window_key(window), count, service_id)
+        await pipe.execute()
+    except RedisError as e:
+        logger.warning(f"记录服务使用次数失败: {e}")
+
+async def get_popular_service_ids(window: str, limit: int) -> Optional[List[Tuple[int, int]]]:
+    """
+    按窗口内使用次数倒序获取服务
+    :return: [(服务ID, 使用次数)]，Redis 不可用时返回 None
+    """
+    try:
+        ranked = await get_async_redis().zrevrange(_window_key(window), 0, limit - 1, withscores=True)
+    except RedisError as e:
+        logger.warning(f"读取热门服务失败: {e}")
+        return None
+    return [(int(member), int(score)) for member, score in ranked]
+
+def rollup_windows():
+    """由小时桶重新汇总各窗口集合，移出窗口的小时不再计入"""
+    redis = get_redis()
+    hour = current_hour()
+    for window, hours in WINDOWS.items():
+        buckets = [_bucket_key(hour - timedelta(hours=i)) for i in range(hours)]
+        # 先汇总到临时键再原子替换，读取方不会看到空集合
+        temp_key = f"{_window_key(window)}:rebuild"
+        if redis.zunionstore(temp_key, buckets):
+            redis.rename(temp_key, _window_key(window))
+        else:
+            redis.delete(_window_key(window))
+
+def replace_hourly_counts(counts: Dict[datetime, Dict[int, int]], since: datetime):
+    """用数据库统计结果覆盖 since 之后的小时桶（对账）"""
+    redis = get_redis()
+    pipe = redis.pipeline()
+    hour = since
+    end = current_hour()
+    while hour <= end:
+        key = _bucket_key(hour)
+        pipe.delete(key)
+        members = counts.get(hour)
+        if members:
+            pipe.zadd(key, {str(service_id): count for service_id, count in members.items()})
+            pipe.expire(key, BUCKET_TTL_SECONDS)
+        hour += timedelta(hours=1)
+    pipe.execute()
@@ -0,0 +1,174 @@
+import json
+import math
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+from sqlalchemy import select, case, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from models import Task, TaskSlaRollup, TaskStatus
+from service_popularity import current_hour
+
+# 统计窗口及包含的小时数（含当前小时）
+SLA_WINDOWS = {"1h": 1, "24h": 24, "7d": 7 * 24, "30d": 30 * 24}
+# 汇总的耗时指标及对应的任务字段
+SLA_METRICS = {
+    "queue_wait": Task.queue_wait_ms,
+    "processing": Task.processing_ms,
+    "provider": Task.provider_ms,
+}
+# 对数分桶相邻边界之比，分位数的相对误差不超过约 2.5%（修改后需以 rollup_task_sla(hours=720) 重算全部汇总）
+BUCKET_GROWTH = 1.05
+
+def to_utc(value: datetime) -> datetime:
+    """统一为带时区的 UTC 时间（早期 worker 写入的是不带时区的 UTC 时间）"""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+def utc_hour(value: datetime) -> datetime:
+    return to_utc(value).replace(minute=0, second=0, microsecond=0)
+
+def duration_ms(start: Optional[datetime], end: Optional[datetime]) -> Optional[int]:
+    """两个时间点之间的毫秒数，任一为空时返回 None"""
+    if start is None or end is None:
+        return None
+    return max(0, round((to_utc(end) - to_utc(start)).total_seconds() * 1000))
+
+def bucket_index_expr(column):
+    """SQL 中计算耗时所在的桶：桶 0 为不足 1ms，桶 i 覆盖 [g^(i-1), g^i)"""
+    return case((column < 1, 0), else_=func.floor(func.ln(column) / math.log(BUCKET_GROWTH)) + 1)
+
+def bucket_value(index: int) -> float:
+    # 取桶边界的几何中点作为代表值
+    return 0.0 if index == 0 else BUCKET_GROWTH ** (index - 0.5)
+
+class LatencyHistogram:
+    """对数分桶的耗时直方图，可按小时汇总后合并，计算任意窗口的分位数"""
+
+    def __init__(self, counts: Optional[Dict[int, int]] = None, total: float = 0.0, maximum: float = 0.0):
+        self.counts = defaultdict(int, counts or {})
+        self.total = total
+        self.maximum = maximum
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts.values())
+
+    def add_bucket(self, index: int, count: int, total: float, maximum: float):
+        self.counts[index] += count
+        self.total += total
+        self.maximum = max(self.maximum, maximum)
+
+    def merge(self, other: "LatencyHistogram"):
+        for index, count in other.counts.items():
+            self.counts[index] += count
+        self.total += other.total
+        self.maximum = max(self.maximum, other.maximum)
+
+    def percentile(self, pct: float) -> float:
+        count = self.count
+        if not count:
+            return 0.0
+        rank = max(1, math.ceil(pct / 100 * count))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return round(min(bucket_value(index), float(self.maximum)), 1)
+        return round(float(self.maximum), 1)
+
+    def summary(self) -> dict:
+        count = self.count
+        return {
+            "count": count,
+            "avg_ms": round(self.total / count, 1) if count else 0.0,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "p99_ms": self.percentile(99),
+            "max_ms": round(float(self.maximum), 1),
+        }
+
+    def to_dict(self) -> dict:
+        return {"counts": {str(i): n for i, n in self.counts.items()}, "total": self.total, "max": self.maximum}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "LatencyHistogram":
+        return cls({int(i): n for i, n in data["counts"].items()}, data["total"], data["max"])
+
+def _empty_rollup() -> dict:
+    return {"completed": 0, "failed": 0, "histograms": {name: LatencyHistogram() for name in SLA_METRICS}}
+
+def rebuild_rollups(db: Session, since: datetime) -> int:
+    """
+    根据 tasks 表重算 since 之后各小时的 SLA 汇总（同步会话，定时任务使用）
+    只统计由 worker 处理过（记录了 processing_ms）的任务，命中结果缓存的任务不计入
+    :return: 汇总的任务数
+    """
+    since = utc_hour(since)
+    # 分桶和计数在数据库中完成（PostgreSQL），只返回 服务 x 小时 x 桶 的聚合结果
+    hour = func.date_trunc("hour", func.timezone("UTC", Task.completed_at))
+    processed = [Task.completed_at >= since, Task.processing_ms.is_not(None)]
+
+    rollups: Dict[Tuple[int, datetime], dict] = defaultdict(_empty_rollup)
+    total = 0
+    for service_id, task_hour, task_status, count in db.execute(
+        select(Task.service_id, hour, Task.status, func.count())
+        .where(*processed)
+        .group_by(Task.service_id, hour, Task.status)
+    ):
+        rollups[(service_id, utc_hour(task_hour))]["failed" if task_status == TaskStatus.FAILED else "completed"] += count
+        total += count
+
+    for name, column in SLA_METRICS.items():
+        bucket = bucket_index_expr(column)
+        for service_id, task_hour, index, count, column_total, maximum in db.execute(
+            select(Task.service_id, hour, bucket, func.count(), func.sum(column), func.max(column))
+            .where(*processed, column.is_not(None))
+            .group_by(Task.service_id, hour, bucket)
+        ):
+            rollups[(service_id, utc_hour(task_hour))]["histograms"][name].add_bucket(
+                int(index), count, float(column_total), float(maximum)
+            )
+
+    # 覆盖重算范围内的汇总（整段替换，重复执行结果相同）
+    db.query(TaskSlaRollup).filter(TaskSlaRollup.hour >= since).delete(synchronize_session=False)
+    db.add_all(
+        TaskSlaRollup(
+            service_id=service_id,
+            hour=hour,
+            completed=rollup["completed"],
+            failed=rollup["failed"],
+            histograms=json.dumps({name: h.to_dict() for name, h in rollup["histograms"].items()}),
+        )
+        for (service_id, hour), rollup in rollups.items()
+    )
+    db.commit()
+    return total
+
+async def get_sla_stats(db: AsyncSession, window: str, service_id: Optional[int] = None) -> Dict[int, dict]:
+    """
+    按服务合并窗口内的小时汇总，计算排队、处理和火山引擎调用耗时的分位数
+    :return: {服务ID: 统计}
+    """
+    since = current_hour().replace(tzinfo=timezone.utc) - timedelta(hours=SLA_WINDOWS[window] - 1)
+    query = select(TaskSlaRollup).where(TaskSlaRollup.hour >= since)
+    if service_id is not None:
+        query = query.where(TaskSlaRollup.service_id == service_id)
+    rollups: Dict[int, dict] = defaultdict(_empty_rollup)
+    for row in (await db.execute(query)).scalars():
+        rollup = rollups[row.service_id]
+        rollup["completed"] += row.completed
+        rollup["failed"] += row.failed
+        for name, data in json.loads(row.histograms).items():
+            if name in rollup["histograms"]:
+                rollup["histograms"][name].merge(LatencyHistogram.from_dict(data))
+
+    return {
+        service_id: {
+            "completed": rollup["completed"],
+            "failed": rollup["failed"],
+            **{name: histogram.summary() for name, histogram in rollup["histograms"].items()},
+        }
+        for service_id, rollup in rollups.items()
+    }
@@ -0,0 +1,198 @@
+import logging
+import mimetypes
+import os
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import ContextManager, Iterator, Optional
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class ObjectInfo:
+    """存储对象的元数据"""
+    size: int
+    mtime: float
+
+class Storage(ABC):
+    """
+    存储后端接口
+    上传图片和结果文件以 key 标识（如 uploads/xxx.jpg、outputs/result_1.png），
+    key 与本地存储下的相对路径一致，历史任务记录中的路径无需迁移
+    """
+
+    @abstractmethod
+    def store_file(self, key: str, local_path: str, cache_control: Optional[str] = None):
+        """把本地临时文件存入存储，完成后本地文件不再保留"""
+
+    @abstractmethod
+    def put_bytes(self, key: str, data: bytes, cache_control: Optional[str] = None):
+        """写入对象（整体可见，不会读到写了一半的内容）"""
+
+    @abstractmethod
+    def stat(self, key: str) -> ObjectInfo:
+        """获取对象元数据，不存在时抛出 FileNotFoundError"""
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.stat(key)
+        except FileNotFoundError:
+            return False
+        return True
+
+    @abstractmethod
+    def delete(self, key: str):
+        """删除对象（不存在时忽略）"""
+
+    @abstractmethod
+    def local_copy(self, key: str) -> ContextManager[str]:
+        """在本地文件系统上访问对象（对象存储下载到临时文件，退出时删除）"""
+
+    def local_path(self, key: str) -> Optional[str]:
+        """对象在本地文件系统上的路径，非本地存储返回 None"""
+        return None
+
+    def presigned_url(self, key: str) -> Optional[str]:
+        """客户端直接下载对象的预签名地址，本地存储返回 None（由 API 提供文件）"""
+        return None
+
+class LocalStorage(Storage):
+    """本地目录存储（API 与 worker 需共享同一个目录）"""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def store_file(self, key: str, local_path: str, cache_control: Optional[str] = None):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        os.replace(local_path, path)
+
+    def put_bytes(self, key: str, data: bytes, cache_control: Optional[str] = None):
+        # 先写同目录下的临时文件再原子重命名
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def stat(self, key: str) -> ObjectInfo:
+        stat_result = os.stat(self._path(key))
+        return ObjectInfo(size=stat_result.st_size, mtime=stat_result.st_mtime)
+
+    def exists(self, key: str) -> bool:
+        return os.path.isfile(self._path(key))
+
+    def delete(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    @contextmanager
+    def local_copy(self, key: str) -> Iterator[str]:
+        yield self._path(key)
+
+    def local_path(self, key: str) -> Optional[str]:
+        return self._path(key)
+
+class S3Storage(Storage):
+    """S3 兼容对象存储（AWS S3、MinIO 等），API 与 worker 可以部署在不同节点"""
+
+    def __init__(self):
+        import boto3
+        from botocore.config import Config
+
+        self.bucket = settings.s3_bucket
+        options = {
+            "region_name": settings.s3_region,
+            "aws_access_key_id": settings.s3_access_key,
+            "aws_secret_access_key": settings.s3_secret_key,
+            "config": Config(
+                signature_version="s3v4",
+                max_pool_connections=settings.s3_max_pool_connections,
+                s3={"addressing_style": settings.s3_addressing_style},
+            ),
+        }
+        self.client = boto3.client("s3", endpoint_url=settings.s3_endpoint_url, **options)
+        # 预签名地址由浏览器访问，内外网地址不同时（如容器内通过 minio:9000 访问）使用公开地址签名
+        self.presign_client = (
+            boto3.client("s3", endpoint_url=settings.s3_public_endpoint_url, **options)
+            if settings.s3_public_endpoint_url else self.client
+        )
+
+    @staticmethod
+    def _extra_args(key: str, cache_control: Optional[str]) -> dict:
+        args = {"ContentType": mimetypes.guess_type(key)[0] or "application/octet-stream"}
+        if cache_control:
+            args["CacheControl"] = cache_control
+        return args
+
+    def store_file(self, key: str, local_path: str, cache_control: Optional[str] = None):
+        # upload_file 按块读取本地文件，大文件自动使用分片上传
+        self.client.upload_file(local_path, self.bucket, key, ExtraArgs=self._extra_args(key, cache_control))
+        os.remove(local_path)
+
+    def put_bytes(self, key: str, data: bytes, cache_control: Optional[str] = None):
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=data, **self._extra_args(key, cache_control))
+
+    def stat(self, key: str) -> ObjectInfo:
+        from botocore.exceptions import ClientError
+
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                raise FileNotFoundError(key)
+            raise
+        return ObjectInfo(size=head["ContentLength"], mtime=head["LastModified"].timestamp())
+
+    def delete(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    @contextmanager
+    def local_copy(self, key: str) -> Iterator[str]:
+        fd, temp_path = tempfile.mkstemp(suffix=os.path.splitext(key)[1])
+        os.close(fd)
+        try:
+            # download_file 分块写入本地文件，不会把整个对象读入内存
+            self.client.download_file(self.bucket, key, temp_path)
+            yield temp_path
+        finally:
+            os.remove(temp_path)
+
+    def presigned_url(self, key: str) -> Optional[str]:
+        return self.presign_client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": key},
+            ExpiresIn=settings.s3_presign_expires_seconds,
+        )
+
+_storage: Optional[Storage] = None
+_storage_lock = threading.Lock()
+
+def get_storage() -> Storage:
+    """获取当前进程的存储后端（按 storage_backend 配置创建，进程内复用）"""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                if settings.storage_backend == "s3":
+                    _storage = S3Storage()
+                elif settings.storage_backend == "local":
+                    _storage = LocalStorage(settings.storage_local_root)
+                else:
+                    raise ValueError(f"不支持的存储后端: {settings.storage_backend}")
+                logger.info(f"使用存储后端: {settings.storage_backend}")
+    return _storage
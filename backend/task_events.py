@@ -0,0 +1,105 @@
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from typing import Dict, Optional, Set
+from redis.exceptions import RedisError
+from models import Task
+from redis_client import get_redis, get_async_redis
+
+logger = logging.getLogger(__name__)
+
+# 任务状态事件频道前缀，按用户划分: aigc:task_events:{user_id}
+CHANNEL_PREFIX = "aigc:task_events"
+
+def task_event_channel(user_id: int) -> str:
+    """用户的任务事件频道"""
+    return f"{CHANNEL_PREFIX}:{user_id}"
+
+def task_event_payload(task: Task) -> dict:
+    """任务状态事件内容（只包含状态信息，结果详情由客户端按需获取）"""
+    return {
+        "task_id": task.id,
+        "status": task.status.value if task.status else None,
+        "error_message": task.error_message,
+        "started_at": task.started_at.isoformat() if task.started_at else None,
+        "completed_at": task.completed_at.isoformat() if task.completed_at else None,
+    }
+
+def publish_task_event(task: Task):
+    """发布任务状态变更事件（Celery worker 使用）"""
+    try:
+        get_redis().publish(task_event_channel(task.user_id), json.dumps(task_event_payload(task)))
+    except RedisError as e:
+        logger.warning(f"发布任务 {task.id} 状态事件失败: {e}")
+
+class TaskEventBroker:
+    """
+    进程内任务事件分发
+    每个 API 进程只维护一个 Redis 订阅连接，收到的事件按用户分发到各订阅者的本地队列，
+    空闲订阅者只占用一个 asyncio.Queue
+    """
+
+    def __init__(self, queue_size: int = 100):
+        self.queue_size = queue_size
+        self._subscribers: Dict[int, Set[asyncio.Queue]] = defaultdict(set)
+        self._listener: Optional[asyncio.Task] = None
+
+    @property
+    def subscriber_count(self) -> int:
+        return sum(len(queues) for queues in self._subscribers.values())
+
+    def subscribe(self, user_id: int) -> asyncio.Queue:
+        """订阅用户的任务事件"""
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers[user_id].add(queue)
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+        return queue
+
+    def unsubscribe(self, user_id: int, queue: asyncio.Queue):
+        """取消订阅"""
+        queues = self._subscribers.get(user_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._subscribers[user_id]
+
+    def _dispatch(self, channel: str, data: str):
+        user_id = int(channel.rsplit(":", 1)[1])
+        for queue in list(self._subscribers.get(user_id, ())):
+            try:
+                queue.put_nowait(data)
+            except asyncio.QueueFull:
+                # 消费过慢的订阅者丢弃事件，客户端可通过任务详情接口补齐
+                logger.warning(f"用户 {user_id} 的任务事件队列已满，事件被丢弃")
+
+    async def _listen(self):
+        while True:
+            pubsub = get_async_redis().pubsub()
+            try:
+                await pubsub.psubscribe(f"{CHANNEL_PREFIX}:*")
+                async for message in pubsub.listen():
+                    if message["type"] == "pmessage":
+                        self._dispatch(message["channel"], message["data"])
+            except asyncio.CancelledError:
+                raise
+            except (RedisError, OSError) as e:
+                logger.warning(f"任务事件订阅连接断开，1秒后重连: {e}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+    async def close(self):
+        """停止订阅（应用关闭时调用）"""
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+# 进程级单例
+task_event_broker = TaskEventBroker()
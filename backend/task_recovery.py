@@ -0,0 +1,115 @@
+"""
+任务执行租约与失败恢复（Celery worker 使用）
+worker 领取任务时获得租约并在执行期间定期续租，worker 崩溃或失联后租约过期，
+由定时任务 tasks.maintenance.reclaim_stale_tasks 重新入队或标记失败
+"""
+import logging
+import os
+import random
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import and_, or_, select, update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+from config import settings
+from database import engine
+from models import Task, TaskStatus, utcnow
+
+logger = logging.getLogger(__name__)
+
+def new_lease_owner() -> str:
+    """本次执行的租约持有者标识（同一进程内多个线程执行的任务也互不相同）"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+def lease_expired(now: datetime):
+    """租约已过期的条件；没有租约的处理中任务（升级前开始执行）超过较长的超时时间后也视为过期"""
+    legacy_deadline = now - timedelta(seconds=settings.task_legacy_processing_timeout_seconds)
+    return or_(
+        Task.lease_expires_at < now,
+        and_(Task.lease_expires_at.is_(None), Task.started_at < legacy_deadline),
+    )
+
+def claim_task(db: Session, task_id: int, owner: str) -> bool:
+    """
+    领取排队中的任务：置为处理中并写入租约，返回是否领取成功
+    同一任务的重复消息（worker 崩溃后重新投递、回收后再次入队）只有一条能领取成功，其余直接跳过
+    """
+    now = utcnow()
+    result = db.execute(
+        update(Task)
+        .where(Task.id == task_id, Task.status == TaskStatus.PENDING)
+        .values(
+            status=TaskStatus.PROCESSING,
+            started_at=now,
+            lease_owner=owner,
+            lease_expires_at=now + timedelta(seconds=settings.task_lease_seconds),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return result.rowcount == 1
+
+def renew_lease(task_id: int, owner: str) -> bool:
+    """续租（使用独立连接，不影响任务会话中的事务），租约已不属于 owner 时返回 False"""
+    with engine.begin() as conn:
+        result = conn.execute(
+            update(Task)
+            .where(Task.id == task_id, Task.lease_owner == owner, Task.status == TaskStatus.PROCESSING)
+            .values(lease_expires_at=utcnow() + timedelta(seconds=settings.task_lease_seconds))
+        )
+    return result.rowcount == 1
+
+def holds_lease(db: Session, task_id: int, owner: str) -> bool:
+    """
+    锁定任务行并确认租约仍属于 owner（写入执行结果前调用）
+    行锁持续到事务结束，回收任务不会在确认之后、提交之前改写任务
+    """
+    current = db.execute(
+        select(Task.lease_owner).where(Task.id == task_id).with_for_update()
+    ).scalar_one_or_none()
+    return current == owner
+
+def release_lease(task: Task):
+    """清除任务上的租约（随任务结束或重新排队一起提交）"""
+    task.lease_owner = None
+    task.lease_expires_at = None
+
+def retry_countdown(retries: int) -> float:
+    """临时性错误的重试延迟：按重试次数指数增长的随机退避（full jitter），避免同时重试再次拥塞"""
+    backoff = min(settings.task_retry_backoff_max_seconds, settings.task_retry_backoff_base_seconds * 2 ** retries)
+    return random.uniform(0, backoff)
+
+class LeaseHeartbeat:
+    """
+    任务执行期间在后台线程中定期续租，stop() 后停止
+    租约被回收后停止续租，本次执行的结果在提交前由 holds_lease 检查后丢弃
+    """
+
+    def __init__(self, task_id: int, owner: str):
+        self.task_id = task_id
+        self.owner = owner
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"task-lease-{task_id}", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(settings.task_heartbeat_interval_seconds):
+            try:
+                renewed = renew_lease(self.task_id, self.owner)
+            except SQLAlchemyError as e:
+                # 数据库暂时不可用时继续尝试，租约在到期前仍然有效
+                logger.warning(f"任务 {self.task_id} 续租失败: {e}")
+                continue
+            if not renewed:
+                # 任务刚结束（已释放租约）时也会续租失败，此时不是租约被回收
+                if not self._stop.is_set():
+                    logger.warning(f"任务 {self.task_id} 的租约已被回收，停止续租")
+                return
@@ -1,5 +1,9 @@
+import os
 from celery import Celery
+from celery.signals import worker_ready, worker_process_shutdown
 from config import settings
+from metrics import start_metrics_server, mark_process_dead
+from tasks.queues import TASK_QUEUES, QUEUE_HIGH, QUEUE_DEFAULT, QUEUE_LOW
 
 # 创建Celery应用
 celery = Celery(
@@ -8,6 +12,7 @@ celery = Celery(
     backend=settings.celery_result_backend,
     include=[
         "tasks.image_age_transform",
+        "tasks.maintenance",
     ]
 )
 
@@ -23,4 +28,45 @@ celery.conf.update(
     task_soft_time_limit=25 * 60,  # 25分钟软超时
     worker_prefetch_multiplier=1,  # 每次只处理一个任务
     worker_max_tasks_per_child=1000,
-)
\ No newline at end of file
+    # 优先级队列：API 按用户等级投递，未指定队列的任务进入 default
+    task_queues=TASK_QUEUES,
+    task_default_queue=QUEUE_DEFAULT,
+    # 过期任务回收进入 high 队列，不排在积压的普通任务之后
+    task_routes={
+        "tasks.maintenance.reclaim_stale_tasks": {"queue": QUEUE_HIGH},
+        "tasks.maintenance.*": {"queue": QUEUE_LOW},
+    },
+    # worker 订阅多个队列时按 worker_queue_weights 加权决定拉取顺序（Redis 传输）
+    broker_transport_options={"queue_order_strategy": "tasks.queues:weighted_cycle"},
+    # 定时任务（需运行 celery beat）
+    beat_schedule={
+        "rollup-service-popularity": {
+            "task": "tasks.maintenance.rollup_service_popularity",
+            "schedule": settings.popular_rollup_interval_seconds,
+        },
+        "reconcile-service-popularity": {
+            "task": "tasks.maintenance.reconcile_service_popularity",
+            "schedule": settings.popular_reconcile_interval_seconds,
+        },
+        "rollup-task-sla": {
+            "task": "tasks.maintenance.rollup_task_sla",
+            "schedule": settings.sla_rollup_interval_seconds,
+        },
+        "reclaim-stale-tasks": {
+            "task": "tasks.maintenance.reclaim_stale_tasks",
+            "schedule": settings.task_reaper_interval_seconds,
+            # 未及时执行的回收直接丢弃，由下一次调度接替
+            "options": {"expires": settings.task_reaper_interval_seconds},
+        },
+    },
+)
+
+@worker_ready.connect
+def _start_worker_metrics(**kwargs):
+    # 由 worker 主进程暴露指标，多进程模式下汇总各子进程写入的数据
+    if settings.metrics_enabled and settings.worker_metrics_port:
+        start_metrics_server(settings.worker_metrics_port)
+
+@worker_process_shutdown.connect
+def _cleanup_worker_metrics(pid=None, **kwargs):
+    mark_process_dead(pid or os.getpid())
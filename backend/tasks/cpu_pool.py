@@ -0,0 +1,42 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+from celery.signals import worker_shutdown
+from config import settings
+
+# I/O 模式（threads 池）下图片解码/编码等 CPU 密集操作交给独立进程，避免占用 GIL 拖慢其他在途任务
+_executor: Optional[ProcessPoolExecutor] = None
+_lock = threading.Lock()
+
+def _get_executor() -> Optional[ProcessPoolExecutor]:
+    global _executor
+    if settings.image_cpu_workers <= 0:
+        return None
+    # prefork 子进程是守护进程，不能再创建子进程，此时直接在当前进程执行
+    if multiprocessing.current_process().daemon:
+        return None
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                # 进程池在多线程环境中按需创建，使用 spawn 避免 fork 继承其他线程持有的锁
+                _executor = ProcessPoolExecutor(
+                    max_workers=settings.image_cpu_workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+    return _executor
+
+def run_cpu_bound(fn, *args, **kwargs):
+    """执行 CPU 密集函数：有进程池时提交到进程池并等待结果，否则在当前线程执行"""
+    executor = _get_executor()
+    if executor is None:
+        return fn(*args, **kwargs)
+    return executor.submit(fn, *args, **kwargs).result()
+
+@worker_shutdown.connect
+def shutdown_cpu_pool(**kwargs):
+    """worker 退出时关闭进程池"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
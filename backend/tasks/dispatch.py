@@ -0,0 +1,43 @@
+from dataclasses import dataclass
+from typing import Iterable, Optional
+from celery import group
+from tasks import celery
+from tasks.queues import enqueue_options
+from tiers import UserTier
+
+@dataclass(frozen=True)
+class ServiceHandler:
+    """服务对应的 Celery 任务（按任务名投递，API 进程不需要导入 worker 代码）"""
+    task_name: str
+    # 是否可以通过通用接口 POST /api/tasks/ 提交（需要专用接口上传文件的服务为 False）
+    generic: bool = False
+
+# 服务处理器注册表，按 Service.endpoint 查找，找不到时按服务名称查找
+# 新增服务只需在此登记任务名，并把 worker 模块加入 Celery 的 include
+SERVICE_HANDLERS = {
+    "/api/tasks/image-age-transform": ServiceHandler("tasks.image_age_transform.process_image_age_transform"),
+}
+
+def get_service_handler(service) -> Optional[ServiceHandler]:
+    """获取服务的处理器，未登记时返回 None"""
+    return SERVICE_HANDLERS.get(service.endpoint) or SERVICE_HANDLERS.get(service.name)
+
+def _require_handler(service) -> ServiceHandler:
+    handler = get_service_handler(service)
+    if handler is None:
+        raise LookupError(f"服务未登记处理器: {service.name}")
+    return handler
+
+def dispatch_task(service, task_id: int, tier: UserTier):
+    """按用户等级把任务投递到对应的优先级队列"""
+    handler = _require_handler(service)
+    # 按任务名创建签名：进程内未导入 worker 模块时等同于 send_task，
+    # 已导入时（如基准测试的 eager 模式）走任务自身的 apply_async，遵循 task_always_eager
+    celery.signature(handler.task_name, args=(task_id,)).apply_async(**enqueue_options(tier))
+
+def dispatch_tasks(service, task_ids: Iterable[int], tier: UserTier):
+    """批量任务作为一个 Celery group 投递"""
+    handler = _require_handler(service)
+    group(celery.signature(handler.task_name, args=(task_id,)) for task_id in task_ids).apply_async(
+        **enqueue_options(tier)
+    )
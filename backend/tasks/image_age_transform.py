@@ -2,91 +2,132 @@ from celery import current_task
 from tasks import celery
 from sqlalchemy.orm import sessionmaker
 from database import engine
-from models import Task, TaskStatus
+from models import Task, TaskStatus, utcnow
 from config import settings
+from result_cache import store_result
+from result_blobs import result_image_reference, output_key, output_cache_control
+from storage import get_storage
+from tasks.image_processing import preprocess_image, prepare_result_image
+from tasks.volc_client import cv_process, ProviderTransientError
+from tasks.cpu_pool import run_cpu_bound
+from output_variants import pregenerate_variants
+from tasks.queues import record_queue_wait
+from task_events import publish_task_event
+from credits import refund_task
+from principal_cache import invalidate_principal_sync
+from provider_rate_limit import ProviderRateLimited, requeue_countdown
+from metrics import stage_timer, TASKS_FINISHED, TASKS_IN_PROGRESS
+from sla_stats import duration_ms
+from task_recovery import (
+    new_lease_owner, claim_task, holds_lease, release_lease, retry_countdown, LeaseHeartbeat
+)
 import json
-import os
-import base64
-from datetime import datetime
-from volcengine.visual.VisualService import VisualService
-from volcengine.const import Const
+from datetime import datetime, timedelta
 import logging
-import io
-from PIL import Image
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # 创建数据库会话
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# expire_on_commit=False: 提交后不重新加载任务，等待火山引擎响应期间不占用数据库连接
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 
-def get_volc_client():
-    """获取火山引擎客户端"""
-    if not settings.volc_access_key or not settings.volc_secret_key:
-        raise ValueError("火山引擎API密钥未配置")
-    
-    visual_service = VisualService()
-    print("access_key:" + settings.volc_access_key)
-    print("access_key:" + settings.volc_secret_key)
-    visual_service.set_ak(settings.volc_access_key)
-    visual_service.set_sk(settings.volc_secret_key)    
-    
-    return visual_service
+# 监控指标中的任务名
+METRICS_TASK = "image_age_transform"
+
+# 记录到任务上的阶段耗时（stage_timer 的阶段名 -> 任务字段）
+STAGE_COLUMNS = {"preprocess": "preprocess_ms", "provider": "provider_ms", "save": "save_ms"}
+# 原样记录到任务上的时间点和载荷大小
+TRACE_COLUMNS = (
+    "provider_started_at", "provider_completed_at",
+    "input_bytes", "provider_request_bytes", "provider_response_bytes", "output_bytes",
+)
+
+def record_trace(task: Task, trace: dict):
+    """把本次执行的阶段耗时和载荷大小写入任务（完成或失败时调用，未执行到的阶段为空）"""
+    for stage, column in STAGE_COLUMNS.items():
+        setattr(task, column, trace.get(stage))
+    for column in TRACE_COLUMNS:
+        setattr(task, column, trace.get(column))
+    task.processing_ms = duration_ms(task.started_at, task.completed_at)
 
-def process_images_to_base64(files):
+def lease_held(db, task: Task, owner: str) -> bool:
     """
-    将图片文件处理并转换为base64字符串列表
-    :param files: 图片文件路径列表
-    :return: base64编码的字符串列表
-    """ 
-    binary_data_base64 = []
-    for file in files:
-        # 读取本地图片文件并转换为base64字符串
-        with open(file, 'rb') as image_file:
-            binary_data = image_file.read()
-            # 读取图片并转换为PIL对象
-            img = Image.open(image_file)
-            # 获取原始尺寸
-            width, height = img.size
-            # 计算缩放比例
-            scale = min(1024/width, 1024/height, 1.0)
-            # 计算新的尺寸
-            new_width = int(width * scale)
-            new_height = int(height * scale)
-            # 如果需要缩放，则调整图片大小
-            if scale < 1.0:
-                img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                # 将调整后的图片转换为字节流
-                img_byte_arr = io.BytesIO()
-                img.save(img_byte_arr, format=img.format or 'PNG')
-                binary_data = img_byte_arr.getvalue()
-            
+    写入执行结果前确认租约仍属于本次执行（锁定任务行直到提交）
+    租约已被回收时任务已重新入队或失败，放弃本次执行的所有改动
+    """
+    if holds_lease(db, task.id, owner):
+        return True
+    db.rollback()
+    logger.warning(f"任务 {task.id} 的租约已被回收，丢弃本次执行结果")
+    TASKS_FINISHED.labels(METRICS_TASK, "lease_lost").inc()
+    return False
 
-            # 转换为base64编码
-            base64_data = base64.b64encode(binary_data)
-            # 转换为字符串
-            base64_str = base64_data.decode('utf-8')
-            binary_data_base64.append(base64_str)
+def fail_task(db, task: Task, error: Exception, owner: str, trace: dict = None):
+    """将任务标记为失败，并在同一事务中退还积分"""
+    db.rollback()
+    if not lease_held(db, task, owner):
+        return
+    task.status = TaskStatus.FAILED
+    task.error_message = str(error)
+    task.completed_at = utcnow()
+    release_lease(task)
+    if trace is not None:
+        record_trace(task, trace)
+    refunded = refund_task(db, task) is not None
+    db.commit()
+    publish_task_event(task)
+    TASKS_FINISHED.labels(METRICS_TASK, "failed").inc()
+    if refunded:
+        invalidate_principal_sync(task.user.username)
 
-    return binary_data_base64
+def requeue_task(db, task: Task, owner: str, outcome: str, countdown: float, retry_count: int = None) -> bool:
+    """
+    任务回到排队状态并释放租约（由调用方通过 self.retry 在 countdown 秒后重新入队），租约已被回收时返回 False
+    重试消息丢失时，由定时回收在预计到期时间之后重新投递
+    """
+    db.rollback()
+    if not lease_held(db, task, owner):
+        return False
+    task.status = TaskStatus.PENDING
+    task.started_at = None
+    task.enqueued_at = utcnow() + timedelta(seconds=countdown)
+    release_lease(task)
+    if retry_count is not None:
+        task.retry_count = retry_count
+    db.commit()
+    publish_task_event(task)
+    TASKS_FINISHED.labels(METRICS_TASK, outcome).inc()
+    return True
 
-@celery.task(bind=True)
-def process_image_age_transform(self, task_id: int):
-    """处理图片年龄变换任务"""
+# acks_late: 执行结束后才确认消息，worker 进程崩溃时消息重新投递（重复消息由 claim_task 去重）
+@celery.task(bind=True, acks_late=True, reject_on_worker_lost=True)
+def process_image_age_transform(self, task_id: int, rate_limit_requeues: int = 0):
+    """
+    处理图片年龄变换任务
+    :param rate_limit_requeues: 因全局限流已重新入队的次数（与临时性错误的重试次数 Task.retry_count 分开计算）
+    """
+    record_queue_wait(self.request)
     db = SessionLocal()
+    # 领取任务并获得租约：只处理排队中的任务，执行期间定期续租
+    owner = new_lease_owner()
+    if not claim_task(db, task_id, owner):
+        db.close()
+        logger.info(f"任务 {task_id} 不存在或不在排队状态（已完成、已失败或正由其他 worker 处理），跳过")
+        return
+    heartbeat = LeaseHeartbeat(task_id, owner)
+    heartbeat.start()
+    TASKS_IN_PROGRESS.labels(METRICS_TASK).inc()
+    # 各阶段耗时和载荷大小，结束时写入任务记录
+    trace = {}
     
     try:
         # 获取任务信息
         task = db.query(Task).filter(Task.id == task_id).first()
-        if not task:
-            logger.error(f"任务 {task_id} 不存在")
-            return
-        
-        # 更新任务状态为处理中
-        task.status = TaskStatus.PROCESSING
-        task.started_at = datetime.utcnow()
+        task.queue_wait_ms = duration_ms(task.created_at, task.started_at)
         db.commit()
+        publish_task_event(task)
         
         # 解析输入数据
         input_data = json.loads(task.input_data)
@@ -96,67 +137,81 @@ def process_image_age_transform(self, task_id: int):
         logger.info(f"开始处理任务 {task_id}: 图片路径={image_path}, 目标年龄={target_age}")
         
         # 检查文件是否存在
-        if not os.path.exists(image_path):
+        storage = get_storage()
+        if not storage.exists(image_path):
             raise FileNotFoundError(f"图片文件不存在: {image_path}")
         
         # 调用火山引擎API
         try:
-            visual_service = get_volc_client()
-            
-            # 使用新的调用方式
-            files = [image_path]
-            binary_data_base64 = process_images_to_base64(files)
+            # 预处理图片（缩小解码、方向校正、选择最小载荷格式）
+            # 对象存储下先下载到本地临时文件
+            with stage_timer(METRICS_TASK, "preprocess", trace), storage.local_copy(image_path) as local_image_path:
+                image_base64, preprocess_stats = run_cpu_bound(preprocess_image, local_image_path)
+            trace["input_bytes"] = preprocess_stats["input_bytes"]
+            trace["provider_request_bytes"] = len(image_base64)
+            logger.info(
+                f"任务 {task_id} 图片预处理: 解码 {preprocess_stats['decode_ms']:.1f}ms, "
+                f"编码 {preprocess_stats['encode_ms']:.1f}ms, "
+                f"{preprocess_stats['input_bytes']} -> {preprocess_stats['output_bytes']} 字节, "
+                f"峰值内存 {preprocess_stats['peak_rss_mb']}MB"
+            )
+            binary_data_base64 = [image_base64]
             
             form = {
-                "req_key": "all_age_generation",
+                "req_key": settings.image_age_transform_req_key,
                 "target_age": target_age ,
                 "binary_data_base64":binary_data_base64
                 }
 
-            resp = visual_service.cv_process(form)
+            trace["provider_started_at"] = utcnow()
+            with stage_timer(METRICS_TASK, "provider", trace):
+                resp = cv_process(form)
+            trace["provider_completed_at"] = utcnow()
             
             if resp.get("code") == 10000:  # 成功
                 # 从响应中获取图片base64数据
                 binary_data_base64_result = resp["data"]["binary_data_base64"][0]
+                trace["provider_response_bytes"] = len(binary_data_base64_result)
                 
-                # 检查响应是否包含base64数据
-                if "base64," in binary_data_base64_result:
-                    # 提取base64数据
-                    base64_data = binary_data_base64_result.split("base64,")[1]
-                    # 解码base64数据
-                    image_data = base64.b64decode(base64_data)
-                else:
-                    # 直接使用响应内容
-                    image_data = binary_data_base64_result
-                
-                # 将字符串解码为二进制数据
-                binary_data = base64.b64decode(image_data)
-                # 将二进制数据转换为图片
-                image = Image.open(io.BytesIO(binary_data))
-                
-                # 保存图片到输出目录
-                output_filename = f"result_{task_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}.png"
-                output_path = os.path.join("outputs", output_filename)
-                
-                # 确保输出目录存在
-                os.makedirs("outputs", exist_ok=True)
-                
-                # 保存图片
-                image.save(output_path)
-                logger.info(f"图片已保存至: {output_path}")
+                with stage_timer(METRICS_TASK, "save", trace):
+                    # 校验结果图片，格式无需转换时直接使用原始字节（I/O 模式下交给进程池）
+                    result_bytes, extension, save_stats = run_cpu_bound(prepare_result_image, binary_data_base64_result)
+                    
+                    # 保存图片到存储
+                    output_path = output_key(f"result_{task_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}.{extension}")
+                    storage.put_bytes(output_path, result_bytes, cache_control=output_cache_control())
+                trace["output_bytes"] = len(result_bytes)
+                logger.info(
+                    f"图片已保存至: {output_path}, 写入 {save_stats['output_bytes']} 字节, "
+                    f"{'转码' if save_stats['transcoded'] else '未转码'}, CPU {save_stats['cpu_ms']:.1f}ms"
+                )
+                # 预生成列表页缩略图，避免首次浏览时现场转码
+                with stage_timer(METRICS_TASK, "variants"):
+                    run_cpu_bound(pregenerate_variants, output_path)
                 
+                # 任务记录只保存结果文件的引用和元数据，不再内联图片数据
+                result_reference = result_image_reference(output_path, len(result_bytes))
                 result_data = {
-                    "result_image_path": output_path,
-                    "result_image_base64": binary_data_base64_result,
+                    **result_reference,
                     "original_image_path": image_path,
                     "target_age": target_age,
-                    "processed_at": datetime.utcnow().isoformat()
+                    "preprocess": preprocess_stats,
+                    "save": save_stats,
+                    "processed_at": utcnow().isoformat()
                 }
                 
                 # 更新任务状态为完成
                 task.status = TaskStatus.COMPLETED
                 task.output_data = json.dumps(result_data)
-                task.completed_at = datetime.utcnow()
+                task.completed_at = utcnow()
+                
+                # 写入结果缓存，相同图片和参数的后续请求可直接复用
+                store_result(
+                    input_data.get("image_sha256"),
+                    target_age,
+                    settings.image_age_transform_req_key,
+                    {**result_reference, "target_age": target_age}
+                )
                 
                 logger.info(f"任务 {task_id} 处理完成")
                 
@@ -165,6 +220,8 @@ def process_image_age_transform(self, task_id: int):
                 error_msg = resp.get("message", "未知错误")
                 raise Exception(f"火山引擎API调用失败: {error_msg}")
                 
+        except (ProviderRateLimited, ProviderTransientError):
+            raise
         except Exception as api_error:
             logger.error(f"调用火山引擎API失败: {str(api_error)}")
             
@@ -175,35 +232,71 @@ def process_image_age_transform(self, task_id: int):
                 # 模拟处理结果
                 result_data = {
                     "result_image_url": f"https://example.com/result_{task_id}.jpg",
-                    "result_image_base64": "模拟的base64编码结果",
                     "original_image_path": image_path,
                     "target_age": target_age,
-                    "processed_at": datetime.utcnow().isoformat(),
+                    "processed_at": utcnow().isoformat(),
                     "note": "这是模拟结果，实际部署时需要配置火山引擎API密钥"
                 }
                 
                 task.status = TaskStatus.COMPLETED
                 task.output_data = json.dumps(result_data)
-                task.completed_at = datetime.utcnow()
+                task.completed_at = utcnow()
                 
             else:
                 raise api_error
         
+        record_trace(task, trace)
+        heartbeat.stop()
+        if not lease_held(db, task, owner):
+            return
+        release_lease(task)
         db.commit()
+        publish_task_event(task)
+        TASKS_FINISHED.labels(METRICS_TASK, "completed").inc()
+        
+    except ProviderRateLimited as e:
+        heartbeat.stop()
+        if rate_limit_requeues >= settings.volc_rate_limit_max_retries:
+            logger.error(f"任务 {task_id} 多次超出火山引擎限流配额，放弃处理")
+            fail_task(db, task, e, owner, trace)
+            raise
+        
+        # 超出全局限流配额：任务回到排队状态，退避后重新入队（不退款，稍后仍会处理）
+        countdown = requeue_countdown(e.retry_after, rate_limit_requeues)
+        if not requeue_task(db, task, owner, "requeued", countdown):
+            return
+        logger.info(f"任务 {task_id} 超出火山引擎限流配额，{countdown:.1f}秒后重新入队")
+        raise self.retry(
+            exc=e, countdown=countdown, max_retries=None,
+            kwargs={"rate_limit_requeues": rate_limit_requeues + 1}
+        )
+        
+    except ProviderTransientError as e:
+        heartbeat.stop()
+        retries = task.retry_count or 0
+        if retries >= settings.task_max_retries:
+            logger.error(f"任务 {task_id} 重试 {retries} 次后仍然失败: {e}")
+            fail_task(db, task, e, owner, trace)
+            raise
+        
+        # 临时性错误：任务回到排队状态，指数退避加随机抖动后重试（不退款）
+        countdown = retry_countdown(retries)
+        if not requeue_task(db, task, owner, "retried", countdown, retry_count=retries + 1):
+            return
+        logger.warning(f"任务 {task_id} 遇到临时性错误，{countdown:.1f}秒后第 {retries + 1} 次重试: {e}")
+        raise self.retry(exc=e, countdown=countdown, max_retries=None)
         
     except Exception as e:
+        heartbeat.stop()
         logger.error(f"处理任务 {task_id} 时发生错误: {str(e)}")
-        
-        # 更新任务状态为失败
-        task.status = TaskStatus.FAILED
-        task.error_message = str(e)
-        task.completed_at = datetime.utcnow()
-        db.commit()
+        fail_task(db, task, e, owner, trace)
         
         # 重新抛出异常以便Celery记录
         raise
         
     finally:
+        heartbeat.stop()
+        TASKS_IN_PROGRESS.labels(METRICS_TASK).dec()
         db.close()
     
     return f"任务 {task_id} 处理完成"
\ No newline at end of file
@@ -0,0 +1,172 @@
+import base64
+import binascii
+import io
+import os
+import resource
+import time
+from typing import Tuple
+from PIL import Image, UnidentifiedImageError
+from config import settings
+
+# EXIF Orientation 标签
+EXIF_ORIENTATION = 0x0112
+
+# EXIF 方向值对应的变换操作
+ORIENTATION_TRANSPOSE = {
+    2: [Image.Transpose.FLIP_LEFT_RIGHT],
+    3: [Image.Transpose.ROTATE_180],
+    4: [Image.Transpose.FLIP_TOP_BOTTOM],
+    5: [Image.Transpose.TRANSPOSE],
+    6: [Image.Transpose.ROTATE_270],
+    7: [Image.Transpose.TRANSVERSE],
+    8: [Image.Transpose.ROTATE_90],
+}
+
+# 结果图片允许的格式及对应的文件扩展名
+RESULT_EXTENSIONS = {"PNG": "png", "JPEG": "jpg", "WEBP": "webp"}
+
+# 需要转码时各格式的编码参数
+RESULT_SAVE_OPTIONS = {"JPEG": {"quality": 95}, "WEBP": {"quality": 90}}
+
+# 常见图片格式的文件头，用于判断 base64 解码结果是否已经是图片
+IMAGE_SIGNATURES = (b"\x89PNG\r\n\x1a\n", b"\xff\xd8\xff", b"RIFF", b"GIF8")
+
+def peak_rss_mb() -> float:
+    """当前进程的峰值常驻内存（MB，Linux 下 ru_maxrss 单位为 KB）"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _to_rgb(img: Image.Image) -> Image.Image:
+    """转换为 RGB，透明背景填充为白色"""
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel("A"))
+        return background
+    if img.mode != "RGB":
+        return img.convert("RGB")
+    return img
+
+def preprocess_image(path: str, max_side: int = None) -> Tuple[str, dict]:
+    """
+    预处理待提交给火山引擎的图片
+    - JPEG 使用 draft 模式在解码阶段直接按 1/2、1/4、1/8 缩小，避免完整解码大图
+    - 只应用一次 EXIF 方向校正
+    - 尺寸和方向都无需调整的 JPEG 原样透传，不重新编码
+    - 其余统一编码为 JPEG，作为接口可接受的最小载荷
+    :return: (base64字符串, 统计信息)
+    """
+    max_side = max_side or settings.preprocess_max_side
+    stats = {"input_bytes": os.path.getsize(path), "decode_ms": 0.0, "encode_ms": 0.0}
+
+    decode_start = time.perf_counter()
+    with Image.open(path) as img:
+        width, height = img.size
+        orientation = img.getexif().get(EXIF_ORIENTATION, 1)
+        stats.update({"source_format": img.format, "source_width": width, "source_height": height})
+
+        passthrough = (
+            img.format == "JPEG"
+            and max(width, height) <= max_side
+            and orientation == 1
+            and img.mode in ("RGB", "L")
+        )
+        if not passthrough:
+            if img.format == "JPEG":
+                img.draft("RGB", (max_side, max_side))
+            img.thumbnail((max_side, max_side), Image.Resampling.BICUBIC, reducing_gap=2.0)
+            for method in ORIENTATION_TRANSPOSE.get(orientation, []):
+                img = img.transpose(method)
+            img = _to_rgb(img)
+            stats["decode_ms"] = round((time.perf_counter() - decode_start) * 1000, 1)
+
+            encode_start = time.perf_counter()
+            buffer = io.BytesIO()
+            img.save(buffer, format="JPEG", quality=settings.preprocess_jpeg_quality, optimize=True)
+            width, height = img.size
+            img.close()
+            payload = buffer.getvalue()
+            buffer.close()
+            stats["encode_ms"] = round((time.perf_counter() - encode_start) * 1000, 1)
+
+    if passthrough:
+        # 透传原始字节，不重新编码
+        with open(path, "rb") as f:
+            payload = f.read()
+
+    stats.update({
+        "output_format": "JPEG",
+        "output_width": width,
+        "output_height": height,
+        "output_bytes": len(payload),
+        "passthrough": passthrough,
+    })
+    encoded = base64.b64encode(payload).decode("ascii")
+    del payload
+    stats["peak_rss_mb"] = round(peak_rss_mb(), 1)
+
+    return encoded, stats
+
+def decode_result_image(value: str) -> bytes:
+    """解码结果图片的 base64（兼容 data URI 前缀及历史上的二次 base64 编码）"""
+    if "base64," in value:
+        value = value.split("base64,", 1)[1]
+    # 与历史行为一致，忽略换行等非 base64 字符
+    data = base64.b64decode(value)
+    if data.startswith(IMAGE_SIGNATURES):
+        return data
+    try:
+        # 只有内容不是图片时才尝试再解码一次（去掉空白后严格校验，避免把任意二进制当作 base64）
+        return base64.b64decode(b"".join(data.split()), validate=True)
+    except (binascii.Error, ValueError):
+        return data
+
+def prepare_result_image(result_base64: str) -> Tuple[bytes, str, dict]:
+    """
+    解码并校验火山引擎返回的结果图片，得到要保存的字节
+    - base64 只解码一次，只读取文件头校验是有效图片，不解码像素
+    - 未配置 result_output_format 或格式一致时直接使用接口返回的字节，不重新编码
+    :return: (图片字节, 文件扩展名, 统计信息)
+    """
+    cpu_start = time.thread_time()
+    decode_start = time.perf_counter()
+    data = decode_result_image(result_base64)
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            source_format = img.format
+            width, height = img.size
+    except UnidentifiedImageError:
+        raise ValueError("火山引擎返回的结果不是有效的图片")
+    if source_format not in RESULT_EXTENSIONS:
+        raise ValueError(f"火山引擎返回了不支持的图片格式: {source_format}")
+    stats = {
+        "source_format": source_format,
+        "width": width,
+        "height": height,
+        "decode_ms": round((time.perf_counter() - decode_start) * 1000, 1),
+        "encode_ms": 0.0,
+    }
+
+    target_format = (settings.result_output_format or source_format).upper()
+    if target_format == "JPG":
+        target_format = "JPEG"
+    if target_format not in RESULT_EXTENSIONS:
+        raise ValueError(f"不支持的结果图片格式配置: {settings.result_output_format}")
+
+    transcoded = target_format != source_format
+    if transcoded:
+        encode_start = time.perf_counter()
+        buffer = io.BytesIO()
+        with Image.open(io.BytesIO(data)) as img:
+            if target_format == "JPEG":
+                img = _to_rgb(img)
+            img.save(buffer, format=target_format, **RESULT_SAVE_OPTIONS.get(target_format, {}))
+        data = buffer.getvalue()
+        stats["encode_ms"] = round((time.perf_counter() - encode_start) * 1000, 1)
+
+    stats.update({
+        "output_format": target_format,
+        "transcoded": transcoded,
+        "output_bytes": len(data),
+        "cpu_ms": round((time.thread_time() - cpu_start) * 1000, 1),
+    })
+    return data, RESULT_EXTENSIONS[target_format], stats
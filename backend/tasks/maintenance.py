@@ -0,0 +1,238 @@
+from tasks import celery
+from database import SessionLocal
+from models import Task, TaskStatus
+from result_blobs import INLINE_BLOB_FIELD, result_image_reference, output_key, output_cache_control
+from storage import get_storage
+from tasks.image_processing import decode_result_image
+from service_popularity import WINDOWS, current_hour, rollup_windows, replace_hourly_counts
+from sla_stats import rebuild_rollups
+from task_recovery import utcnow, lease_expired
+from task_events import publish_task_event
+from credits import refund_task
+from principal_cache import invalidate_principal_sync
+from tasks.dispatch import dispatch_task, get_service_handler
+from tiers import get_user_tier_sync
+from metrics import TASKS_RECLAIMED
+from config import settings
+from collections import defaultdict
+from datetime import timedelta, timezone
+import io
+import json
+import logging
+from typing import Optional, Tuple
+from PIL import Image
+from kombu.exceptions import OperationalError
+from redis.exceptions import RedisError
+from sqlalchemy import func, update
+
+logger = logging.getLogger(__name__)
+
+def migrate_output_data(task: Task) -> bool:
+    """将任务输出中内联的结果图片迁移为文件引用，返回是否有改动"""
+    data = json.loads(task.output_data)
+    inline_image = data.pop(INLINE_BLOB_FIELD, None)
+    task.inline_result = None
+    if inline_image is None:
+        return False
+
+    storage = get_storage()
+    path = data.get("result_image_path")
+    if path and storage.exists(path):
+        data.update(result_image_reference(path))
+    else:
+        try:
+            image_bytes = decode_result_image(inline_image)
+            with Image.open(io.BytesIO(image_bytes)) as image:
+                extension = (image.format or "png").lower()
+            path = output_key(f"result_{task.id}_backfill.{extension}")
+            storage.put_bytes(path, image_bytes, cache_control=output_cache_control())
+            data.update(result_image_reference(path, len(image_bytes)))
+        except Exception as e:
+            # 无法解析的数据（如模拟结果）直接丢弃
+            logger.warning(f"任务 {task.id} 的内联结果图片无法解析，已丢弃: {e}")
+
+    task.output_data = json.dumps(data)
+    return True
+
+@celery.task
+def backfill_task_output_blobs(after_id: int = 0, batch_size: int = 100):
+    """后台迁移旧任务中内联的结果图片，每批提交后自动排队下一批"""
+    db = SessionLocal()
+    try:
+        tasks = db.query(Task).filter(
+            Task.id > after_id,
+            Task.inline_result.is_(True)
+        ).order_by(Task.id).limit(batch_size).all()
+
+        migrated = sum(1 for task in tasks if migrate_output_data(task))
+        db.commit()
+        last_id = tasks[-1].id if tasks else after_id
+    finally:
+        db.close()
+
+    logger.info(f"结果图片迁移: 本批 {migrated} 条，最后任务ID {last_id}")
+    if len(tasks) == batch_size:
+        backfill_task_output_blobs.delay(last_id, batch_size)
+
+    return migrated
+
+@celery.task
+def rollup_service_popularity():
+    """定期由小时桶重新汇总热门服务的统计窗口（Celery beat 调度）"""
+    try:
+        rollup_windows()
+    except RedisError as e:
+        logger.warning(f"汇总热门服务统计窗口失败: {e}")
+
+@celery.task
+def reconcile_service_popularity():
+    """以 tasks 表为准重建统计窗口内各小时的服务使用次数（Celery beat 调度）"""
+    since = current_hour() - timedelta(hours=max(WINDOWS.values()) - 1)
+    hour = func.date_trunc("hour", func.timezone("UTC", Task.created_at))
+    db = SessionLocal()
+    try:
+        rows = db.query(Task.service_id, hour, func.count()).filter(
+            Task.created_at >= since.replace(tzinfo=timezone.utc)
+        ).group_by(Task.service_id, hour).all()
+    finally:
+        db.close()
+
+    counts = defaultdict(dict)
+    for service_id, task_hour, count in rows:
+        counts[task_hour][service_id] = count
+    try:
+        replace_hourly_counts(counts, since)
+        rollup_windows()
+    except RedisError as e:
+        logger.warning(f"热门服务统计对账失败: {e}")
+        return 0
+
+    logger.info(f"热门服务统计对账完成: {len(rows)} 个小时桶条目")
+    return len(rows)
+
+@celery.task
+def rollup_task_sla(hours: Optional[int] = None):
+    """重算最近若干小时的任务 SLA 汇总（Celery beat 调度，补算历史数据时传入 hours）"""
+    hours = hours or settings.sla_rollup_lookback_hours
+    since = current_hour() - timedelta(hours=hours - 1)
+    db = SessionLocal()
+    try:
+        total = rebuild_rollups(db, since)
+    finally:
+        db.close()
+
+    logger.info(f"任务 SLA 汇总完成: 最近 {hours} 小时 {total} 个任务")
+    return total
+
+def _dispatch_before_commit(db, task: Task) -> bool:
+    """
+    投递任务后提交当前事务；投递失败时回滚，任务保持原状态，由下一次回收重试
+    （投递后、提交前到达的消息在领取时等待行锁，提交后即可领取）
+    """
+    try:
+        dispatch_task(task.service, task.id, get_user_tier_sync(db, task.user_id))
+    except OperationalError as e:
+        db.rollback()
+        logger.error(f"任务 {task.id} 重新投递失败，等待下次回收: {e}")
+        return False
+    db.commit()
+    return True
+
+def reclaim_expired_leases(db, now, batch_size: int) -> Tuple[int, int]:
+    """
+    租约过期的处理中任务（执行的 worker 崩溃或失联）：未超过重试次数的重新入队，否则标记失败并退还积分
+    :return: (重新入队数, 标记失败数)
+    """
+    requeued = failed = 0
+    stale = db.query(Task).filter(
+        Task.status == TaskStatus.PROCESSING,
+        lease_expired(now)
+    ).order_by(Task.id).limit(batch_size).all()
+
+    for task in stale:
+        retries = task.retry_count or 0
+        retry = retries < settings.task_max_retries and get_service_handler(task.service) is not None
+        values = {"lease_owner": None, "lease_expires_at": None}
+        if retry:
+            values.update(status=TaskStatus.PENDING, started_at=None, retry_count=retries + 1, enqueued_at=now)
+        else:
+            values.update(status=TaskStatus.FAILED, error_message="执行任务的 worker 失联，重试次数已用完", completed_at=now)
+        # 条件更新：原 worker 在此期间续租或已结束时不做改动
+        result = db.execute(
+            update(Task)
+            .where(Task.id == task.id, Task.status == TaskStatus.PROCESSING, lease_expired(now))
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount != 1:
+            db.rollback()
+            continue
+
+        if retry:
+            if not _dispatch_before_commit(db, task):
+                continue
+            publish_task_event(task)
+            logger.warning(f"任务 {task.id} 租约过期，第 {retries + 1} 次重新入队")
+            TASKS_RECLAIMED.labels("requeued").inc()
+            requeued += 1
+        else:
+            refunded = refund_task(db, task) is not None
+            db.commit()
+            publish_task_event(task)
+            logger.error(f"任务 {task.id} 租约过期且重试次数已用完，标记为失败")
+            TASKS_RECLAIMED.labels("failed").inc()
+            failed += 1
+            if refunded:
+                invalidate_principal_sync(task.user.username)
+    return requeued, failed
+
+def redispatch_lost_pending(db, now, batch_size: int) -> int:
+    """
+    投递后超过 task_pending_redispatch_seconds 仍未被领取的排队任务重新投递（原消息可能已丢失）
+    从未投递过的任务（enqueued_at 为空，如由外部流程处理的服务）不处理
+    :return: 重新投递数
+    """
+    deadline = now - timedelta(seconds=settings.task_pending_redispatch_seconds)
+    redispatched = 0
+    stale = db.query(Task).filter(
+        Task.status == TaskStatus.PENDING,
+        Task.enqueued_at < deadline
+    ).order_by(Task.id).limit(batch_size).all()
+
+    for task in stale:
+        if get_service_handler(task.service) is None:
+            continue
+        # 条件更新：任务在此期间被领取时不做改动
+        result = db.execute(
+            update(Task)
+            .where(Task.id == task.id, Task.status == TaskStatus.PENDING, Task.enqueued_at < deadline)
+            .values(enqueued_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount != 1:
+            db.rollback()
+            continue
+        if not _dispatch_before_commit(db, task):
+            continue
+        logger.warning(f"任务 {task.id} 投递后长时间未被领取，已重新投递")
+        TASKS_RECLAIMED.labels("redispatched").inc()
+        redispatched += 1
+    return redispatched
+
+@celery.task
+def reclaim_stale_tasks(batch_size: int = 100):
+    """
+    回收执行中断或消息丢失的任务（Celery beat 调度）：
+    租约过期的处理中任务重新入队或标记失败，长时间未被领取的排队任务重新投递
+    """
+    now = utcnow()
+    db = SessionLocal()
+    try:
+        requeued, failed = reclaim_expired_leases(db, now, batch_size)
+        redispatched = redispatch_lost_pending(db, now, batch_size)
+    finally:
+        db.close()
+
+    if requeued or failed or redispatched:
+        logger.info(f"过期任务回收完成: 重新入队 {requeued} 个，标记失败 {failed} 个，重新投递 {redispatched} 个")
+    return requeued + failed + redispatched
@@ -0,0 +1,117 @@
+import logging
+import random
+import time
+from kombu import Queue
+from kombu.utils.scheduling import priority_cycle
+from redis.exceptions import RedisError
+from config import settings
+from metrics import TASK_QUEUE_WAIT
+from redis_client import get_redis, get_async_redis
+from tiers import UserTier
+
+logger = logging.getLogger(__name__)
+
+# 优先级队列
+QUEUE_HIGH = "high"
+QUEUE_DEFAULT = "default"
+QUEUE_LOW = "low"
+
+# 引入优先级队列之前所有任务进入 Celery 默认的 celery 队列；保留一个版本供 worker 消费升级前积压的消息，
+# 之后不再有新消息进入，排空（aigc_celery_queue_depth 为 0）后即可移除
+QUEUE_LEGACY = "celery"
+
+TASK_QUEUES = (Queue(QUEUE_HIGH), Queue(QUEUE_DEFAULT), Queue(QUEUE_LOW), Queue(QUEUE_LEGACY))
+
+# 用户等级对应的队列
+TIER_QUEUES = {
+    UserTier.ENTERPRISE: QUEUE_HIGH,
+    UserTier.PAID: QUEUE_DEFAULT,
+    UserTier.FREE: QUEUE_LOW,
+}
+
+# 各等级排队耗时统计: aigc:queue_wait:{tier}
+QUEUE_WAIT_PREFIX = "aigc:queue_wait"
+# 每个等级保留的最近样本数（用于计算分位数）
+QUEUE_WAIT_SAMPLES = 1000
+
+def enqueue_options(tier: UserTier) -> dict:
+    """按用户等级生成 apply_async 参数：目标队列，以及用于统计排队耗时的消息头"""
+    return {
+        "queue": TIER_QUEUES[tier],
+        "headers": {"enqueued_at": time.time(), "tier": tier.value},
+    }
+
+def parse_queue_weights(value: str) -> dict:
+    """解析 "high:6,default:3,low:1" 形式的队列权重"""
+    weights = {}
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        name, _, weight = item.partition(":")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+class weighted_cycle(priority_cycle):
+    """
+    按权重决定 worker 每次拉取消息时检查队列的顺序（kombu Redis 传输的 queue_order_strategy）
+    BRPOP 从第一个非空队列取消息，因此各队列都有积压时按权重比例分配，
+    高优先级队列为空时不会空等，低优先级队列也不会被饿死
+    """
+
+    def __init__(self, it=None):
+        super().__init__(it)
+        self.weights = parse_queue_weights(settings.worker_queue_weights)
+
+    def consume(self, n):
+        items = list(self.items[:n])
+        weights = [self.weights.get(item, 1.0) for item in items]
+        order = []
+        while items:
+            index = random.choices(range(len(items)), weights)[0]
+            order.append(items.pop(index))
+            weights.pop(index)
+        return order
+
+def record_queue_wait(request):
+    """记录任务从入队到开始执行的等待时间（只统计首次执行，重试不计入）"""
+    enqueued_at = request.get("enqueued_at")
+    tier = request.get("tier")
+    if enqueued_at is None or tier is None or request.retries:
+        return
+
+    wait_ms = max(0.0, (time.time() - float(enqueued_at)) * 1000)
+    TASK_QUEUE_WAIT.labels(tier).observe(wait_ms / 1000)
+    key = f"{QUEUE_WAIT_PREFIX}:{tier}"
+    try:
+        pipe = get_redis().pipeline()
+        pipe.hincrby(f"{key}:stats", "count", 1)
+        pipe.hincrbyfloat(f"{key}:stats", "total_ms", wait_ms)
+        pipe.lpush(f"{key}:samples", round(wait_ms, 1))
+        pipe.ltrim(f"{key}:samples", 0, QUEUE_WAIT_SAMPLES - 1)
+        pipe.execute()
+    except RedisError as e:
+        logger.warning(f"记录排队耗时失败: {e}")
+
+def _percentile(ordered: list, pct: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))]
+
+async def get_queue_wait_stats() -> dict:
+    """获取各用户等级的排队耗时统计（分位数基于最近的样本）"""
+    redis = get_async_redis()
+    result = {}
+    for tier in UserTier:
+        key = f"{QUEUE_WAIT_PREFIX}:{tier.value}"
+        stats = await redis.hgetall(f"{key}:stats")
+        samples = sorted(float(value) for value in await redis.lrange(f"{key}:samples", 0, -1))
+        count = int(stats.get("count", 0))
+        result[tier.value] = {
+            "queue": TIER_QUEUES[tier],
+            "count": count,
+            "avg_ms": round(float(stats.get("total_ms", 0)) / count, 1) if count else 0.0,
+            "p50_ms": _percentile(samples, 50),
+            "p95_ms": _percentile(samples, 95),
+            "max_ms": samples[-1] if samples else 0.0,
+        }
+    return result
@@ -0,0 +1,121 @@
+import logging
+import re
+import threading
+from typing import Optional
+import requests
+from celery.signals import worker_process_init
+from requests.adapters import HTTPAdapter
+from volcengine.visual.VisualService import VisualService
+from config import settings
+from provider_rate_limit import acquire as acquire_rate_limit
+
+logger = logging.getLogger(__name__)
+
+# 每个 worker 进程一个客户端，复用同一个 requests.Session 的 keep-alive 连接
+_client: Optional[VisualService] = None
+_client_lock = threading.Lock()
+# 限制单个 worker 进程同时进行的调用数（threads 池下多个任务共享同一客户端）
+_in_flight = threading.BoundedSemaphore(settings.volc_max_in_flight)
+
+# SDK 在 HTTP 状态码非 200 时以响应正文作为异常消息，从中提取业务错误码
+_ERROR_CODE_PATTERN = re.compile(r'"code"\s*:\s*(\d+)')
+
+class ProviderTransientError(Exception):
+    """火山引擎调用的临时性错误（网络异常、接口限流或服务内部错误），可以稍后重试"""
+
+def _error_code(error: Exception) -> Optional[int]:
+    match = _ERROR_CODE_PATTERN.search(str(error))
+    return int(match.group(1)) if match else None
+
+def _is_network_error(error: Optional[BaseException]) -> bool:
+    """
+    是否由网络异常（连接失败、超时）引起
+    SDK 捕获所有异常后以 Exception(str(e)) 重新抛出，原始的 requests 异常只保留在异常链中
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+            return True
+        seen.add(id(error))
+        error = error.__cause__ or error.__context__
+    return False
+
+def _pooled_session() -> requests.Session:
+    """带连接池的会话（连接池不小于在途调用上限，避免并发调用时连接用完即丢、反复重建）"""
+    session = requests.Session()
+    pool_maxsize = max(settings.volc_pool_maxsize, settings.volc_max_in_flight)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def create_volc_client() -> VisualService:
+    """
+    创建火山引擎客户端（连接池、超时、访问地址均取自配置）
+    VisualService 是进程内单例，每次 VisualService() 都返回同一个对象并重新执行 __init__，
+    替换会话和凭证，因此只在持有 _client_lock 时调用，进程内只创建一次，之后通过 get_volc_client 复用
+    """
+    visual_service = VisualService()
+    visual_service.set_ak(settings.volc_access_key)
+    visual_service.set_sk(settings.volc_secret_key)
+    visual_service.set_host(settings.volc_host)
+    visual_service.set_scheme(settings.volc_scheme)
+    visual_service.set_connection_timeout(settings.volc_connect_timeout)
+    visual_service.set_socket_timeout(settings.volc_read_timeout)
+    visual_service.service_info.credentials.region = settings.volc_region
+    visual_service.session = _pooled_session()
+    return visual_service
+
+def get_volc_client() -> VisualService:
+    """获取当前进程的火山引擎客户端，未初始化时按需创建"""
+    global _client
+    if not settings.volc_access_key or not settings.volc_secret_key:
+        raise ValueError("火山引擎API密钥未配置")
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = create_volc_client()
+    return _client
+
+def cv_process(form: dict) -> dict:
+    """
+    调用 CVProcess 接口
+    先获取全局限流配额（配额短时间内无法获得时抛出 ProviderRateLimited），超过进程内在途上限时等待
+    网络异常和临时性错误码抛出 ProviderTransientError，由调用方退避重试
+    """
+    visual_service = get_volc_client()
+    acquire_rate_limit()
+    with _in_flight:
+        try:
+            resp = visual_service.cv_process(form)
+        except Exception as e:
+            if _is_network_error(e):
+                raise ProviderTransientError(f"火山引擎接口网络异常: {e}") from e
+            if _error_code(e) in settings.volc_transient_error_codes:
+                raise ProviderTransientError(f"火山引擎接口临时错误: {e}") from e
+            raise
+    if resp.get("code") in settings.volc_transient_error_codes:
+        raise ProviderTransientError(f"火山引擎接口临时错误 {resp.get('code')}: {resp.get('message')}")
+    return resp
+
+def close_volc_client():
+    """关闭当前进程客户端的连接（客户端仍可继续使用，下次调用时重新建立连接）"""
+    if _client is not None:
+        _client.session.close()
+
+@worker_process_init.connect
+def init_volc_client(**kwargs):
+    """
+    worker 子进程启动时准备客户端
+    fork 前已创建的客户端（单例）在子进程中换用新的会话，不与父进程共享套接字，也不重新执行 VisualService()
+    """
+    global _client
+    if not settings.volc_access_key or not settings.volc_secret_key:
+        logger.warning("火山引擎API密钥未配置，worker 将返回模拟结果")
+        return
+    with _client_lock:
+        if _client is None:
+            _client = create_volc_client()
+        else:
+            _client.session = _pooled_session()
+    logger.info(f"火山引擎客户端已初始化: {settings.volc_scheme}://{settings.volc_host}")
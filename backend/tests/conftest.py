@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 测试在 backend 目录下运行，模块按顶层包导入（与 worker、API 进程一致）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
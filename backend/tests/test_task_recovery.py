@@ -0,0 +1,118 @@
+from datetime import timedelta
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from config import settings
+from models import Base, Service, Task, TaskStatus, User, utcnow
+from tasks import maintenance
+
+ENDPOINT = "/api/tasks/image-age-transform"
+
+@pytest.fixture
+def session_factory(monkeypatch, tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'recovery.db'}")
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine)
+    monkeypatch.setattr(maintenance, "SessionLocal", factory)
+    monkeypatch.setattr(maintenance, "publish_task_event", lambda task: None)
+    monkeypatch.setattr(maintenance, "invalidate_principal_sync", lambda username: None)
+    yield factory
+    engine.dispose()
+
+@pytest.fixture
+def dispatched(monkeypatch):
+    """记录重新投递的任务ID，不连接 broker"""
+    task_ids = []
+    monkeypatch.setattr(maintenance, "dispatch_task", lambda service, task_id, tier: task_ids.append(task_id))
+    return task_ids
+
+@pytest.fixture
+def make_task(session_factory):
+    db = session_factory()
+    user = User(username="alice", email="alice@example.com", hashed_password="x", credits=0)
+    service = Service(name="图片年龄变换", cost_credits=10, endpoint=ENDPOINT)
+    db.add_all([user, service])
+    db.commit()
+    user_id, service_id = user.id, service.id
+
+    def make(**values):
+        task = Task(user_id=user_id, service_id=service_id, input_data="{}", credits_used=10, **values)
+        db.add(task)
+        db.commit()
+        return task.id
+
+    yield make
+    db.close()
+
+def load(session_factory, task_id):
+    """重新读取任务及其用户的积分余额"""
+    db = session_factory()
+    try:
+        task = db.get(Task, task_id)
+        return task, db.get(User, task.user_id).credits
+    finally:
+        db.close()
+
+def test_expired_lease_is_requeued(session_factory, dispatched, make_task):
+    now = utcnow()
+    task_id = make_task(
+        status=TaskStatus.PROCESSING, started_at=now - timedelta(minutes=5),
+        lease_owner="worker", lease_expires_at=now - timedelta(seconds=1),
+    )
+
+    maintenance.reclaim_stale_tasks()
+
+    task, _ = load(session_factory, task_id)
+    assert task.status == TaskStatus.PENDING
+    assert task.lease_owner is None
+    assert task.retry_count == 1
+    assert dispatched == [task_id]
+
+def test_expired_lease_fails_after_max_retries(session_factory, dispatched, make_task):
+    now = utcnow()
+    task_id = make_task(
+        status=TaskStatus.PROCESSING, started_at=now - timedelta(minutes=5), retry_count=settings.task_max_retries,
+        lease_owner="worker", lease_expires_at=now - timedelta(seconds=1),
+    )
+
+    maintenance.reclaim_stale_tasks()
+
+    task, credits = load(session_factory, task_id)
+    assert task.status == TaskStatus.FAILED
+    assert credits == 10
+    assert dispatched == []
+
+def test_live_lease_is_left_alone(session_factory, dispatched, make_task):
+    now = utcnow()
+    task_id = make_task(
+        status=TaskStatus.PROCESSING, started_at=now,
+        lease_owner="worker", lease_expires_at=now + timedelta(seconds=30),
+    )
+
+    maintenance.reclaim_stale_tasks()
+
+    task, _ = load(session_factory, task_id)
+    assert task.status == TaskStatus.PROCESSING
+    assert task.lease_owner == "worker"
+    assert dispatched == []
+
+def test_lost_pending_task_is_redispatched(session_factory, dispatched, make_task):
+    now = utcnow()
+    stale_id = make_task(
+        status=TaskStatus.PENDING, enqueued_at=now - timedelta(seconds=settings.task_pending_redispatch_seconds + 1)
+    )
+    recent_id = make_task(status=TaskStatus.PENDING, enqueued_at=now)
+    never_dispatched_id = make_task(status=TaskStatus.PENDING)
+
+    maintenance.reclaim_stale_tasks()
+
+    assert dispatched == [stale_id]
+    task, _ = load(session_factory, stale_id)
+    assert task.status == TaskStatus.PENDING
+    assert task.enqueued_at.replace(tzinfo=None) >= now.replace(tzinfo=None) - timedelta(seconds=1)
+    assert load(session_factory, recent_id)[0].status == TaskStatus.PENDING
+    assert load(session_factory, never_dispatched_id)[0].enqueued_at is None
+
+    # 刚重新投递的任务不会在下一次回收时再次投递
+    maintenance.reclaim_stale_tasks()
+    assert dispatched == [stale_id]
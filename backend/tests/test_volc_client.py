@@ -0,0 +1,57 @@
+import socket
+import pytest
+from config import settings
+from tasks import volc_client
+
+FORM = {"req_key": "all_age_generation", "target_age": 5, "binary_data_base64": [""]}
+
+@pytest.fixture
+def volc_settings(monkeypatch):
+    monkeypatch.setattr(settings, "volc_access_key", "test")
+    monkeypatch.setattr(settings, "volc_secret_key", "test")
+    monkeypatch.setattr(settings, "volc_scheme", "http")
+    monkeypatch.setattr(settings, "volc_connect_timeout", 1)
+    monkeypatch.setattr(settings, "volc_rate_limit_enabled", False)
+    # 测试结束时由 monkeypatch 还原 _client（FailingClient 没有 session，不能调用 close_volc_client）
+    monkeypatch.setattr(volc_client, "_client", None)
+
+@pytest.fixture
+def refused_host():
+    """一个没有进程监听的本地端口"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    return f"127.0.0.1:{port}"
+
+def test_refused_connection_is_transient(monkeypatch, volc_settings, refused_host):
+    monkeypatch.setattr(settings, "volc_host", refused_host)
+    try:
+        with pytest.raises(volc_client.ProviderTransientError):
+            volc_client.cv_process(FORM)
+    finally:
+        volc_client.close_volc_client()
+
+class FailingClient:
+    """按 SDK 的方式把错误重新抛出为 Exception(str(e))"""
+
+    def __init__(self, error: Exception):
+        self.error = error
+
+    def cv_process(self, form):
+        try:
+            raise self.error
+        except Exception as e:
+            raise Exception(str(e))
+
+def test_transient_error_code_is_transient(monkeypatch, volc_settings):
+    error = Exception('{"code": 50429, "message": "Request Has Reached API Limit"}')
+    monkeypatch.setattr(volc_client, "_client", FailingClient(error))
+    with pytest.raises(volc_client.ProviderTransientError):
+        volc_client.cv_process(FORM)
+
+def test_other_errors_are_not_transient(monkeypatch, volc_settings):
+    error = Exception('{"code": 50207, "message": "Image Size Exceeded"}')
+    monkeypatch.setattr(volc_client, "_client", FailingClient(error))
+    with pytest.raises(Exception) as info:
+        volc_client.cv_process(FORM)
+    assert not isinstance(info.value, volc_client.ProviderTransientError)
@@ -0,0 +1,35 @@
+import enum
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from config import settings
+from models import Payment, PaymentStatus
+
+class UserTier(str, enum.Enum):
+    """用户等级（由支付记录推导，决定任务进入的优先级队列）"""
+    FREE = "free"
+    PAID = "paid"
+    ENTERPRISE = "enterprise"
+
+def tier_for_payment(max_amount) -> UserTier:
+    """根据单笔最大成功支付金额确定用户等级"""
+    if max_amount is None:
+        return UserTier.FREE
+    if max_amount >= settings.tier_enterprise_min_payment:
+        return UserTier.ENTERPRISE
+    return UserTier.PAID
+
+def _max_payment_query(user_id: int):
+    return select(func.max(Payment.amount)).where(
+        Payment.user_id == user_id,
+        Payment.status == PaymentStatus.SUCCESS
+    )
+
+async def get_user_tier(db: AsyncSession, user_id: int) -> UserTier:
+    """查询用户等级：购买过企业套餐（或等额充值）为企业用户，有过成功支付为付费用户"""
+    result = await db.execute(_max_payment_query(user_id))
+    return tier_for_payment(result.scalar_one_or_none())
+
+def get_user_tier_sync(db: Session, user_id: int) -> UserTier:
+    """同 get_user_tier（Celery worker 使用）"""
+    return tier_for_payment(db.execute(_max_payment_query(user_id)).scalar_one_or_none())
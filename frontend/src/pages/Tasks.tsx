@@ -21,6 +21,26 @@ const Tasks: React.FC = () => {
     fetchTasks();
   }, []);
 
+  // 订阅任务状态推送，替代轮询
+  useEffect(() => {
+    const unsubscribe = taskService.subscribeTaskEvents((event) => {
+      setTasks((prev) =>
+        prev.map((task) =>
+          String(task.id) === String(event.task_id)
+            ? {
+                ...task,
+                status: event.status,
+                error_message: event.error_message ?? task.error_message,
+                started_at: event.started_at ?? task.started_at,
+                completed_at: event.completed_at ?? task.completed_at,
+              }
+            : task
+        )
+      );
+    });
+    return unsubscribe;
+  }, []);
+
   const fetchTasks = async () => {
     setLoading(true);
     try {
@@ -157,16 +177,17 @@ const Tasks: React.FC = () => {
               ? JSON.parse(record.result_data) 
               : record.result_data;
             
-            if (record.service_name === '图片年龄变换' && resultData.output_image_url) {
+            const imageUrl = resultData.result_image_url || resultData.output_image_url;
+            if (record.service_name === '图片年龄变换' && imageUrl) {
               return (
                 <Image
-                  src={resultData.output_image_url}
+                  src={resultData.result_thumbnail_url || imageUrl}
                   alt="结果预览"
                   width={50}
                   height={50}
                   style={{ objectFit: 'cover', borderRadius: 4 }}
                   preview={{
-                    src: resultData.output_image_url,
+                    src: imageUrl,
                   }}
                 />
               );
@@ -19,17 +19,49 @@ export interface Task {
   service?: Service;
 }
 
+export interface TaskEvent {
+  task_id: number;
+  status: TaskStatus;
+  error_message?: string | null;
+  started_at?: string | null;
+  completed_at?: string | null;
+}
+
 export interface ImageAgeTransformResponse {
   task_id: number;
   message: string;
 }
 
+export interface ImageAgeTransformBatchResponse {
+  batch_id: number;
+  task_ids: number[];
+  total_tasks: number;
+  cached_tasks: number;
+  credits_used: number;
+  message: string;
+}
+
+export interface TaskBatch {
+  id: number;
+  service_id: number;
+  total_tasks: number;
+  credits_used: number;
+  created_at: string;
+  pending: number;
+  processing: number;
+  completed: number;
+  failed: number;
+  progress: number;
+}
+
 export const taskService = {
   // 获取用户任务列表
+  // 下一页游标由响应头 x-next-cursor 返回
   getTasks: async (params?: {
     status?: TaskStatus;
     limit?: number;
-    offset?: number;
+    cursor?: string;
+    batch_id?: number;
   }) => {
     const response = await api.get('/tasks/', { params });
     return response;
@@ -58,10 +90,50 @@ export const taskService = {
     return response.data;
   },
 
+  // 批量创建图片年龄变换任务（多张图片和/或一个 zip 压缩包）
+  createImageAgeTransformBatch: async (
+    images: File[],
+    targetAge: number,
+    archive?: File
+  ): Promise<ImageAgeTransformBatchResponse> => {
+    const formData = new FormData();
+    images.forEach((image) => formData.append('images', image));
+    if (archive) {
+      formData.append('archive', archive);
+    }
+    formData.append('target_age', targetAge.toString());
+
+    const response = await api.post('/tasks/image-age-transform/batch', formData, {
+      headers: {
+        'Content-Type': 'multipart/form-data',
+      },
+    });
+    return response.data;
+  },
+
+  // 获取批次进度
+  getTaskBatch: async (batchId: number): Promise<TaskBatch> => {
+    const response = await api.get(`/tasks/batches/${batchId}`);
+    return response.data;
+  },
+
   // 删除任务
   deleteTask: async (id: string): Promise<void> => {
     await api.delete(`/tasks/${id}`);
   },
+
+  // 订阅任务状态变更（SSE），返回取消订阅函数
+  subscribeTaskEvents: (onEvent: (event: TaskEvent) => void): (() => void) => {
+    const token = localStorage.getItem('token');
+    if (!token) {
+      return () => {};
+    }
+    const source = new EventSource(`/api/tasks/events?token=${encodeURIComponent(token)}`);
+    source.addEventListener('task', (e) => {
+      onEvent(JSON.parse((e as MessageEvent).data));
+    });
+    return () => source.close();
+  },
 };
 
 export const tasksService = taskService;
\ No newline at end of file